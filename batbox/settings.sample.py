@@ -49,10 +49,37 @@ DATABASES = {
     }
 }
 
+# Rendered pages are cached here. Both the web server and the import commands must use the same
+# cache, so that imports can render pages ahead of the first visit
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'data', 'cache'),
+    }
+}
+
+# Map tiles of recording density are kept here, until recordings next change. The web server
+# must be able to write here, as must the rendertiles command
+TILE_CACHE_DIR = os.path.join(BASE_DIR, 'data', 'tiles')
+
+# Spectrograms are drawn in-process with 'numpy', or by running SoX with 'sox'.
+# The numpy engine only handles uncompressed WAV files, and uses SoX for anything else.
+SPECTROGRAM_ENGINE = 'numpy'
+
+# Subsampled playback files are likewise made in-process with 'numpy', or by SoX with 'sox'
+SUBSAMPLE_ENGINE = 'numpy'
+
+# SoX effects applied before plotting. The numpy engine uses the rate, highpass and lowpass
+# frequencies from this list to limit the frequency range and band shown
 SPECTROGRAM_PREFILTER = ['rate', '200k', 'highpass', '25k', 'lowpass', '75k', ]
 
+# Drawn on the image by SoX; stored as a PNG text comment by the numpy engine
 SPECTROGRAM_CREDIT = 'Created by SoX'
 
+# Species names are cached in memory by each process, and reloaded after this many seconds to
+# pick up changes made by other processes
+SPECIES_INDEX_TTL = 300
+
 #########################################################
 # Options below this point won't usually need changing
 #########################################################
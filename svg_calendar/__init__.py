@@ -1 +1,2 @@
-from .daily_grid import GridImage  # noqa F401
+from .daily_grid import COLOR_HIGH, COLOR_LOW, GridImage  # noqa F401
+from .fast_grid import DayLink, DayRect, FastGridImage  # noqa F401
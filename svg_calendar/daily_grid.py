@@ -1,6 +1,6 @@
 from datetime import date, timedelta
 from math import ceil
-from typing import Callable, Tuple
+from typing import Callable, List, Optional, Tuple
 
 from dateutil.parser import parse as parse_date
 from svgwrite import Drawing, base, shapes
@@ -12,6 +12,8 @@ GRID_SQUARE = 10
 GRID_BORDERS = {'top': 24, 'left': 52, 'bottom': 16, 'right': 10}
 LEGEND_GRID = {'height': 50, 'left': 480, 'pitch': 32, 'cell_height': 22, 'cell_width': 28}
 
+MONTH_INITIALS = 'JFMAMJJASOND'
+
 COLOR_LOW = (0xff, 0xff, 0xaa)
 COLOR_HIGH = (0xaa, 0x22, 0x00)
 
@@ -161,52 +163,73 @@ class GridImage:
         return day_square
 
     def draw_year_labels(self, image, year, year_top):
-        months = 'JFMAMJJASOND'
+        for text, insert, class_ in self.year_labels(year, year_top):
+            image.add(image.text(text, insert=insert, class_=class_))
+        return MONTH_INITIALS
+
+    def year_labels(self, year, year_top) -> List[Tuple[str, tuple, str]]:
+        """
+        Labels for a year's grid: the year, the first and last days of the week, and month
+        initials in line with the first day of each month
+
+        Args:
+            year:
+            year_top:
+
+        Returns:
+            list of (text, x,y position, class)
+        """
         text_vrt_offset = 9
-        image.add(
-            image.text(
+        labels = [
+            (
                 '%d' % year,
-                insert=(self.grid_borders['left'] - 8,
-                        year_top + self.grid_borders[
-                            'top'] + text_vrt_offset - self.grid_pitch - 2),
-                class_='year'
-            )
-        )
-        image.add(
-            image.text(
+                (self.grid_borders['left'] - 8,
+                 year_top + self.grid_borders['top'] + text_vrt_offset - self.grid_pitch - 2),
+                'year'
+            ),
+            (
                 'Mo',
-                insert=(self.grid_borders['left'] - 8,
-                        year_top + self.grid_borders['top'] + text_vrt_offset),
-                class_='day'
-            )
-        )
-        image.add(
-            image.text(
+                (self.grid_borders['left'] - 8,
+                 year_top + self.grid_borders['top'] + text_vrt_offset),
+                'day'
+            ),
+            (
                 'Su',
-                insert=(self.grid_borders['left'] - 8,
-                        year_top + self.grid_borders[
-                            'top'] + text_vrt_offset + 6 * self.grid_pitch),
-                class_='day'
-            )
-        )
-        # Draw month initials in line with first day of month
-        for month_index, month in enumerate(months):
+                (self.grid_borders['left'] - 8,
+                 year_top + self.grid_borders['top'] + text_vrt_offset + 6 * self.grid_pitch),
+                'day'
+            ),
+        ]
+        for month_index, month in enumerate(MONTH_INITIALS):
             start_location = self.month_start_location(month_index + 1, year, year_top)
-
-            image.add(
-                image.text(
-                    month,
-                    insert=(
-                        self.offset_point(start_location,
-                                          (self.grid_pitch + (self.grid_square / 2), 0))[0],
-                        year_top + self.grid_borders['top'] + text_vrt_offset - self.grid_pitch - 2
-                    ),
-                    class_='month'
-                )
-            )
-        return months
+            labels.append((
+                month,
+                (
+                    self.offset_point(start_location,
+                                      (self.grid_pitch + (self.grid_square / 2), 0))[0],
+                    year_top + self.grid_borders['top'] + text_vrt_offset - self.grid_pitch - 2
+                ),
+                'month'
+            ))
+        return labels
 
     def draw_month_boundary(self, image, month_number, year, year_top):
+        points = self.month_boundary_points(month_number, year, year_top)
+        if points is not None:
+            image.add(image.polyline(points, fill='#f4f4f4' if month_number % 2 else '#fff'))
+
+    def month_boundary_points(self, month_number, year, year_top) -> Optional[List[tuple]]:
+        """
+        Outline of a month's squares, or None for months that haven't started yet
+
+        Args:
+            month_number:
+            year:
+            year_top:
+
+        Returns:
+            list of x,y points
+        """
         start_location = self.month_start_location(month_number, year, year_top)
         end_location = self.offset_point(self.month_end_location(month_number, year, year_top),
                                          (0, self.grid_pitch))
@@ -240,7 +263,8 @@ class GridImage:
                     self.grid_square_top(1, year_top) - half_pitch
                 ),
             ]
-            image.add(image.polyline(points, fill='#f4f4f4' if month_number % 2 else '#fff'))
+            return points
+        return None
 
     def month_start_location(self, month, year, y_offset):
         """
@@ -319,9 +343,6 @@ class GridImage:
 
     def draw_legend(self, image: Drawing, legend_title: str, top: int, range_max: float,
                     range_min: int = 0):
-        # Generate up to 5 integer steps
-        step = int(ceil((range_max - range_min) / 5))
-
         image.add(
             image.text(
                 legend_title,
@@ -329,11 +350,7 @@ class GridImage:
                 class_='legend_title'
             )
         )
-        steps = list(range(range_min, int(range_max + 1), step))
-        if max(steps) != int(range_max):
-            steps.append(int(range_max))
-
-        for offset, marker in enumerate(steps):
+        for offset, marker in enumerate(self.legend_steps(range_max, range_min)):
             left = self.legend_grid['left'] + offset * self.legend_grid['pitch']
             image.add(
                 image.rect(
@@ -352,6 +369,24 @@ class GridImage:
                 )
             )
 
+    @staticmethod
+    def legend_steps(range_max: float, range_min: int = 0) -> List[int]:
+        """
+        Values shown in the legend: up to 5 integer steps, and the maximum
+
+        Args:
+            range_max:
+            range_min:
+
+        Returns:
+            list of values
+        """
+        step = int(ceil((range_max - range_min) / 5))
+        steps = list(range(range_min, int(range_max + 1), step))
+        if max(steps) != int(range_max):
+            steps.append(int(range_max))
+        return steps
+
     @staticmethod
     def init_image(width: int, height: int) -> Drawing:
         image = Drawing(size=('%dpx' % width, '%dpx' % height))
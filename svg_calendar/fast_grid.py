@@ -0,0 +1,450 @@
+from calendar import month_abbr
+from datetime import date, timedelta
+from math import ceil
+from typing import (Callable, Collection, Dict, Hashable, Iterator, List,
+                    NamedTuple, Optional, Tuple, Union)
+
+from svgwrite import shapes
+
+from .daily_grid import CSS, GridImage
+
+
+SVG_ATTRIBUTES = {
+    'baseProfile': 'full',
+    'version': '1.1',
+    'xmlns': 'http://www.w3.org/2000/svg',
+    'xmlns:ev': 'http://www.w3.org/2001/xml-events',
+    'xmlns:xlink': 'http://www.w3.org/1999/xlink',
+}
+
+
+def escape_text(text: str) -> str:
+    """
+    Escape text for SVG markup. Most text needs no escaping, which is quicker to check for than
+    to attempt
+    """
+    if '&' in text or '<' in text or '>' in text:
+        text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    return text
+
+
+def escape_attribute(value: str) -> str:
+    """
+    Escape an attribute value for SVG markup
+    """
+    value = escape_text(value)
+    if '"' in value or '\n' in value:
+        value = value.replace('"', '&quot;').replace('\n', '&#10;')
+    return value
+
+
+def element(tag: str, attributes: dict, content: Optional[str] = None) -> str:
+    """
+    Markup for an SVG element, with attributes in the same order as svgwrite
+
+    Args:
+        tag: Element name
+        attributes: Map of attribute name to value
+        content: Markup inside the element, if any
+
+    Returns:
+        SVG markup
+    """
+    attribute_markup = ''.join(
+        f' {name}="{escape_attribute(value) if isinstance(value, str) else value}"'
+        for name, value in sorted(attributes.items())
+    )
+    if not content:
+        return f'<{tag}{attribute_markup} />'
+    return f'<{tag}{attribute_markup}>{content}</{tag}>'
+
+
+def parse_daily_count(daily_count: Dict[str, float]) -> List[Tuple[date, float]]:
+    """
+    Convert a map of ISO date to count into a list of (date, count)
+    """
+    return [(date.fromisoformat(d), quantity) for d, quantity in daily_count.items()]
+
+
+class CalendarLayout(NamedTuple):
+    """
+    Geometry of a calendar covering a range of years, shared by all images drawn over it
+    """
+    width: int
+    height: int
+    year_markup: str  # Labels and month outlines for every year
+    square_positions: Dict[int, List[Tuple[int, int]]]  # See FastGridImage.square_positions
+
+
+class DayRect:
+    """
+    A day's square, which decorators can update like the svgwrite element used by GridImage
+    """
+    __slots__ = ('attributes', 'title')
+
+    def __init__(self, attributes: dict, title: Optional[str] = None):
+        self.attributes = attributes
+        self.title = title
+
+    def update(self, attributes: dict):
+        # As svgwrite, a trailing underscore allows names such as class_
+        for name, value in attributes.items():
+            self.attributes[name.rstrip('_')] = value
+
+    def tostring(self) -> str:
+        content = None if self.title is None else f'<title>{escape_text(self.title)}</title>'
+        return element('rect', self.attributes, content)
+
+
+class DayLink:
+    """
+    A link around a day's square, for decorators, as the svgwrite Hyperlink used with GridImage
+    """
+    __slots__ = ('attributes', 'elements')
+
+    def __init__(self, href: str, target: str = '_blank'):
+        self.attributes = {'xlink:href': href, 'target': target}
+        self.elements: List[Union[DayRect, 'DayLink']] = []
+
+    def add(self, child: Union[DayRect, 'DayLink']) -> Union[DayRect, 'DayLink']:
+        self.elements.append(child)
+        return child
+
+    def tostring(self) -> str:
+        return element('a', self.attributes, ''.join(e.tostring() for e in self.elements))
+
+
+# Anything a decorator may return in place of a day's square
+DayElement = Union[DayRect, DayLink]
+
+
+class FastGridImage(GridImage):
+    """
+    Draws the same calendar as GridImage, building the SVG as text rather than as svgwrite
+    elements. Layout is worked out once per year, and days are looked up in it, so large
+    calendars render in a few milliseconds
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.day_markup_decorator = None
+
+    def set_day_markup_decorator(
+            self,
+            decorator: Callable[[DayRect, date, float], DayElement]
+    ):
+        """
+        Set a function to adapt each day's square, as GridImage.set_day_rect_decorator, but
+        without building svgwrite elements. It's given a DayRect, which it may update, and
+        returns the element to draw in its place: the DayRect itself, or a DayLink containing
+        it. Attribute values and titles are escaped when the element is drawn.
+
+        A decorator set with set_day_rect_decorator is also applied, to an svgwrite Rect as
+        GridImage does, but that is slower
+
+        Args:
+            decorator:
+
+        Returns:
+            self
+        """
+        self.day_markup_decorator = decorator
+        return self
+
+    def render_daily_count_image(self, daily_count: Dict[str, float], show_legend: bool = False,
+                                 legend_title: str = '', range_min=0) -> str:
+        """
+        As GridImage.draw_daily_count_image, but returning SVG markup
+
+        Args:
+            daily_count: Map of ISO date (YYYY-MM-DD) to numeric count
+            show_legend:
+            legend_title:
+            range_min: Value from which to graduate colors, if non-zero
+
+        Returns:
+            SVG document
+        """
+        return ''.join(
+            self.iter_daily_count_image(daily_count, show_legend, legend_title, range_min)
+        )
+
+    def iter_daily_count_image(self, daily_count: Dict[str, float], show_legend: bool = False,
+                               legend_title: str = '', range_min=0) -> Iterator[str]:
+        """
+        Generate the SVG markup of render_daily_count_image in pieces, eg to stream a response
+
+        Args:
+            daily_count: Map of ISO date (YYYY-MM-DD) to numeric count
+            show_legend:
+            legend_title:
+            range_min: Value from which to graduate colors, if non-zero
+
+        Returns:
+            Iterator of SVG markup
+        """
+        days = parse_daily_count(daily_count)
+        # Without any days, draw this year's calendar, empty
+        years = {day_date.year for day_date, _ in days} or {date.today().year}
+        layout = self.layout(years, show_legend)
+        max_daily = max(
+            ceil(max((quantity for _, quantity in days if quantity is not None), default=0)),
+            range_min + 1
+        )
+
+        yield self.image_header(layout.width, layout.height)
+        yield layout.year_markup
+        yield from self.iter_day_squares(days, layout, max_daily, range_min, {})
+
+        if show_legend:
+            top = layout.height - self.legend_grid['height']
+            yield ''.join(self.legend_markup(legend_title, top, max_daily, range_min))
+
+        yield '</svg>'
+
+    def render_daily_count_images(self, series: Dict[Hashable, Dict[str, float]],
+                                  range_min=0) -> Dict[Hashable, str]:
+        """
+        Render a calendar for each of several series of daily counts, eg one per species, to
+        show together. All cover the same years and share a colour scale, so that they can be
+        compared, and the layout and colours are only worked out once for all of them. They
+        scale to fit their container, and have no legend; see render_legend
+
+        Args:
+            series: Map of series key to map of ISO date (YYYY-MM-DD) to numeric count
+            range_min: Value from which to graduate colors, if non-zero
+
+        Returns:
+            Map of series key to SVG document, in the order of series
+        """
+        parsed = {key: parse_daily_count(daily_count) for key, daily_count in series.items()}
+        parsed = {key: days for key, days in parsed.items() if days}
+        if not parsed:
+            return {}
+
+        layout = self.layout(
+            {day_date.year for days in parsed.values() for day_date, _ in days}, False
+        )
+        max_daily = self.series_max(series, range_min)
+        colors: Dict[float, str] = {}
+        header = self.image_header(layout.width, layout.height, scalable=True)
+
+        return {
+            key: ''.join([
+                header,
+                layout.year_markup,
+                *self.iter_day_squares(days, layout, max_daily, range_min, colors),
+                '</svg>'
+            ])
+            for key, days in parsed.items()
+        }
+
+    def render_legend(self, range_max: float, legend_title: str = '', range_min=0) -> str:
+        """
+        Render a legend on its own, eg for images from render_daily_count_images
+
+        Args:
+            range_max: Top of the colour scale, as from series_max
+            legend_title:
+            range_min: Value from which colors are graduated, if non-zero
+
+        Returns:
+            SVG document
+        """
+        width, _ = self.grid_size(7, 54)
+        height = self.legend_grid['height']
+        return ''.join([
+            self.image_header(width, height, scalable=True),
+            *self.legend_markup(legend_title, 0, range_max, range_min),
+            '</svg>'
+        ])
+
+    @staticmethod
+    def series_max(series: Dict[Hashable, Dict[str, float]], range_min=0) -> int:
+        """
+        Top of the colour scale shared by several series: the highest count in any of them,
+        rounded up, but always above the bottom of the scale
+        """
+        highest = max(
+            (quantity for daily_count in series.values() for quantity in daily_count.values()
+             if quantity is not None),
+            default=0
+        )
+        return max(ceil(highest), range_min + 1)
+
+    def layout(self, years: Collection[int], show_legend: bool) -> CalendarLayout:
+        """
+        Work out the size of a calendar, its labels and month outlines, and where each day goes
+        Args:
+            years: Years with counts; any years between them are also included
+            show_legend: Whether to leave room for the legend
+
+        Returns:
+            CalendarLayout
+        """
+        min_year = min(years)
+        years = range(min_year, max(years) + 1)  # Ensure there are no gaps
+        width, height_per_year = self.grid_size(7, 54)  # 52 weeks + ISO weeks 0, 53
+        image_height = height_per_year * len(years) + (
+            self.legend_grid['height'] if show_legend else 0
+        )
+
+        year_markup = []
+        square_positions = {}
+        for year in years:
+            year_top = height_per_year * (year - min_year)
+            year_markup.extend(self.year_markup(year, year_top))
+            square_positions[year] = self.square_positions(year, year_top)
+
+        return CalendarLayout(width, image_height, ''.join(year_markup), square_positions)
+
+    def iter_day_squares(self, days: List[Tuple[date, float]], layout: CalendarLayout,
+                         max_daily: float, range_min, colors: Dict[float, str]) -> Iterator[str]:
+        """
+        Generate the markup for each day's square, decorated if a decorator is set
+
+        Args:
+            days: List of (date, count)
+            layout: Layout of the calendar
+            max_daily: Count at the top of the colour scale
+            range_min: Count at the bottom of the colour scale
+            colors: Fill colours already worked out for counts, which is added to
+
+        Returns:
+            Iterator of SVG markup
+        """
+        months = list(month_abbr)
+        for day_date, daily_quantity in days:
+            if daily_quantity is None:
+                color = '#e0e0e0'
+            else:
+                color = colors.get(daily_quantity)
+                if color is None:
+                    color = colors[daily_quantity] = self.fractional_fill_color(
+                        (daily_quantity - range_min) / (max_daily - range_min))
+
+            left, top = layout.square_positions[day_date.year][day_date.timetuple().tm_yday - 1]
+            amount_string = round(daily_quantity, 1) if daily_quantity else '?'
+            rect = DayRect(
+                {
+                    'fill': color,
+                    'height': self.grid_square,
+                    'width': self.grid_square,
+                    'x': left,
+                    'y': top,
+                },
+                f'{months[day_date.month]} {day_date.day}: {amount_string}'
+            )
+
+            if self.day_markup_decorator is not None:
+                yield self.day_markup_decorator(rect, day_date, daily_quantity).tostring()
+            elif self.day_rect_decorator is not None:
+                yield self.decorate_svgwrite_rect(rect, day_date, daily_quantity)
+            else:
+                yield rect.tostring()
+
+    def decorate_svgwrite_rect(self, rect: DayRect, day_date: date, daily_quantity: float) -> str:
+        """
+        Apply a decorator set with set_day_rect_decorator, which takes and returns svgwrite
+        elements, to a day's square
+
+        Args:
+            rect: The day's square
+            day_date:
+            daily_quantity:
+
+        Returns:
+            SVG markup
+        """
+        attributes = rect.attributes
+        svg_rect = shapes.Rect(
+            insert=(attributes['x'], attributes['y']),
+            size=(attributes['width'], attributes['height']),
+            fill=attributes['fill']
+        )
+        svg_rect.set_desc(title=rect.title)
+        return self.day_rect_decorator(svg_rect, day_date, daily_quantity).tostring()
+
+    def square_positions(self, year: int, year_top: int) -> List[Tuple[int, int]]:
+        """
+        Top-left positions of the squares for every day of a year
+
+        Args:
+            year:
+            year_top: Offset of the year's grid from the top of the image
+
+        Returns:
+            list of x,y positions, indexed by day of the year from 0
+        """
+        positions = []
+        day_date = date(year, 1, 1)
+        one_day = timedelta(days=1)
+        while day_date.year == year:
+            _, week, day = self.isocalendar_natural(day_date)
+            positions.append((self.grid_square_left(week), self.grid_square_top(day, year_top)))
+            day_date += one_day
+        return positions
+
+    def year_markup(self, year: int, year_top: int) -> Iterator[str]:
+        """
+        Labels and month outlines for a year, as drawn by GridImage
+        """
+        for text, (x, y), class_ in self.year_labels(year, year_top):
+            yield element('text', {'class': class_, 'x': x, 'y': y}, escape_text(text))
+
+        for month_number in range(1, 13):
+            points = self.month_boundary_points(month_number, year, year_top)
+            if points is not None:
+                yield element('polyline', {
+                    'fill': '#f4f4f4' if month_number % 2 else '#fff',
+                    'points': ' '.join(f'{x},{y}' for x, y in points),
+                })
+
+    def legend_markup(self, legend_title: str, top: int, range_max: float,
+                      range_min: int = 0) -> Iterator[str]:
+        """
+        The legend, as drawn by GridImage.draw_legend
+        """
+        text_top = top + 3 * self.legend_grid['cell_height'] / 4
+        yield element(
+            'text',
+            {'class': 'legend_title', 'x': self.legend_grid['left'], 'y': text_top},
+            escape_text(legend_title)
+        )
+        for offset, marker in enumerate(self.legend_steps(range_max, range_min)):
+            left = self.legend_grid['left'] + offset * self.legend_grid['pitch']
+            yield element('rect', {
+                'fill': self.fractional_fill_color((marker - range_min) / (range_max - range_min)),
+                'height': self.legend_grid['cell_height'],
+                'width': self.legend_grid['cell_width'],
+                'x': left,
+                'y': top,
+            })
+            yield element(
+                'text',
+                {
+                    'class': 'key',
+                    'fill': '#ffffff' if marker > range_max / 2 else '#000000',
+                    'x': left + self.legend_grid['cell_width'] / 2,
+                    'y': text_top,
+                },
+                str(marker)
+            )
+
+    @staticmethod
+    def image_header(width: int, height: int, scalable: bool = False) -> str:
+        """
+        Opening tag, styles and background of the image, as GridImage.init_image; a scalable
+        image has a viewBox, so that it can be resized with CSS
+        """
+        attributes = dict(SVG_ATTRIBUTES, width='%dpx' % width, height='%dpx' % height)
+        if scalable:
+            attributes['viewBox'] = f'0 0 {width} {height}'
+        attribute_markup = ''.join(
+            f' {name}="{value}"' for name, value in sorted(attributes.items())
+        )
+        return (
+            f'<svg{attribute_markup}>'
+            f'<defs><style type="text/css"><![CDATA[{CSS}]]></style></defs>'
+            + element('rect', {'fill': 'white', 'height': height, 'width': width, 'x': 0, 'y': 0})
+        )
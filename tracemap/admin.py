@@ -4,7 +4,7 @@ Configuration of django admin interface
 from django.contrib import admin
 
 # Register your models here.
-from .models import AudioRecording, Species
+from .models import AudioRecording, MediaJob, Species
 
 
 class AudioRecordingAdmin(admin.ModelAdmin):
@@ -16,6 +16,7 @@ class AudioRecordingAdmin(admin.ModelAdmin):
         'processed',
         'recorded_at_iso',
         'duration',
+        'sample_rate',
         'latitude',
         'longitude',
         'genus',
@@ -25,6 +26,25 @@ class AudioRecordingAdmin(admin.ModelAdmin):
     )
 
 
+class MediaJobAdmin(admin.ModelAdmin):
+    """
+    Configuration of MediaJob management interface
+    """
+    list_display = (
+        'recording',
+        'kind',
+        'status',
+        'attempts',
+        'worker',
+        'started_at',
+        'finished_at',
+    )
+    list_filter = (
+        'kind',
+        'status',
+    )
+
+
 class SpeciesAdmin(admin.ModelAdmin):
     """
     Configuration of Species management interface
@@ -42,4 +62,5 @@ class SpeciesAdmin(admin.ModelAdmin):
 
 
 admin.site.register(AudioRecording, AudioRecordingAdmin)
+admin.site.register(MediaJob, MediaJobAdmin)
 admin.site.register(Species, SpeciesAdmin)
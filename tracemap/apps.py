@@ -7,3 +7,7 @@ from django.apps import AppConfig
 class TracemapConfig(AppConfig):
     """ Set module name"""
     name = 'tracemap'
+
+    def ready(self):
+        # Connect signal handlers
+        from . import signals  # noqa: F401 pylint: disable=C0415,W0611
@@ -1,5 +1,6 @@
 import csv
 
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
 
 from tracemap.models import Species
@@ -91,3 +92,6 @@ class Command(BaseCommand):
                         species_record.save()
 
         print(f'Read {i} rows, found {new} new bats')
+
+        # Recordings may now match different species
+        call_command('resolvespecies')
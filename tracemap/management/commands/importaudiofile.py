@@ -1,19 +1,26 @@
 import json
+import multiprocessing
 import os
-import subprocess
+import sys
+from collections import defaultdict
 from datetime import datetime
 from glob import glob
+from typing import Dict, List, Optional, Set, Tuple
 
 import audioread
-from dateutil import parser as date_parser
 from django.core.management.base import BaseCommand
+from django.db import connections, transaction
 from guano import GuanoFile
-from png import Reader
 
-from batbox import settings
+from tracemap import views
 from tracemap.filetools import TraceIdentifier
-from tracemap.models import AudioRecording
-from tracemap.repository import NonUniqueSpeciesLookup, SpeciesLookup
+from tracemap.media import DerivedMediaGenerator
+from tracemap.models import (QUERY_BATCH_SIZE, AudioRecording,
+                             DailySpeciesSummary, DataVersion,
+                             ImportManifestEntry, MediaJob, summary_day)
+from tracemap.repository import SpeciesLookup
+from tracemap.riff import RiffScan, scan_riff
+from tracemap.timing import ImportTimings
 from wamd import WamdFile
 
 
@@ -30,16 +37,76 @@ def populate_audio_identification(audio: AudioRecording, raw_ident: str):
     # Got values like 'No ID' here…
 
 
+# Fields that an import may change on an existing record
+IMPORTED_FIELDS = (
+    'identifier',
+    'subsampled_audio_file',
+    'spectrogram_image_file',
+    'spectrogram_image_width',
+    'spectrogram_image_height',
+    'processed',
+    'recorded_at_utc',
+    'recorded_at_iso',
+    'recorded_date',
+    'latitude',
+    'longitude',
+    'genus',
+    'species',
+    'recorder_serial',
+    'guano_data',
+    'duration',
+    'sample_rate',
+    'channels',
+    'bit_depth',
+    'resolved_species',
+    'species_ambiguous',
+)
+
+# Command instance used inside each pool worker process, see Command.process_files_in_pool
+_worker_command = None
+
+
+def _init_worker(options: dict):
+    global _worker_command  # pylint: disable=W0603
+    _worker_command = Command()
+    _worker_command.configure(options)
+
+
+def _analyse_in_worker(task):
+    # Errors are handed back as text, so that one bad file doesn't stop the pool
+    filename, audio = task
+    try:
+        _worker_command.analyse_file(filename, audio)
+        error = None
+    except Exception as e:  # pylint: disable=W0703
+        error = repr(e)
+    return filename, audio, _worker_command.timings.take_file(filename), error
+
+
 class Command(BaseCommand):
     help = 'Load audio files into database'
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.sox_executable = 'sox'
         self.force = False
         self.subsample = False
         self.spectrogram = False
+        self.jobs = 1
+        self.batch_size = 500
+        self.changed_only = False
+        self.new_recordings = []
+        self.updated_recordings = []
+        self.manifest_updates: Dict[str, ImportManifestEntry] = {}
+        # Days of the daily summary that the queued records move recordings into or out of
+        self.affected_days: Set[str] = set()
+        self.manifest: Optional[Dict[str, ImportManifestEntry]] = None
+        self.known_recordings: Optional[Dict[str, List[Tuple[int, bool]]]] = None
+        # Recordings saved so far, so that cached pages are only rendered again after changes
+        self.records_written = 0
+        self.queue_media = False
+        self.media = DerivedMediaGenerator()
         self.species_lookup = SpeciesLookup()
+        self.timings = ImportTimings()
 
     def add_arguments(self, parser):
         parser.add_argument('filename', type=str, help='Name of the file or directory to import')
@@ -53,29 +120,71 @@ class Command(BaseCommand):
         parser.add_argument(
             '-p', '--spectrogram', action='store_true', help='Generate spectrogram image files'
         )
+        parser.add_argument(
+            '-q', '--queue-media', action='store_true',
+            help='Queue subsampling and spectrogram generation for processmedia, instead of '
+                 'generating files during import. Queues both unless -u or -p is given'
+        )
         parser.add_argument(
             '-f', '--force', action='store_true', help='Process files even if already seen'
         )
+        parser.add_argument(
+            '-c', '--changed-only', action='store_true',
+            help='Only process files that are new or changed since they were last imported'
+        )
+        parser.add_argument(
+            '-j', '--jobs', type=int, default=1,
+            help='Number of worker processes to use for parsing and generating files'
+        )
+        parser.add_argument(
+            '-b', '--batch-size', type=int, default=500,
+            help='Number of records to write to the database in each transaction'
+        )
+        parser.add_argument(
+            '--report', type=str, default=None,
+            help='Write the time taken by each stage of the import to this JSON file'
+        )
+
+    def configure(self, options: dict):
+        self.force = options['force']
+        self.changed_only = options['changed_only']
+        self.subsample = options['subsample']
+        self.spectrogram = options['spectrogram']
+        self.queue_media = options['queue_media']
+        self.jobs = max(1, options['jobs'])
+        self.batch_size = max(1, options['batch_size'])
 
     def handle(self, *args, **kwargs):
         filename = kwargs['filename']
         recurse = kwargs['recursive']
-        self.force = kwargs['force']
-        self.subsample = kwargs['subsample']
-        self.spectrogram = kwargs['spectrogram']
+        self.configure(kwargs)
 
         if os.path.isfile(filename):
             self.process_file(filename)
+            self.flush_recordings()
         elif os.path.isdir(filename):
             if recurse:
                 target = filename + '/**/*.[wW][aA][vV]'
             else:
                 target = filename + '/*.[wW][aA][vV]'
 
-            files = glob(target, recursive=recurse)
-            for file in files:
-                print(file)
-                self.process_file(file)
+            with self.timings.stage('scan'):
+                files = glob(target, recursive=recurse)
+            if files:
+                with self.timings.stage('preload'):
+                    self.known_recordings = self.load_known_recordings()
+                    if self.changed_only:
+                        self.manifest = self.load_manifest()
+            if self.jobs > 1 and len(files) > 1:
+                self.process_files_in_pool(files, kwargs)
+            else:
+                for file in files:
+                    print(file)
+                    try:
+                        self.process_file(file)
+                    except Exception as e:  # pylint: disable=W0703
+                        self.report_failure(file, repr(e))
+            self.flush_recordings()
             if not files:
                 print('Found no files')
 
@@ -83,64 +192,329 @@ class Command(BaseCommand):
             print(f'{filename} not found')
             exit(1)
 
+        if self.records_written:
+            self.warm_caches()
+        self.timings.print_summary()
+        if kwargs['report']:
+            self.timings.write_report(kwargs['report'])
+
+    @staticmethod
+    def load_known_recordings() -> Dict[str, List[Tuple[int, bool]]]:
+        """
+        Index the id and processed flag of all existing recordings by audio file, in one query
+        """
+        known_recordings = defaultdict(list)
+        existing = AudioRecording.objects.order_by('id') \
+            .values_list('audio_file', 'id', 'processed')
+        for audio_file, record_id, processed in existing:
+            known_recordings[audio_file].append((record_id, processed))
+        return known_recordings
+
+    def find_known_recordings(self, filepath: str) -> List[Tuple[int, bool]]:
+        """
+        Get the id and processed flag of any existing recordings of a file
+        """
+        if self.known_recordings is not None:
+            return self.known_recordings.get(filepath, [])
+        existing = AudioRecording.objects.filter(audio_file=filepath).order_by('id')
+        return list(existing.values_list('id', 'processed'))
+
+    @staticmethod
+    def load_manifest() -> Dict[str, ImportManifestEntry]:
+        """
+        Load the import manifest, indexed by source file, in one query
+        """
+        return {entry.source_file: entry for entry in ImportManifestEntry.objects.all()}
+
+    def find_manifest_entry(self, filepath: str) -> Optional[ImportManifestEntry]:
+        """
+        Get the import manifest entry for a file, if it has one
+        """
+        if filepath in self.manifest_updates:
+            return self.manifest_updates[filepath]
+        if self.manifest is not None:
+            return self.manifest.get(filepath)
+        return ImportManifestEntry.objects.filter(source_file=filepath).first()
+
+    def file_is_unchanged(self, filepath: str) -> bool:
+        """
+        Check the import manifest to see whether a file has changed since it was last imported
+        """
+        entry = self.find_manifest_entry(filepath)
+        if entry is None:
+            return False
+        recorded_mtime = entry.mtime
+        if not entry.matches_file(filepath):
+            return False
+        if entry.mtime != recorded_mtime:
+            self.manifest_updates[filepath] = entry
+        return True
+
+    def record_file_state(self, filepath: str):
+        """
+        Queue an update to the import manifest with the current state of a file. If the manifest
+        isn't loaded, any existing entry for the file is found when the batch is written
+        """
+        entry = self.manifest_updates.get(filepath)
+        if entry is None and self.manifest is not None:
+            entry = self.manifest.get(filepath)
+        entry = entry or ImportManifestEntry()
+        entry.update_from_file(filepath)
+        self.manifest_updates[filepath] = entry
+
+    @staticmethod
+    def match_manifest_entries(entries: List[ImportManifestEntry]):
+        """
+        Give queued manifest entries the ids of any existing entries for the same files, so that
+        they are updated rather than duplicated, looking them up a batch at a time
+        """
+        for start in range(0, len(entries), QUERY_BATCH_SIZE):
+            batch = {entry.source_file: entry for entry in entries[start:start + QUERY_BATCH_SIZE]}
+            existing = ImportManifestEntry.objects.filter(source_file__in=batch) \
+                .values_list('source_file', 'id')
+            for source_file, entry_id in existing:
+                batch[source_file].id = entry_id
+
+    def process_files_in_pool(self, files: list, options: dict):
+        """
+        Parse files and generate derived media in a pool of worker processes.
+
+        Record lookups happen here first, and the workers hand back populated records so that
+        all database writes come from this process. Files that fail are reported and skipped.
+        """
+        tasks = []
+        for file in files:
+            try:
+                with self.timings.stage('lookup', file):
+                    audio = self.prepare_record(file)
+            except Exception as e:  # pylint: disable=W0703
+                self.report_failure(file, repr(e))
+                continue
+            if audio is None:
+                self.timings.finish_file(file, imported=False)
+            else:
+                tasks.append((file, audio))
+
+        # Workers are forked, so must not inherit our open database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with context.Pool(self.jobs, initializer=_init_worker, initargs=(options,)) as pool:
+            for file, audio, file_timings, error in pool.imap_unordered(_analyse_in_worker, tasks):
+                self.timings.add_file(file, file_timings)
+                if error is None:
+                    self.queue_recording(audio)
+                    self.timings.finish_file(file, imported=True)
+                else:
+                    self.report_failure(file, error)
+
+    def report_failure(self, filename: str, error: str):
+        """
+        Report a file that couldn't be imported, and count it as checked but not imported
+        """
+        print(f'Failed to import {filename}: {error}', file=sys.stderr)
+        self.timings.finish_file(filename, imported=False)
+
     def process_file(self, filename):
+        with self.timings.stage('lookup', filename):
+            audio = self.prepare_record(filename)
+        if audio is None:
+            self.timings.finish_file(filename, imported=False)
+            return
+
+        self.analyse_file(filename, audio)
+        self.queue_recording(audio)
+        self.timings.finish_file(filename, imported=True)
+
+    def queue_recording(self, audio: AudioRecording):
+        """
+        Add a record to the next batch of database writes, writing the batch if it's full
+        """
+        if audio.id:
+            self.updated_recordings.append(audio)
+        else:
+            self.new_recordings.append(audio)
+        self.affected_days.add(summary_day(audio.recorded_at_iso))
+        self.record_file_state(audio.audio_file)
+
+        if len(self.manifest_updates) >= self.batch_size:
+            self.flush_recordings()
+
+    def flush_recordings(self):
+        """
+        Write all queued records in a single transaction
+        """
+        if not (self.new_recordings or self.updated_recordings or self.manifest_updates):
+            return
+
+        print(
+            f'Saving {len(self.new_recordings)} new and '
+            f'{len(self.updated_recordings)} updated records'
+        )
+        with self.timings.stage('write'), transaction.atomic():
+            if self.manifest is None:
+                self.match_manifest_entries(
+                    [e for e in self.manifest_updates.values() if not e.id]
+                )
+            new_entries = [e for e in self.manifest_updates.values() if not e.id]
+            updated_entries = [e for e in self.manifest_updates.values() if e.id]
+            AudioRecording.objects.bulk_create(self.new_recordings)
+            AudioRecording.objects.bulk_update(self.updated_recordings, IMPORTED_FIELDS)
+            ImportManifestEntry.objects.bulk_create(new_entries)
+            ImportManifestEntry.objects.bulk_update(
+                updated_entries, ['size', 'mtime', 'header_hash', 'imported_at']
+            )
+            DailySpeciesSummary.refresh_days(self.affected_days)
+            DataVersion.bump()
+            if self.queue_media:
+                self.queue_media_jobs(self.new_recordings + self.updated_recordings)
+        self.records_written += len(self.new_recordings) + len(self.updated_recordings)
+        self.new_recordings = []
+        self.updated_recordings = []
+        self.manifest_updates = {}
+        self.affected_days = set()
+
+    @staticmethod
+    def warm_caches():
+        """
+        Render cached pages for the current data, so that the first visitor needn't wait
+        """
+        data_version = DataVersion.current()
+        views.render_calendar_page(data_version)
+        views.render_dashboard_page(data_version, 'species')
+
+    def queue_media_jobs(self, recordings: List[AudioRecording]):
+        """
+        Queue jobs to generate derived files for saved records, redoing any earlier jobs
+        """
+        kinds = []
+        if self.subsample or not self.spectrogram:
+            kinds.append(MediaJob.SUBSAMPLE)
+        if self.spectrogram or not self.subsample:
+            kinds.append(MediaJob.SPECTROGRAM)
+
+        # bulk_create doesn't set ids on SQLite, so look new records up by file
+        recording_ids = [r.id for r in recordings if r.id]
+        new_files = [r.audio_file for r in recordings if not r.id]
+        for start in range(0, len(new_files), QUERY_BATCH_SIZE):
+            recording_ids.extend(
+                AudioRecording.objects
+                .filter(audio_file__in=new_files[start:start + QUERY_BATCH_SIZE])
+                .values_list('id', flat=True)
+            )
+
+        MediaJob.enqueue(recording_ids, kinds, requeue=True)
+        print(f'Queued {len(kinds)} media job(s) for each of {len(recording_ids)} records')
+
+    def prepare_record(self, filename) -> Optional[AudioRecording]:
+        """
+        Find or create the record for a file, or None if it doesn't need processing
+        """
         filepath = os.path.realpath(filename)
         filestem = os.path.basename(filename).split('.')[0]
         print(f'Loading {filepath}')
 
-        existing_audio = AudioRecording.objects.filter(audio_file=filepath)
-        result_count = len(existing_audio)
+        if self.changed_only and self.file_is_unchanged(filepath):
+            print('Unchanged since last import, skipping')
+            return None
+
+        known_recordings = self.find_known_recordings(filepath)
+        result_count = len(known_recordings)
         if result_count:
             if result_count > 1:
                 print(f'Got duplicate records ({result_count}) for {filepath}')
-            audio = existing_audio[0]
+            record_id, processed = known_recordings[0]
+            if processed and not self.force:
+                if not self.changed_only:
+                    print("Already processed this file, skipping")
+                    return None
+                if self.find_manifest_entry(filepath) is None:
+                    print('Already processed this file, adding it to the import manifest')
+                    self.record_file_state(filepath)
+                    return None
+                print('File has changed since last import, trying to update')
+            else:
+                print('Found incomplete existing record, trying to update')
+            audio = AudioRecording.objects.get(id=record_id)
             audio.identifier = filestem
-            if audio.processed and not self.force:
-                print("Already processed this file, skipping")
-                return
-            print('Found incomplete existing record, trying to update')
+            # Re-reading the file may move the recording to another day
+            self.affected_days.add(summary_day(audio.recorded_at_iso))
         else:
             audio = AudioRecording(audio_file=filepath, identifier=filestem)
 
+        return audio
+
+    def analyse_file(self, filename, audio: AudioRecording) -> AudioRecording:
+        """
+        Read metadata and generate any requested files for a recording, without saving it
+        """
+        with self.timings.stage('parse', filename):
+            riff_scan = self.parse_file(filename, audio)
+            self.species_lookup.resolve_recording(audio)
+
+        if not audio.duration:
+            with self.timings.stage('duration', filename):
+                self.read_file_duration(filename, audio, riff_scan)
+
+        if self.queue_media:
+            return audio
+
+        # Both derived files are generated from the same mapping of the source samples
+        samples = None
+        if (self.subsample or self.spectrogram) and riff_scan is not None:
+            with self.timings.stage('parse', filename):
+                riff_scan, samples = self.media.read_samples(audio, riff_scan)
+
+        if self.subsample:
+            with self.timings.stage('subsample', filename):
+                self.media.subsample_file(audio, riff_scan, samples)
+
+        if self.spectrogram:
+            with self.timings.stage('spectrogram', filename):
+                self.media.generate_spectrogram_file(audio, riff_scan, samples)
+
+        return audio
+
+    def parse_file(self, filename, audio: AudioRecording) -> Optional[RiffScan]:
+        """
+        Populate a record from the file's name and metadata chunks
+
+        Returns:
+            Result of scanning the file's chunks, or None if it isn't a readable WAV file
+        """
+        filepath = audio.audio_file
         self.populate_audio_from_identifier(audio)
 
         try:
-            # print(f'Looking for GUANO data for {filename}')
-            guano_file = GuanoFile(filepath)
-            if not guano_file:
-                # print(f'Empty GUANO data for {filename}')
-                guano_file = None
+            riff_scan = scan_riff(filepath)
         except ValueError:
-            print(f'Unable to load GUANO data for {filename}')
-            guano_file = None
+            print(f'Unable to read RIFF chunks from {filename}')
+            riff_scan = None
 
-        wamd_file = None
-        if guano_file is not None:
-            self.populate_audio_from_guano(audio, guano_file)
-        else:
-            # print(f'Looking for WAMD data for {filename}')
+        guano_file = None
+        if riff_scan is not None and riff_scan.chunk(b'guan'):
             try:
-                wamd_file = WamdFile(filepath)
-                # print(f'Loaded WAMD data for {filename}')
+                guano_file = GuanoFile.from_string(riff_scan.chunk(b'guan'))
+                if not guano_file:
+                    # print(f'Empty GUANO data for {filename}')
+                    guano_file = None
             except ValueError:
-                print(f'Unable to load WAMD data for {filename}')
+                print(f'Unable to load GUANO data for {filename}')
 
-        if wamd_file is not None:
+        if guano_file is not None:
+            self.populate_audio_from_guano(audio, guano_file)
+        elif riff_scan is not None and riff_scan.chunk(b'wamd'):
             try:
+                wamd_file = WamdFile.from_chunk_data(filepath, riff_scan.chunk(b'wamd'))
                 self.populate_audio_from_wamd(audio, wamd_file)
             except ValueError:
                 print("Could not load fallback WAMD data")
+        else:
+            print(f'No GUANO or WAMD data found for {filename}')
 
-        if not audio.duration:
-            self.read_file_duration(filename, audio)
-
-        if self.subsample:
-            self.subsample_file(audio)
-
-        if self.spectrogram:
-            self.generate_spectrogram_file(audio)
+        if riff_scan is not None:
+            self.populate_audio_from_wave_format(audio, riff_scan)
 
-        audio.save()
+        return riff_scan
 
     @staticmethod
     def populate_audio_from_guano(audio: AudioRecording, guano_file: GuanoFile):
@@ -188,7 +562,20 @@ class Command(BaseCommand):
             audio.species = id_parser.species
 
     @staticmethod
-    def read_file_duration(filename, audio):
+    def populate_audio_from_wave_format(audio: AudioRecording, riff_scan: RiffScan):
+        wave_format = riff_scan.wave_format
+        if wave_format is not None:
+            audio.sample_rate = wave_format.sample_rate
+            audio.channels = wave_format.channels
+            audio.bit_depth = wave_format.bits_per_sample
+
+    @staticmethod
+    def read_file_duration(filename, audio, riff_scan: Optional[RiffScan] = None):
+        if riff_scan is not None and riff_scan.duration is not None:
+            audio.duration = riff_scan.duration
+            return
+
+        # Compressed or unreadable headers, so have audioread decode the file
         with audioread.audio_open(filename) as f:
             audio.duration = f.duration
 
@@ -206,58 +593,3 @@ class Command(BaseCommand):
 
         audio.guano_data = json.dumps({'Source': 'WAMD data'})
         audio.processed = True
-
-    def subsample_file(self, audio: AudioRecording):
-        if not audio.id:
-            audio.save()
-        dest = os.path.join(
-            settings.MEDIA_ROOT,
-            'processed',
-            'subsampled',
-            f'{audio.id}-{audio.identifier}.wav'
-        )
-        print(f'Subsample {audio.audio_file} to {dest}')
-        sox_result = subprocess.run([self.sox_executable, audio.audio_file, '-r44100', dest])
-        sox_result.check_returncode()
-        audio.subsampled_audio_file = dest
-
-    def generate_spectrogram_file(self, audio: AudioRecording):
-        prefilter = settings.SPECTROGRAM_PREFILTER
-        credit = settings.SPECTROGRAM_CREDIT
-
-        title = '(unknown) '
-
-        if audio.species:
-            title = f'{audio.genus} {audio.species} '
-            try:
-                species = self.species_lookup.species_by_abbreviations(audio.genus, audio.species)
-            except NonUniqueSpeciesLookup:
-                species = None
-
-            if species:
-                species_ucfirst = species.species[0].upper() + species.species[1:]
-                if species.common_name:
-                    title = f'{species.common_name} ({species.genus} {species_ucfirst}) '
-                else:
-                    title = f'{species.genus} {species_ucfirst} '
-
-        if audio.recorded_at_iso:
-            title += date_parser.parse(audio.recorded_at_iso).strftime('%Y-%m-%d %H:%M')
-
-        if not audio.id:
-            audio.save()
-        dest = os.path.join(settings.MEDIA_ROOT, 'processed', 'spectrograms',
-                            f'{audio.id}-{audio.identifier}.png')
-        print(f'Plot {audio.audio_file} spectrum to {dest}')
-        #     sox "$file" -n spectrogram -o "$outfile" -t "$ident"
-        sox_result = subprocess.run(
-            [self.sox_executable, audio.audio_file, '-n', ] +
-            prefilter +
-            ['spectrogram', '-o', dest, '-c', credit, '-t', title]
-        )
-        sox_result.check_returncode()
-        png_reader = Reader(filename=dest)
-        (width, height, _, _) = png_reader.read()
-        audio.spectrogram_image_file = dest
-        audio.spectrogram_image_width = width
-        audio.spectrogram_image_height = height
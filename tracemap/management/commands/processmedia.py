@@ -0,0 +1,248 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Exists, F, OuterRef, Q
+
+from tracemap.media import DerivedMediaGenerator
+from tracemap.models import AudioRecording, MediaJob
+
+
+# Recording fields that each kind of job fills in
+JOB_FIELDS = {
+    MediaJob.SUBSAMPLE: ['subsampled_audio_file'],
+    MediaJob.SPECTROGRAM: [
+        'spectrogram_image_file',
+        'spectrogram_image_width',
+        'spectrogram_image_height',
+    ],
+}
+
+# Number of pending jobs fetched at a time when looking for one to claim
+CLAIM_CANDIDATES = 10
+
+
+class JobTimeout(Exception):
+    """
+    Raised in a worker when a job has run for too long
+    """
+
+
+def _raise_timeout(signum, frame):  # pylint: disable=W0613
+    raise JobTimeout()
+
+
+class Command(BaseCommand):
+    help = 'Generate queued subsampled audio and spectrogram files'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.kinds: List[str] = []
+        self.workers = 1
+        self.timeout = 300
+        self.max_attempts = 3
+        self.poll = 0.0
+        self.enqueue = True
+        self.media: Optional[DerivedMediaGenerator] = None
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-u', '--subsample', action='store_true',
+            help='Queue subsampling for records without subsampled audio files'
+        )
+        parser.add_argument(
+            '-p', '--spectrogram', action='store_true',
+            help='Queue spectrograms for records without spectrogram image files'
+        )
+        parser.add_argument(
+            '-n', '--no-enqueue', action='store_true',
+            help="Only run jobs that are already queued, don't look for records missing files"
+        )
+        parser.add_argument(
+            '-w', '--workers', type=int, default=1,
+            help='Number of worker processes'
+        )
+        parser.add_argument(
+            '-t', '--timeout', type=int, default=300,
+            help='Seconds allowed for each job before it is abandoned'
+        )
+        parser.add_argument(
+            '-a', '--max-attempts', type=int, default=3,
+            help='Number of times to try each job before marking it as failed'
+        )
+        parser.add_argument(
+            '--poll', type=float, default=0,
+            help='Keep running, checking for new jobs at this interval in seconds, instead of '
+                 'stopping when the queue is empty'
+        )
+        parser.add_argument(
+            '--retry-failed', action='store_true',
+            help='Queue jobs that have failed to be tried again'
+        )
+
+    def handle(self, *args, **kwargs):
+        subsample = kwargs['subsample']
+        spectrogram = kwargs['spectrogram']
+        # Neither option means both
+        if subsample or not spectrogram:
+            self.kinds.append(MediaJob.SUBSAMPLE)
+        if spectrogram or not subsample:
+            self.kinds.append(MediaJob.SPECTROGRAM)
+        self.workers = max(1, kwargs['workers'])
+        self.timeout = max(0, kwargs['timeout'])
+        self.max_attempts = max(1, kwargs['max_attempts'])
+        self.poll = max(0.0, kwargs['poll'])
+        self.enqueue = not kwargs['no_enqueue']
+
+        if kwargs['retry_failed']:
+            retried = MediaJob.objects.filter(status=MediaJob.FAILED) \
+                .update(status=MediaJob.PENDING, attempts=0)
+            print(f'Queued {retried} failed jobs to be tried again')
+
+        self.release_stale_jobs()
+        if self.enqueue:
+            self.enqueue_missing()
+
+        if self.workers == 1:
+            self.run_worker()
+            return
+
+        # Workers are forked, so must not inherit our open database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=self.run_worker) for _ in range(self.workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+    def enqueue_missing(self):
+        """
+        Queue jobs for records missing derived files, unless a job to make them is already queued
+        """
+        for kind, field in (
+                (MediaJob.SUBSAMPLE, 'subsampled_audio_file'),
+                (MediaJob.SPECTROGRAM, 'spectrogram_image_file'),
+        ):
+            if kind not in self.kinds:
+                continue
+            # Jobs that are done are redone if their file has gone; failed ones are left alone
+            unfinished_jobs = MediaJob.objects \
+                .filter(recording=OuterRef('pk'), kind=kind) \
+                .exclude(status=MediaJob.DONE)
+            missing = AudioRecording.objects \
+                .filter(Q(**{f'{field}__isnull': True}) | Q(**{field: ''})) \
+                .exclude(Exists(unfinished_jobs)) \
+                .values_list('id', flat=True)
+            queued = MediaJob.enqueue(missing, [kind], requeue=True)
+            if queued:
+                print(f'Queued {queued} {kind} jobs')
+
+    def release_stale_jobs(self):
+        """
+        Return jobs to the queue if they were claimed by a worker that has since died
+        """
+        if not self.timeout:
+            return
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=2 * self.timeout)
+        stale = MediaJob.objects.filter(status=MediaJob.RUNNING, started_at__lt=cutoff)
+        failed = stale.filter(attempts__gte=self.max_attempts) \
+            .update(status=MediaJob.FAILED, last_error='Worker stopped without finishing job')
+        released = stale.update(status=MediaJob.PENDING)
+        if failed or released:
+            print(f'Released {released} and failed {failed} abandoned jobs')
+
+    def run_worker(self):
+        """
+        Claim and run jobs until the queue is empty, or indefinitely if polling
+        """
+        worker_name = f'{socket.gethostname()}:{os.getpid()}'
+        self.media = DerivedMediaGenerator()
+        done = failed = 0
+        while True:
+            job = self.claim_job(worker_name)
+            if job is None:
+                if not self.poll:
+                    break
+                time.sleep(self.poll)
+                self.release_stale_jobs()
+                if self.enqueue:
+                    self.enqueue_missing()
+                continue
+
+            if self.run_job(job):
+                done += 1
+            else:
+                failed += 1
+
+        print(f'{worker_name} finished: {done} jobs done, {failed} failed')
+
+    @staticmethod
+    def claim_job(worker_name: str) -> Optional[MediaJob]:
+        """
+        Take the oldest pending job. The claim is a conditional update, so only one worker
+        can win each job without any locking beyond the database's own.
+        """
+        while True:
+            candidates = list(
+                MediaJob.objects.filter(status=MediaJob.PENDING)
+                .order_by('id')
+                .values_list('id', flat=True)[:CLAIM_CANDIDATES]
+            )
+            if not candidates:
+                return None
+            for job_id in candidates:
+                claimed = MediaJob.objects.filter(id=job_id, status=MediaJob.PENDING).update(
+                    status=MediaJob.RUNNING,
+                    worker=worker_name,
+                    started_at=datetime.now(timezone.utc),
+                    attempts=F('attempts') + 1
+                )
+                if claimed:
+                    return MediaJob.objects.select_related('recording').get(id=job_id)
+
+    def run_job(self, job: MediaJob) -> bool:
+        """
+        Generate the file for a job and record the outcome
+
+        Returns:
+            True if the job succeeded
+        """
+        recording = job.recording
+        print(f'{job.worker}: {job.kind} {recording.audio_file} (attempt {job.attempts})')
+
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.alarm(self.timeout)
+        try:
+            riff_scan, samples = self.media.read_samples(recording)
+            if job.kind == MediaJob.SUBSAMPLE:
+                self.media.subsample_file(recording, riff_scan, samples)
+            else:
+                self.media.generate_spectrogram_file(recording, riff_scan, samples)
+        except JobTimeout:
+            error = f'Timed out after {self.timeout} seconds'
+        except Exception as e:  # pylint: disable=W0703
+            error = f'{type(e).__name__}: {e}'
+        else:
+            error = None
+        finally:
+            signal.alarm(0)
+
+        job.finished_at = datetime.now(timezone.utc)
+        if error is None:
+            recording.save(update_fields=JOB_FIELDS[job.kind])
+            job.status = MediaJob.DONE
+            job.last_error = ''
+        else:
+            print(f'Failed to {job.kind} {recording.audio_file}: {error}')
+            job.status = MediaJob.FAILED if job.attempts >= self.max_attempts \
+                else MediaJob.PENDING
+            job.last_error = error
+        job.save(update_fields=['status', 'last_error', 'finished_at'])
+        return error is None
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from tracemap.models import DailySpeciesSummary, DataVersion
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the daily species summary from all recordings, eg after editing the ' \
+           'database directly'
+
+    def handle(self, *args, **kwargs):
+        count = DailySpeciesSummary.rebuild()
+        DataVersion.bump()
+        print(f'Summarised recordings into {count} day and species rows')
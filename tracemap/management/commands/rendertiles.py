@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tracemap.models import DataVersion
+from tracemap.tiles import MAX_TILE_ZOOM, located_positions
+from tracemap.views import density_tiles
+
+
+class Command(BaseCommand):
+    help = 'Render the map tiles of recording density for the search page ahead of time, for ' \
+           'every tile with recordings at the given zoom levels'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-zoom', type=int, default=0,
+            help='Lowest zoom level to render'
+        )
+        parser.add_argument(
+            '--max-zoom', type=int, default=10,
+            help=f'Highest zoom level to render, up to {MAX_TILE_ZOOM}'
+        )
+        parser.add_argument(
+            '-s', '--species',
+            help='Comma-separated species abbreviations to render tiles of, as the search page'
+        )
+
+    def handle(self, *args, **kwargs):
+        search_params = {'species': kwargs['species']} if kwargs['species'] else {}
+        tiles = density_tiles(DataVersion.current(), search_params)
+        latitudes, longitudes = located_positions(tiles.recordings)
+        print(f'Rendering tiles of {len(latitudes)} recordings')
+
+        for zoom in range(max(kwargs['min_zoom'], 0), min(kwargs['max_zoom'], MAX_TILE_ZOOM) + 1):
+            started = time.perf_counter()
+            rendered = tiles.render_zoom(zoom, latitudes, longitudes)
+            print(f'Zoom {zoom}: rendered {rendered} tiles in {time.perf_counter() - started:.1f}s')
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tracemap.models import AudioRecording, DataVersion
+from tracemap.repository import SpeciesLookup
+
+
+class Command(BaseCommand):
+    help = 'Link recordings to species records, from their genus and species abbreviations'
+
+    def handle(self, *args, **kwargs):
+        lookup = SpeciesLookup()
+        # The species table may just have been changed by another process
+        lookup.index.invalidate()
+
+        pairs = AudioRecording.objects.order_by() \
+            .values_list('genus', 'species') \
+            .distinct()
+
+        counts = {'resolved': 0, 'ambiguous': 0, 'unmatched': 0}
+        updated = 0
+        with transaction.atomic():
+            for genus, species in pairs:
+                resolved_species, ambiguous = lookup.resolve(genus, species)
+                if resolved_species:
+                    counts['resolved'] += 1
+                elif ambiguous:
+                    counts['ambiguous'] += 1
+                else:
+                    counts['unmatched'] += 1
+
+                # One update for all recordings with these abbreviations, skipping any that
+                # are already correct
+                updated += AudioRecording.objects \
+                    .filter(genus=genus, species=species) \
+                    .exclude(resolved_species=resolved_species, species_ambiguous=ambiguous) \
+                    .update(resolved_species=resolved_species, species_ambiguous=ambiguous)
+            if updated:
+                DataVersion.bump()
+
+        print(
+            f'Checked {sum(counts.values())} abbreviations: {counts["resolved"]} resolved, '
+            f'{counts["ambiguous"]} ambiguous, {counts["unmatched"]} unmatched'
+        )
+        print(f'Updated {updated} recordings')
@@ -0,0 +1,131 @@
+import os
+import signal
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from batbox import settings
+from tracemap.management.commands import importaudiofile
+from tracemap.timing import ImportTimings
+from tracemap.watch import SettlingFiles, create_watcher
+
+
+class Command(BaseCommand):
+    help = 'Watch the sessions directory and import audio files as they arrive'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'directory', type=str, nargs='?', default=None,
+            help='Directory to watch, by default the sessions directory in MEDIA_ROOT'
+        )
+        parser.add_argument(
+            '-u', '--subsample', action='store_true', help='Generate subsampled audio files'
+        )
+        parser.add_argument(
+            '-p', '--spectrogram', action='store_true', help='Generate spectrogram image files'
+        )
+        parser.add_argument(
+            '-q', '--queue-media', action='store_true',
+            help='Queue subsampling and spectrogram generation for processmedia, instead of '
+                 'generating files during import. Queues both unless -u or -p is given'
+        )
+        parser.add_argument(
+            '-s', '--settle', type=float, default=10,
+            help='Seconds a file must be left unchanged before it is imported'
+        )
+        parser.add_argument(
+            '-i', '--interval', type=float, default=5,
+            help='Seconds between checks for new files when polling, and for settled files'
+        )
+        parser.add_argument(
+            '--poll', action='store_true', help='Poll for changes instead of using inotify'
+        )
+        parser.add_argument(
+            '--catch-up', action='store_true',
+            help='Import any new or changed files already in the directory when starting'
+        )
+
+    def handle(self, *args, **kwargs):
+        directory = os.path.realpath(
+            kwargs['directory'] or os.path.join(settings.MEDIA_ROOT, 'sessions')
+        )
+        if not os.path.isdir(directory):
+            print(f'{directory} not found')
+            exit(1)
+
+        importer = importaudiofile.Command()
+        importer.configure({
+            'force': False,
+            'changed_only': True,
+            'subsample': kwargs['subsample'],
+            'spectrogram': kwargs['spectrogram'],
+            'queue_media': kwargs['queue_media'],
+            'jobs': 1,
+            'batch_size': 500,
+        })
+
+        interval = max(0.1, kwargs['interval'])
+        pending = SettlingFiles(kwargs['settle'])
+        watcher, existing = create_watcher(directory, use_inotify=not kwargs['poll'])
+        print(f'Watching {directory} with {type(watcher).__name__}')
+        if kwargs['catch_up']:
+            self.catch_up(importer, existing)
+        del existing
+
+        # Stop cleanly when a service manager stops us, as on ctrl-C
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            while True:
+                # Check for settled files sooner while any are pending
+                pending.add(watcher.wait(min(interval, 1) if len(pending) else interval))
+                settled = pending.settled()
+                if settled:
+                    self.import_files(importer, settled)
+        except KeyboardInterrupt:
+            print('Stopping')
+        finally:
+            watcher.close()
+            importer.flush_recordings()
+
+    @staticmethod
+    def catch_up(importer: importaudiofile.Command, files: list):
+        """
+        Import files found when starting, skipping those already imported and unchanged
+        """
+        print(f'Checking {len(files)} existing files')
+        importer.known_recordings = importer.load_known_recordings()
+        importer.manifest = importer.load_manifest()
+        new_files = [
+            f for f in files if not importer.file_is_unchanged(os.path.realpath(f))
+        ]
+        Command.import_files(importer, new_files)
+        # Later lookups are for a few files at a time, so are made as needed
+        importer.known_recordings = None
+        importer.manifest = None
+
+    @staticmethod
+    def import_files(importer: importaudiofile.Command, files: list):
+        """
+        Import a group of files, writing them to the database together. A file that can't be
+        imported, eg as it's truncated or still being copied, is reported and skipped, so that
+        the rest are still written and watching carries on. Failures to render cached pages
+        afterwards are reported in the same way
+        """
+        started = time.monotonic()
+        written = importer.records_written
+        # Stage timings are only summarised by importaudiofile, so don't let them accumulate
+        importer.timings = ImportTimings()
+        for file in files:
+            try:
+                importer.process_file(file)
+            except Exception as e:  # pylint: disable=W0703
+                print(f'Failed to import {file}: {e!r}', file=sys.stderr)
+        importer.flush_recordings()
+        if files:
+            print(f'Processed {len(files)} files in {time.monotonic() - started:.1f}s')
+        if importer.records_written > written:
+            try:
+                importer.warm_caches()
+            except Exception as e:  # pylint: disable=W0703
+                print(f'Failed to render cached pages: {e!r}', file=sys.stderr)
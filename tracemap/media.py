@@ -0,0 +1,152 @@
+"""
+Generation of files derived from recordings: subsampled audio and spectrogram images
+"""
+import hashlib
+import os
+import subprocess
+from typing import Optional, Tuple
+
+import numpy as np
+from dateutil import parser as date_parser
+from png import Reader
+
+from batbox import settings
+
+from .models import AudioRecording
+from .repository import NonUniqueSpeciesLookup, SpeciesLookup
+from .resampler import PolyphaseResampler
+from .riff import RiffScan, scan_riff
+from .samples import map_samples
+from .spectrogram import SpectrogramRenderer
+
+
+# Sample rate of subsampled files, for playback in browsers
+SUBSAMPLE_RATE = 44100
+
+
+class DerivedMediaGenerator:
+    """
+    Generate derived files for recordings, in-process where possible, otherwise with SoX
+    """
+
+    def __init__(self):
+        self.sox_executable = 'sox'
+        self.species_lookup = SpeciesLookup()
+        self.spectrogram_renderer = SpectrogramRenderer(settings.SPECTROGRAM_PREFILTER)
+
+    @staticmethod
+    def read_samples(
+            audio: AudioRecording,
+            riff_scan: Optional[RiffScan] = None
+    ) -> Tuple[Optional[RiffScan], Optional[np.ndarray]]:
+        """
+        Map the samples of a recording's source file, so that both derived files can share them
+        Args:
+            audio: Recording
+            riff_scan: Result of scanning the source file, if already available
+
+        Returns:
+            Tuple of (riff_scan, samples), either None if the file can't be read in-process
+        """
+        try:
+            if riff_scan is None:
+                riff_scan = scan_riff(audio.audio_file)
+            return riff_scan, map_samples(riff_scan)
+        except ValueError as e:
+            print(f'Cannot read samples in-process ({e}), using SoX')
+            return riff_scan, None
+
+    @staticmethod
+    def derived_file_name(audio: AudioRecording, extension: str) -> str:
+        """
+        Name a file generated from a recording, unique to its source file so no id is needed
+        """
+        source_hash = hashlib.sha1(audio.audio_file.encode('utf-8')).hexdigest()[0:10]
+        return f'{source_hash}-{audio.identifier}.{extension}'
+
+    def subsample_file(
+            self,
+            audio: AudioRecording,
+            riff_scan: RiffScan = None,
+            samples: np.ndarray = None
+    ):
+        dest = audio.subsampled_audio_file or os.path.join(
+            settings.MEDIA_ROOT,
+            'processed',
+            'subsampled',
+            self.derived_file_name(audio, 'wav')
+        )
+        print(f'Subsample {audio.audio_file} to {dest}')
+        if getattr(settings, 'SUBSAMPLE_ENGINE', 'numpy') == 'numpy' and samples is not None:
+            resampler = PolyphaseResampler(riff_scan.wave_format.sample_rate, SUBSAMPLE_RATE)
+            resampler.resample_to_file(samples, dest)
+        else:
+            sox_result = subprocess.run(
+                [self.sox_executable, audio.audio_file, f'-r{SUBSAMPLE_RATE}', dest]
+            )
+            sox_result.check_returncode()
+        audio.subsampled_audio_file = dest
+
+    def spectrogram_title(self, audio: AudioRecording) -> str:
+        """
+        Describe a recording's species and time, to title its spectrogram
+        """
+        title = '(unknown) '
+
+        if audio.species:
+            title = f'{audio.genus} {audio.species} '
+            try:
+                species = self.species_lookup.species_by_abbreviations(audio.genus, audio.species)
+            except NonUniqueSpeciesLookup:
+                species = None
+
+            if species:
+                species_ucfirst = species.species[0].upper() + species.species[1:]
+                if species.common_name:
+                    title = f'{species.common_name} ({species.genus} {species_ucfirst}) '
+                else:
+                    title = f'{species.genus} {species_ucfirst} '
+
+        if audio.recorded_at_iso:
+            title += date_parser.parse(audio.recorded_at_iso).strftime('%Y-%m-%d %H:%M')
+
+        return title
+
+    def generate_spectrogram_file(
+            self,
+            audio: AudioRecording,
+            riff_scan: RiffScan = None,
+            samples: np.ndarray = None
+    ):
+        credit = settings.SPECTROGRAM_CREDIT
+        title = self.spectrogram_title(audio)
+
+        dest = audio.spectrogram_image_file or os.path.join(
+            settings.MEDIA_ROOT,
+            'processed',
+            'spectrograms',
+            self.derived_file_name(audio, 'png')
+        )
+        print(f'Plot {audio.audio_file} spectrum to {dest}')
+        if getattr(settings, 'SPECTROGRAM_ENGINE', 'numpy') == 'numpy' and samples is not None:
+            width, height = self.spectrogram_renderer.render(
+                samples, riff_scan.wave_format.sample_rate, dest, title, credit
+            )
+        else:
+            width, height = self.sox_spectrogram(audio.audio_file, dest, title, credit)
+
+        audio.spectrogram_image_file = dest
+        audio.spectrogram_image_width = width
+        audio.spectrogram_image_height = height
+
+    def sox_spectrogram(self, source: str, dest: str, title: str, credit: str) -> Tuple[int, int]:
+        #     sox "$file" -n spectrogram -o "$outfile" -t "$ident"
+        sox_result = subprocess.run(
+            [self.sox_executable, source, '-n', ] +
+            settings.SPECTROGRAM_PREFILTER +
+            ['spectrogram', '-o', dest, '-c', credit, '-t', title]
+        )
+        sox_result.check_returncode()
+        png_reader = Reader(filename=dest)
+        (width, height, _, _) = png_reader.read()
+        return width, height
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracemap', '0010_add_spectro_dims'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportManifestEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False,
+                                        verbose_name='ID')),
+                ('source_file', models.CharField(max_length=1024, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('mtime', models.FloatField()),
+                ('header_hash', models.CharField(max_length=40)),
+                ('imported_at', models.DateTimeField()),
+            ],
+        ),
+    ]
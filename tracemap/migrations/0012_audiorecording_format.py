@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracemap', '0011_import_manifest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audiorecording',
+            name='bit_depth',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='audiorecording',
+            name='channels',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='audiorecording',
+            name='sample_rate',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracemap', '0012_audiorecording_format'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False,
+                                        verbose_name='ID')),
+                ('kind', models.CharField(choices=[('subsample', 'Subsampled audio'),
+                                                   ('spectrogram', 'Spectrogram image')],
+                                          max_length=16)),
+                ('status', models.CharField(choices=[('pending', 'Pending'),
+                                                     ('running', 'Running'), ('done', 'Done'),
+                                                     ('failed', 'Failed')],
+                                            default='pending', max_length=16)),
+                ('attempts', models.IntegerField(default=0)),
+                ('worker', models.CharField(blank=True, max_length=64)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('recording', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                related_name='media_jobs',
+                                                to='tracemap.audiorecording')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='mediajob',
+            index=models.Index(fields=['status', 'id'], name='tracemap_me_status_6184e1_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='mediajob',
+            unique_together={('recording', 'kind')},
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracemap', '0013_media_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audiorecording',
+            name='resolved_species',
+            field=models.ForeignKey(blank=True, null=True,
+                                    on_delete=django.db.models.deletion.SET_NULL,
+                                    related_name='recordings', to='tracemap.species'),
+        ),
+        migrations.AddField(
+            model_name='audiorecording',
+            name='species_ambiguous',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='audiorecording',
+            index=models.Index(fields=['genus', 'species'], name='tracemap_au_genus_c632b8_idx'),
+        ),
+    ]
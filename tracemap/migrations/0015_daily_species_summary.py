@@ -0,0 +1,55 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:03
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import Substr
+
+
+def summarise_recordings(apps, schema_editor):
+    AudioRecording = apps.get_model('tracemap', 'AudioRecording')
+    DailySpeciesSummary = apps.get_model('tracemap', 'DailySpeciesSummary')
+    rows = AudioRecording.objects \
+        .filter(hide=False) \
+        .annotate(summary_day=Substr('recorded_at_iso', 1, 10)) \
+        .values('summary_day', 'genus', 'species') \
+        .annotate(count=Count('id'), total_duration=Sum('duration')) \
+        .order_by()
+    DailySpeciesSummary.objects.bulk_create(
+        [
+            DailySpeciesSummary(
+                day=row['summary_day'] or '',
+                genus=row['genus'],
+                species=row['species'],
+                count=row['count'],
+                total_duration=row['total_duration'] or 0
+            )
+            for row in rows
+        ],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracemap', '0014_audiorecording_resolved_species'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySpeciesSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False,
+                                        verbose_name='ID')),
+                ('day', models.CharField(blank=True, max_length=10)),
+                ('genus', models.CharField(blank=True, max_length=16)),
+                ('species', models.CharField(blank=True, max_length=16)),
+                ('count', models.IntegerField(default=0)),
+                ('total_duration', models.FloatField(default=0)),
+            ],
+            options={
+                'unique_together': {('day', 'genus', 'species')},
+            },
+        ),
+        migrations.RunPython(summarise_recordings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:16
+
+from django.db import migrations, models
+from django.db.models import DateField
+from django.db.models.functions import Cast, Substr
+
+
+def fill_recorded_date(apps, schema_editor):
+    # The local date is the date part of the ISO recording time
+    AudioRecording = apps.get_model('tracemap', 'AudioRecording')
+    AudioRecording.objects \
+        .filter(recorded_at_iso__isnull=False) \
+        .update(recorded_date=Cast(Substr('recorded_at_iso', 1, 10), DateField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracemap', '0016_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audiorecording',
+            name='recorded_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_recorded_date, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='audiorecording',
+            index=models.Index(
+                condition=models.Q(('hide', False)), fields=['recorded_date'],
+                name='recording_visible_date'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='audiorecording',
+            index=models.Index(
+                condition=models.Q(('hide', False)), fields=['genus', 'species'],
+                name='recording_visible_species'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='audiorecording',
+            index=models.Index(
+                condition=models.Q(('hide', False)), fields=['recorded_at_utc'],
+                name='recording_visible_time'
+            ),
+        ),
+    ]
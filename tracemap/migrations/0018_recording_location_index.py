@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from tracemap.spatial import create_location_index, drop_location_index
+
+
+def create_index(apps, schema_editor):
+    create_location_index(schema_editor.connection)
+
+
+def drop_index(apps, schema_editor):
+    drop_location_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracemap', '0017_audiorecording_recorded_date'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:08
+
+from django.db import migrations
+
+
+# The partial index recording_visible_species serves the views' queries by genus and species,
+# which are all of visible recordings; this full index only added to the cost of every write
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracemap', '0018_recording_location_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='audiorecording',
+            name='tracemap_au_genus_c632b8_idx',
+        ),
+    ]
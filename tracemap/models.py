@@ -1,16 +1,22 @@
 """
 Django entity models for bat recording data
 """
+import hashlib
 import json
 import os
 from datetime import datetime, timezone
-from typing import Dict, Optional
+from typing import Dict, Iterable, List, Optional
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, Q, Sum
 
 from batbox import settings
 
 
+# Rows written, or ids matched, per query; keeps within SQLite's limit on query variables
+QUERY_BATCH_SIZE = 500
+
+
 class AudioRecording(models.Model):
     """
     Entity representing an audio recording file
@@ -40,6 +46,7 @@ class AudioRecording(models.Model):
     processed = models.BooleanField(default=False)
     recorded_at_utc = models.DateTimeField(null=True, blank=True)
     recorded_at_iso = models.CharField(max_length=30, null=True, blank=True)
+    recorded_date = models.DateField(null=True, blank=True)  # Local date, as in recorded_at_iso
     latitude = models.FloatField(blank=True, null=True)
     longitude = models.FloatField(blank=True, null=True)
     genus = models.CharField(max_length=16, blank=True)
@@ -47,7 +54,32 @@ class AudioRecording(models.Model):
     recorder_serial = models.CharField(max_length=16, blank=True)
     guano_data = models.TextField(blank=True)
     duration = models.FloatField(blank=True, null=True)
+    sample_rate = models.IntegerField(blank=True, null=True)
+    channels = models.IntegerField(blank=True, null=True)
+    bit_depth = models.IntegerField(blank=True, null=True)
     hide = models.BooleanField(default=False)  # Ignore files not containing useful recordings
+    # Species matched from genus and species abbreviations, see resolvespecies command
+    resolved_species = models.ForeignKey(
+        'Species', on_delete=models.SET_NULL, related_name='recordings', null=True, blank=True
+    )
+    species_ambiguous = models.BooleanField(default=False)  # Abbreviations match many species
+
+    class Meta:
+        # Views only show recordings that aren't hidden. The filter on hide is written as
+        # "NOT hide", which can't select from an index on hide, so these cover visible
+        # recordings only
+        indexes = [
+            models.Index(
+                fields=['recorded_date'], condition=Q(hide=False), name='recording_visible_date'
+            ),
+            models.Index(
+                fields=['genus', 'species'], condition=Q(hide=False),
+                name='recording_visible_species'
+            ),
+            models.Index(
+                fields=['recorded_at_utc'], condition=Q(hide=False), name='recording_visible_time'
+            ),
+        ]
 
     def path_relative_to(self, base_dir: str) -> Optional[str]:
         """
@@ -89,12 +121,17 @@ class AudioRecording(models.Model):
             'species': self.species,
             'recorder_serial': self.recorder_serial,
             'guano_data': json.loads(self.guano_data) if self.guano_data else None,
-            'duration': self.duration
+            'duration': self.duration,
+            'sample_rate': self.sample_rate,
+            'channels': self.channels,
+            'bit_depth': self.bit_depth,
+            'resolved_species_id': self.resolved_species_id,
+            'species_ambiguous': self.species_ambiguous,
         }
 
     def set_recording_time(self, recording_time: datetime):
         """
-        Set recording time in human-readable and timezone-aware formats
+        Set recording time in human-readable and timezone-aware formats, and its local date
         Args:
             recording_time: datetime recording time
 
@@ -103,6 +140,292 @@ class AudioRecording(models.Model):
         """
         self.recorded_at_utc = recording_time.astimezone(timezone.utc)
         self.recorded_at_iso = recording_time.isoformat()
+        self.recorded_date = recording_time.date()
+
+
+class ImportManifestEntry(models.Model):
+    """
+    Entity recording the state of a source audio file when it was last imported
+    """
+    HEADER_HASH_BYTES = 65536
+
+    source_file = models.CharField(max_length=1024, unique=True)
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    header_hash = models.CharField(max_length=40)
+    imported_at = models.DateTimeField()
+
+    @classmethod
+    def hash_file_header(cls, filepath: str) -> str:
+        """
+        Hash the start of a file, which holds the RIFF headers of most recordings
+        Args:
+            filepath: Path to file
+
+        Returns:
+            Hex digest
+        """
+        with open(filepath, 'rb') as file:
+            return hashlib.sha1(file.read(cls.HEADER_HASH_BYTES)).hexdigest()
+
+    def matches_file(self, filepath: str) -> bool:
+        """
+        Check whether a file appears unchanged since this entry was recorded.
+
+        Size and mtime are checked first, so unchanged files are not opened. If only the mtime
+        differs (eg after a copy) the header hash decides, and the entry's mtime is refreshed.
+        Args:
+            filepath: Path to file
+
+        Returns:
+            True if the file is unchanged
+        """
+        stat = os.stat(filepath)
+        if stat.st_size != self.size:
+            return False
+        if stat.st_mtime == self.mtime:
+            return True
+        if self.hash_file_header(filepath) == self.header_hash:
+            self.mtime = stat.st_mtime
+            return True
+        return False
+
+    def update_from_file(self, filepath: str):
+        """
+        Record the current state of a file
+        Args:
+            filepath: Path to file
+
+        Returns:
+            void
+        """
+        stat = os.stat(filepath)
+        self.source_file = filepath
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.header_hash = self.hash_file_header(filepath)
+        self.imported_at = datetime.now(timezone.utc)
+
+
+class MediaJob(models.Model):
+    """
+    Entity representing a queued task to generate a derived file for a recording
+    """
+    SUBSAMPLE = 'subsample'
+    SPECTROGRAM = 'spectrogram'
+    KIND_CHOICES = [
+        (SUBSAMPLE, 'Subsampled audio'),
+        (SPECTROGRAM, 'Spectrogram image'),
+    ]
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    recording = models.ForeignKey(
+        AudioRecording, on_delete=models.CASCADE, related_name='media_jobs'
+    )
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    worker = models.CharField(max_length=64, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = [('recording', 'kind')]
+        indexes = [models.Index(fields=['status', 'id'])]
+
+    @classmethod
+    def enqueue(
+            cls,
+            recording_ids: Iterable[int],
+            kinds: Iterable[str],
+            requeue: bool = False
+    ) -> int:
+        """
+        Queue jobs for recordings. There's only one job for each recording and kind, so
+        existing jobs are left as they are unless requeue is set
+        Args:
+            recording_ids: Ids of recordings to process
+            kinds: Job kinds, eg [MediaJob.SUBSAMPLE]
+            requeue: Reset existing jobs that aren't running, so that they're done again
+
+        Returns:
+            Number of jobs requested
+        """
+        recording_ids = list(recording_ids)
+        kinds = list(kinds)
+        jobs = [
+            cls(recording_id=recording_id, kind=kind)
+            for recording_id in recording_ids
+            for kind in kinds
+        ]
+        cls.objects.bulk_create(jobs, batch_size=QUERY_BATCH_SIZE, ignore_conflicts=True)
+        if requeue:
+            for start in range(0, len(recording_ids), QUERY_BATCH_SIZE):
+                cls.objects \
+                    .filter(
+                        recording_id__in=recording_ids[start:start + QUERY_BATCH_SIZE],
+                        kind__in=kinds
+                    ) \
+                    .exclude(status__in=[cls.PENDING, cls.RUNNING]) \
+                    .update(status=cls.PENDING, attempts=0, last_error='')
+        return len(jobs)
+
+
+def summary_day(recorded_at_iso: Optional[str]) -> str:
+    """
+    Day under which a recording is summarised: the local date part of its ISO timestamp
+    Args:
+        recorded_at_iso: Recording time in ISO format, or None
+
+    Returns:
+        YYYY-MM-DD, or blank if undated
+    """
+    return recorded_at_iso[0:10] if recorded_at_iso else ''
+
+
+class DailySpeciesSummary(models.Model):
+    """
+    Entity holding the number and total duration of visible recordings of each species on each
+    day, kept up to date as recordings change so that summaries needn't scan every recording
+    """
+    # Fields of AudioRecording that affect the summary
+    SOURCE_FIELDS = frozenset(
+        ['recorded_at_iso', 'recorded_date', 'genus', 'species', 'duration', 'hide']
+    )
+
+    day = models.CharField(max_length=10, blank=True)  # YYYY-MM-DD, or blank if undated
+    genus = models.CharField(max_length=16, blank=True)
+    species = models.CharField(max_length=16, blank=True)
+    count = models.IntegerField(default=0)
+    total_duration = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = [('day', 'genus', 'species')]
+
+    @classmethod
+    def aggregate(cls, days: Optional[Iterable[str]] = None) -> List['DailySpeciesSummary']:
+        """
+        Summarise recordings, without saving the results
+        Args:
+            days: Days to summarise, as from summary_day, or None for all days
+
+        Returns:
+            List of unsaved DailySpeciesSummary
+        """
+        recordings = AudioRecording.objects.filter(hide=False)
+        if days is not None:
+            days = list(days)
+            condition = Q(recorded_date__in=[d for d in days if d])
+            if '' in days:
+                condition |= Q(recorded_date__isnull=True)
+            recordings = recordings.filter(condition)
+
+        rows = recordings \
+            .values('recorded_date', 'genus', 'species') \
+            .annotate(count=Count('id'), total_duration=Sum('duration')) \
+            .order_by()
+        return [
+            cls(
+                day=row['recorded_date'].isoformat() if row['recorded_date'] else '',
+                genus=row['genus'],
+                species=row['species'],
+                count=row['count'],
+                total_duration=row['total_duration'] or 0
+            )
+            for row in rows
+        ]
+
+    @classmethod
+    def refresh_days(cls, days: Iterable[str]) -> None:
+        """
+        Recalculate the summary for some days, eg those of recordings that have changed
+        Args:
+            days: Days, as from summary_day
+
+        Returns:
+            void
+        """
+        days = sorted(set(days))
+        with transaction.atomic():
+            for start in range(0, len(days), QUERY_BATCH_SIZE):
+                chunk = days[start:start + QUERY_BATCH_SIZE]
+                cls.objects.filter(day__in=chunk).delete()
+                cls.objects.bulk_create(cls.aggregate(chunk), batch_size=QUERY_BATCH_SIZE)
+
+    @classmethod
+    def rebuild(cls) -> int:
+        """
+        Recalculate the whole summary
+        Returns:
+            Number of summary rows
+        """
+        summaries = cls.aggregate()
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(summaries, batch_size=QUERY_BATCH_SIZE)
+        return len(summaries)
+
+
+class DataVersion(models.Model):
+    """
+    Entity holding a counter that changes whenever recordings are written, so that pages built
+    from them can be cached until the next change, in any process
+    """
+    ROW_ID = 1
+
+    # Fields of AudioRecording that affect cached pages and tiles; saves that change none of
+    # them, such as adding processed media, leave the version as it is
+    SOURCE_FIELDS = DailySpeciesSummary.SOURCE_FIELDS | frozenset(
+        ['recorded_at_utc', 'latitude', 'longitude', 'recorder_serial', 'resolved_species_id']
+    )
+
+    version = models.IntegerField(default=0)
+    updated_at = models.DateTimeField()
+
+    @property
+    def token(self) -> str:
+        """
+        Identifier for this version, also used as an ETag; the time distinguishes versions with
+        the same count, eg after the database is recreated
+        """
+        return f'{self.version}-{int(self.updated_at.timestamp() * 1000):x}'
+
+    @classmethod
+    def current(cls) -> 'DataVersion':
+        """
+        Get the current version, creating it if necessary
+        Returns:
+            DataVersion
+        """
+        data_version, _ = cls.objects.get_or_create(
+            id=cls.ROW_ID, defaults={'updated_at': datetime.now(timezone.utc)}
+        )
+        return data_version
+
+    @classmethod
+    def bump(cls) -> None:
+        """
+        Record that recordings have changed
+        Returns:
+            void
+        """
+        now = datetime.now(timezone.utc)
+        if not cls.objects.filter(id=cls.ROW_ID).update(
+                version=models.F('version') + 1, updated_at=now
+        ):
+            cls.objects.get_or_create(id=cls.ROW_ID, defaults={'version': 1, 'updated_at': now})
 
 
 class Species(models.Model):
@@ -1,9 +1,19 @@
 """
 Data lookup tools - find species names from DB
 """
-from typing import List, Optional, Union
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
-from .models import Species
+from batbox import settings
+
+from .models import AudioRecording, Species
+
+
+# Seconds before the index is reloaded, to pick up changes saved by other processes. Changes
+# saved in this process invalidate it immediately, see signals.py
+DEFAULT_SPECIES_INDEX_TTL = 300
 
 
 class NonUniqueSpeciesLookup(Exception):
@@ -16,15 +26,96 @@ class NonUniqueSpeciesLookup(Exception):
         self.alternatives = kwargs['alternatives']
 
 
+class SpeciesIndex:
+    """
+    In-memory index of the whole Species table, shared by every SpeciesLookup in the process
+
+    Records are indexed by canonical genus 3-code, and by every prefix of their genus name, so
+    that lookups by abbreviation need no queries once the index is loaded. The Species objects
+    returned are shared, so must be treated as read-only.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._loaded_at: Optional[float] = None
+        self.by_canon_genus: Dict[str, List[Species]] = {}
+        self.by_genus_prefix: Dict[str, List[Species]] = {}
+
+    def invalidate(self) -> None:
+        """
+        Discard the index, so that it's reloaded on next use
+        """
+        with self._lock:
+            self._loaded_at = None
+
+    def ensure_loaded(self) -> None:
+        """
+        Load the index if it's not loaded or has expired
+        """
+        ttl = getattr(settings, 'SPECIES_INDEX_TTL', DEFAULT_SPECIES_INDEX_TTL)
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < ttl:
+                return
+
+            by_canon_genus = defaultdict(list)
+            by_genus_prefix = defaultdict(list)
+            for species in Species.objects.order_by('id'):
+                if species.canon_genus_3code:
+                    by_canon_genus[species.canon_genus_3code].append(species)
+                genus = species.genus.lower()
+                for length in range(1, len(genus) + 1):
+                    by_genus_prefix[genus[:length]].append(species)
+
+            self.by_canon_genus = dict(by_canon_genus)
+            self.by_genus_prefix = dict(by_genus_prefix)
+            self._loaded_at = time.monotonic()
+
+    def with_canon_genus(self, code: str) -> List[Species]:
+        """
+        Find species by canonical genus 3-code
+        Args:
+            code: Code, case-insensitive
+
+        Returns:
+            List of Species
+        """
+        self.ensure_loaded()
+        return self.by_canon_genus.get(code.upper(), [])
+
+    def with_genus_prefix(self, prefix: str) -> List[Species]:
+        """
+        Find species whose genus starts with a prefix
+        Args:
+            prefix: Prefix, case-insensitive
+
+        Returns:
+            List of Species
+        """
+        self.ensure_loaded()
+        return self.by_genus_prefix.get(prefix.lower(), [])
+
+
+# Index shared by all lookups in this process
+species_index = SpeciesIndex()
+
+
+def _distinct_genera(species_records: List[Species]) -> List[str]:
+    return list(dict.fromkeys(s.genus for s in species_records))
+
+
+def _with_species_prefix(species_records: List[Species], prefix: str) -> List[Species]:
+    prefix = prefix.lower()
+    return [s for s in species_records if s.species.lower().startswith(prefix)]
+
+
 class SpeciesLookup:
     """
     Tools to fetch species records
     """
-    model = Species
 
-    def __init__(self) -> None:
+    def __init__(self, index: SpeciesIndex = species_index) -> None:
         super().__init__()
-        self._species_lookup_cache = {}
+        self.index = index
 
     def genus_name_by_abbreviation(self, abbreviation: str) -> Union[None, str, List[str]]:
         """
@@ -40,19 +131,16 @@ class SpeciesLookup:
             return None
 
         # First see if we've got it fixed:
-        species_records = self.model.objects.filter(canon_genus_3code=abbreviation.upper()). \
-            values('genus').distinct()
-        if len(species_records) == 1:
-            return species_records[0]['genus']
+        genera = _distinct_genera(self.index.with_canon_genus(abbreviation))
+        if len(genera) == 1:
+            return genera[0]
 
         # Otherwise, use heuristic lookup
+        genera = _distinct_genera(self.index.with_genus_prefix(abbreviation))
+        if len(genera) == 1:
+            return genera[0]
 
-        species_records = self.model.objects.filter(genus__istartswith=abbreviation). \
-            values('genus').distinct()
-        if len(species_records) == 1:
-            return species_records[0]['genus']
-
-        return [s['genus'] for s in species_records]
+        return genera
 
     def species_by_abbreviations(
             self,
@@ -71,25 +159,16 @@ class SpeciesLookup:
         if len(genus_abbreviation) == 0 or len(species_abbreviation) == 0:
             return None
 
-        composite_key = (genus_abbreviation + species_abbreviation).upper()
-        if composite_key in self._species_lookup_cache:
-            species_records = self._species_lookup_cache[composite_key]
-        else:
+        # First try a canon lookup:
+        species_records = _with_species_prefix(
+            self.index.with_canon_genus(genus_abbreviation), species_abbreviation
+        )
 
-            # First try a canon lookup:
-            species_records = self.model.objects.filter(
-                canon_genus_3code=genus_abbreviation.upper(),
-                species__istartswith=species_abbreviation,
+        if len(species_records) == 0:  # Else go heuristic
+            species_records = _with_species_prefix(
+                self.index.with_genus_prefix(genus_abbreviation), species_abbreviation
             )
 
-            if len(species_records) == 0:  # Else go heuristic
-                species_records = self.model.objects.filter(
-                    genus__istartswith=genus_abbreviation,
-                    species__istartswith=species_abbreviation,
-                )
-
-            self._species_lookup_cache[composite_key] = list(species_records)
-
         if len(species_records) == 1:
             return species_records[0]
 
@@ -97,3 +176,68 @@ class SpeciesLookup:
             return None
 
         raise NonUniqueSpeciesLookup(alternatives=list(species_records))
+
+    def resolve(
+            self,
+            genus_abbreviation: str,
+            species_abbreviation: str
+    ) -> Tuple[Optional[Species], bool]:
+        """
+        Lookup a species by abbreviations, without raising an exception if there's no unique match
+        Args:
+            genus_abbreviation:
+            species_abbreviation:
+
+        Returns:
+            Tuple of (Species or None, whether the abbreviations match more than one species)
+        """
+        try:
+            return self.species_by_abbreviations(genus_abbreviation, species_abbreviation), False
+        except NonUniqueSpeciesLookup:
+            return None, True
+
+    def resolve_recording(self, recording: AudioRecording) -> None:
+        """
+        Set the resolved species of a recording from its abbreviations, without saving it
+        Args:
+            recording: Recording
+
+        Returns:
+            void
+        """
+        species, ambiguous = self.resolve(recording.genus, recording.species)
+        recording.resolved_species_id = species.id if species else None
+        recording.species_ambiguous = ambiguous
+
+    def species_by_abbreviation_pairs(
+            self,
+            pairs: Iterable[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], Optional[Species]]:
+        """
+        Lookup the species for many (genus, species) abbreviation pairs at once, eg all those in
+        a list of recordings. Each distinct pair is resolved once, from the shared index, so at
+        most one query is made however many pairs there are.
+        Args:
+            pairs: (genus abbreviation, species abbreviation) tuples, which may repeat
+
+        Returns:
+            Map of each distinct pair to its Species, or None if it has no unique match
+        """
+        return {pair: self.resolve(*pair)[0] for pair in set(pairs)}
+
+    def genus_names_by_abbreviations(
+            self,
+            abbreviations: Iterable[str]
+    ) -> Dict[str, Union[None, str, List[str]]]:
+        """
+        Lookup the genus names for many abbreviations at once
+        Args:
+            abbreviations: Genus abbreviations, which may repeat
+
+        Returns:
+            Map of each distinct abbreviation to the result of genus_name_by_abbreviation
+        """
+        return {
+            abbreviation: self.genus_name_by_abbreviation(abbreviation)
+            for abbreviation in set(abbreviations)
+        }
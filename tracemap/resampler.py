@@ -0,0 +1,95 @@
+"""
+Rational polyphase resampling of WAV files with numpy, as an in-process alternative to SoX
+"""
+import wave
+from math import ceil, gcd
+
+import numpy as np
+
+from .samples import to_float
+
+
+# Filter length, in zero crossings of the sinc either side of its centre, and Kaiser window
+# shape. Subsampled files are only used for playback, so this favours speed over steepness.
+ZERO_CROSSINGS = 10
+KAISER_BETA = 5.0
+
+# Number of output frames calculated and written at a time
+OUTPUT_BLOCK_FRAMES = 4096
+
+
+class PolyphaseResampler:
+    """
+    Resample audio by the rational factor target_rate / source_rate
+
+    The anti-aliasing FIR filter is split into one phase per upsampling step, so that each
+    output frame only needs the few filter taps that line up with real input frames.
+    """
+
+    def __init__(self, source_rate: int, target_rate: int):
+        divisor = gcd(source_rate, target_rate)
+        self.source_rate = source_rate
+        self.target_rate = target_rate
+        self.up = target_rate // divisor
+        self.down = source_rate // divisor
+
+        # Low-pass at whichever Nyquist frequency is lower, relative to the upsampled rate
+        factor = max(self.up, self.down)
+        self.half_length = ZERO_CROSSINGS * factor
+        positions = np.arange(-self.half_length, self.half_length + 1)
+        taps = np.sinc(positions / factor) / factor * np.kaiser(len(positions), KAISER_BETA)
+        taps *= self.up  # Make up for the zeros inserted when upsampling
+
+        taps_per_phase = ceil(len(taps) / self.up)
+        taps = np.pad(taps, (0, taps_per_phase * self.up - len(taps)))
+        # phases[p][t] is the tap applied to the input frame t steps before an output frame
+        # that falls on upsampled position p (mod up)
+        self.phases = taps.reshape(taps_per_phase, self.up).T.astype(np.float32)
+
+    def output_length(self, input_frames: int) -> int:
+        """
+        Number of frames produced from a given number of input frames
+        """
+        return ceil(input_frames * self.up / self.down)
+
+    def resample_block(self, samples: np.ndarray, first: int, count: int) -> np.ndarray:
+        """
+        Calculate a block of output frames
+        Args:
+            samples: (frames, channels) array of input samples, eg from samples.map_samples
+            first: Index of first output frame
+            count: Number of output frames
+
+        Returns:
+            (count, channels) float32 array
+        """
+        # Position of each output frame in the upsampled signal, allowing for filter delay
+        upsampled = np.arange(first, first + count, dtype=np.int64) * self.down + self.half_length
+        phase = upsampled % self.up
+        latest_input = upsampled // self.up
+        indices = latest_input[:, np.newaxis] - np.arange(self.phases.shape[1])
+        in_range = (indices >= 0) & (indices < len(samples))
+
+        frames = to_float(samples[np.clip(indices, 0, len(samples) - 1)])  # (count, taps, ch)
+        weights = self.phases[phase] * in_range
+        return np.einsum('otc,ot->oc', frames, weights)
+
+    def resample_to_file(self, samples: np.ndarray, dest: str):
+        """
+        Resample audio and write it to a 16-bit PCM WAV file, a block at a time
+        Args:
+            samples: (frames, channels) array of input samples, eg from samples.map_samples
+            dest: Destination .wav file
+
+        Returns:
+            void
+        """
+        total = self.output_length(len(samples))
+        with wave.open(dest, 'wb') as output:
+            output.setnchannels(samples.shape[1])
+            output.setsampwidth(2)
+            output.setframerate(self.target_rate)
+            for first in range(0, total, OUTPUT_BLOCK_FRAMES):
+                block = self.resample_block(samples, first, min(OUTPUT_BLOCK_FRAMES, total - first))
+                pcm = np.clip(np.round(block * 32768), -32768, 32767).astype('<i2')
+                output.writeframes(pcm.tobytes())
@@ -0,0 +1,150 @@
+"""
+Tools to read the chunk structure of RIFF WAVE files without reading their audio data
+"""
+import os
+import struct
+from typing import Dict, Iterable, Optional
+
+
+RIFF_HEADER = struct.Struct('<4sI4s')
+CHUNK_HEADER = struct.Struct('<4sI')
+FMT_CHUNK = struct.Struct('<HHIIHH')
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+EXTENSIBLE_SUBFORMAT_OFFSET = 24  # Format tag is the first 2 bytes of the sub-format GUID
+
+# Metadata chunks that we read in full by default
+METADATA_CHUNKS = (b'fmt ', b'guan', b'wamd')
+
+
+class WaveFormat:
+    """
+    Audio format details from the fmt chunk of a WAVE file
+    """
+
+    # pylint: disable=R0903
+
+    def __init__(self, fmt_chunk: bytes):
+        if len(fmt_chunk) < FMT_CHUNK.size:
+            raise ValueError('fmt chunk is too short')
+        (
+            self.format_tag,
+            self.channels,
+            self.sample_rate,
+            self.byte_rate,
+            self.block_align,
+            self.bits_per_sample
+        ) = FMT_CHUNK.unpack_from(fmt_chunk)
+
+        if (
+                self.format_tag == WAVE_FORMAT_EXTENSIBLE
+                and len(fmt_chunk) >= EXTENSIBLE_SUBFORMAT_OFFSET + 2
+        ):
+            self.format_tag = struct.unpack_from('<H', fmt_chunk, EXTENSIBLE_SUBFORMAT_OFFSET)[0]
+
+    @property
+    def is_uncompressed(self) -> bool:
+        """
+        Whether samples are stored as plain integer PCM or float values, one block per frame
+        """
+        return self.format_tag in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT)
+
+
+class RiffScan:
+    """
+    Result of a single pass over the chunks of a RIFF WAVE file
+
+    Wanted chunks are read in full; the position and size of the audio data chunk are
+    recorded, but the data itself is skipped.
+    """
+
+    # pylint: disable=R0903
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.chunks: Dict[bytes, bytes] = {}
+        self.data_offset: Optional[int] = None
+        self.data_size: Optional[int] = None
+
+    def chunk(self, chunk_id: bytes) -> Optional[bytes]:
+        """
+        Get the contents of a chunk, if it was found and read
+        Args:
+            chunk_id: 4-byte chunk identifier, eg b'guan'
+
+        Returns:
+            Chunk contents, or None
+        """
+        return self.chunks.get(chunk_id)
+
+    @property
+    def wave_format(self) -> Optional[WaveFormat]:
+        """
+        Audio format read from the fmt chunk, if there was a valid one
+        """
+        fmt_chunk = self.chunk(b'fmt ')
+        if fmt_chunk is None:
+            return None
+        try:
+            return WaveFormat(fmt_chunk)
+        except ValueError:
+            return None
+
+    @property
+    def duration(self) -> Optional[float]:
+        """
+        Duration in seconds calculated from the headers, for uncompressed audio only
+        """
+        wave_format = self.wave_format
+        if (
+                wave_format is None
+                or not wave_format.is_uncompressed
+                or not wave_format.sample_rate
+                or not wave_format.block_align
+                or self.data_size is None
+        ):
+            return None
+        return self.data_size / (wave_format.sample_rate * wave_format.block_align)
+
+
+def scan_riff(filename: str, wanted: Iterable[bytes] = METADATA_CHUNKS) -> RiffScan:
+    """
+    Read the wanted chunks of a RIFF WAVE file with a single open, seeking past all others
+
+    Args:
+        filename: Path to .wav file
+        wanted: Identifiers of chunks to read
+
+    Returns:
+        RiffScan
+
+    Raises:
+        ValueError if the file is not a RIFF WAVE file
+    """
+    wanted = set(wanted)
+    scan = RiffScan(filename)
+    with open(filename, 'rb') as file:
+        file_size = os.fstat(file.fileno()).st_size
+        header = file.read(RIFF_HEADER.size)
+        if len(header) < RIFF_HEADER.size:
+            raise ValueError(f'{filename} is too small to be a RIFF file')
+        riff_id, _, form_type = RIFF_HEADER.unpack(header)
+        if riff_id != b'RIFF' or form_type != b'WAVE':
+            raise ValueError(f'{filename} is not a RIFF WAVE file')
+
+        offset = RIFF_HEADER.size
+        while offset + CHUNK_HEADER.size <= file_size:
+            file.seek(offset)
+            chunk_id, size = CHUNK_HEADER.unpack(file.read(CHUNK_HEADER.size))
+            content_offset = offset + CHUNK_HEADER.size
+            if chunk_id == b'data':
+                scan.data_offset = content_offset
+                # Recorders that lose power can leave the declared size longer than the file
+                scan.data_size = min(size, file_size - content_offset)
+            elif chunk_id in wanted:
+                scan.chunks[chunk_id] = file.read(size)
+            offset = content_offset + size + (size % 2)  # Chunks are 16-bit aligned
+
+    return scan
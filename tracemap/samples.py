@@ -0,0 +1,71 @@
+"""
+Memory-mapped access to the samples of uncompressed WAV files
+"""
+import numpy as np
+
+from .riff import WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_PCM, RiffScan
+
+
+# numpy dtypes for supported (format tag, bits per sample) combinations
+SAMPLE_DTYPES = {
+    (WAVE_FORMAT_PCM, 8): np.dtype('u1'),
+    (WAVE_FORMAT_PCM, 16): np.dtype('<i2'),
+    (WAVE_FORMAT_PCM, 32): np.dtype('<i4'),
+    (WAVE_FORMAT_IEEE_FLOAT, 32): np.dtype('<f4'),
+    (WAVE_FORMAT_IEEE_FLOAT, 64): np.dtype('<f8'),
+}
+
+
+def map_samples(riff_scan: RiffScan) -> np.ndarray:
+    """
+    Map the data chunk of a scanned WAV file as a (frames, channels) array, without reading it
+
+    Args:
+        riff_scan: Result of scanning the file
+
+    Returns:
+        Read-only array backed by the file
+
+    Raises:
+        ValueError if the sample format isn't supported
+    """
+    wave_format = riff_scan.wave_format
+    if wave_format is None or riff_scan.data_offset is None:
+        raise ValueError(f'No audio format or data found in {riff_scan.filename}')
+
+    key = (wave_format.format_tag, wave_format.bits_per_sample)
+    if key not in SAMPLE_DTYPES or not wave_format.channels:
+        raise ValueError(
+            f'Unsupported sample format {wave_format.format_tag}/{wave_format.bits_per_sample}'
+            f' in {riff_scan.filename}'
+        )
+
+    dtype = SAMPLE_DTYPES[key]
+    frames = riff_scan.data_size // (dtype.itemsize * wave_format.channels)
+    if frames == 0:
+        return np.zeros((0, wave_format.channels), dtype=dtype)
+
+    return np.memmap(
+        riff_scan.filename,
+        dtype=dtype,
+        mode='r',
+        offset=riff_scan.data_offset,
+        shape=(frames, wave_format.channels)
+    )
+
+
+def to_float(samples: np.ndarray) -> np.ndarray:
+    """
+    Convert a block of samples to float32 values in the range -1..1
+
+    Args:
+        samples: Array of samples as stored in the file
+
+    Returns:
+        New float32 array of the same shape
+    """
+    if samples.dtype.kind == 'f':
+        return samples.astype(np.float32)
+    if samples.dtype.kind == 'u':  # 8-bit WAV is unsigned, centred on 128
+        return (samples.astype(np.float32) - 128) / 128
+    return samples.astype(np.float32) / float(np.iinfo(samples.dtype).max + 1)
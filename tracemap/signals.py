@@ -0,0 +1,92 @@
+"""
+Signal handlers, connected when the app is ready
+"""
+from django.db import connections
+from django.db.models.signals import (post_delete, post_migrate, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+
+from .models import (AudioRecording, DailySpeciesSummary, DataVersion, Species,
+                     summary_day)
+from .repository import species_index
+from .spatial import repair_location_index
+
+
+@receiver(post_save, sender=Species)
+@receiver(post_delete, sender=Species)
+def invalidate_species_index(**kwargs):  # pylint: disable=W0613
+    """
+    Reload the shared species index after any change to the Species table
+    """
+    species_index.invalidate()
+
+
+@receiver(pre_save, sender=AudioRecording)
+def note_data_change(  # pylint: disable=W0613
+        instance: AudioRecording, update_fields=None, **kwargs
+):
+    """
+    Before a recording is saved, note whether the save will change cached data, and which days
+    of the daily summary it will change, if any. Bulk imports refresh the summary themselves, as
+    bulk writes don't send signals
+    """
+    instance.summary_days_changed = set()
+    instance.data_changed = False
+    saved = DataVersion.SOURCE_FIELDS
+    if update_fields is not None:
+        # Fields may be named by name or attname, eg resolved_species or resolved_species_id
+        meta = AudioRecording._meta  # pylint: disable=W0212
+        saved = saved & {meta.get_field(name).attname for name in update_fields}
+        if not saved:
+            return
+
+    fields = sorted(DataVersion.SOURCE_FIELDS)
+    previous = AudioRecording.objects.filter(id=instance.id).values(*fields).first() \
+        if instance.id else None
+    if previous is None:
+        instance.data_changed = True
+        if not instance.hide:
+            instance.summary_days_changed.add(summary_day(instance.recorded_at_iso))
+        return
+
+    changed = {f for f in saved if previous[f] != getattr(instance, f)}
+    instance.data_changed = bool(changed)
+    if changed & DailySpeciesSummary.SOURCE_FIELDS:
+        instance.summary_days_changed.add(summary_day(previous['recorded_at_iso']))
+        instance.summary_days_changed.add(summary_day(instance.recorded_at_iso))
+
+
+@receiver(post_save, sender=AudioRecording)
+def recording_saved(instance: AudioRecording, **kwargs):  # pylint: disable=W0613
+    """
+    Recalculate the days of the daily summary changed by saving a recording, and invalidate
+    cached pages if the save changed their data
+    """
+    days = getattr(instance, 'summary_days_changed', None)
+    if days:
+        DailySpeciesSummary.refresh_days(days)
+    if getattr(instance, 'data_changed', True):
+        DataVersion.bump()
+    instance.summary_days_changed = set()
+    instance.data_changed = False
+
+
+@receiver(post_delete, sender=AudioRecording)
+def recording_deleted(instance: AudioRecording, **kwargs):  # pylint: disable=W0613
+    """
+    Recalculate the day of the daily summary a deleted recording was counted in, and invalidate
+    cached pages
+    """
+    if not instance.hide:
+        DailySpeciesSummary.refresh_days([summary_day(instance.recorded_at_iso)])
+    DataVersion.bump()
+
+
+@receiver(post_migrate)
+def check_location_index(app_config, using, **kwargs):  # pylint: disable=W0613
+    """
+    Restore the triggers that keep the location index up to date, if a migration of the
+    recordings table has dropped them
+    """
+    if app_config.name == 'tracemap' and repair_location_index(connections[using]):
+        print('Re-indexed recording locations')
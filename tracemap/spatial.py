@@ -0,0 +1,256 @@
+"""
+Spatial searches of recordings: an index of their locations, so that map bounds can be searched
+without a table scan, and counts of recordings in a grid of cells, for heatmaps
+
+On SQLite, recording locations are copied into an R*Tree virtual table by triggers, so the
+index follows every insert, update and delete, including bulk writes, which don't send signals.
+Other databases, or SQLite builds without the R*Tree module, have no index, and bounds are only
+searched by the plain latitude and longitude filters.
+"""
+from typing import Dict, List, Mapping, Optional
+
+from django.db import connections
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.models import Count, F, IntegerField, Max, QuerySet
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+from django.db.utils import OperationalError
+
+
+LOCATION_INDEX_TABLE = 'tracemap_recording_location'
+RECORDING_TABLE = 'tracemap_audiorecording'
+
+CREATE_TABLE = f"""
+    CREATE VIRTUAL TABLE {LOCATION_INDEX_TABLE} USING rtree(
+        id, min_latitude, max_latitude, min_longitude, max_longitude
+    )
+"""
+
+# Recordings are only indexed once they have both coordinates
+INSERT_LOCATION = f"""
+    INSERT INTO {LOCATION_INDEX_TABLE}
+    SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+    WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+"""
+
+TRIGGERS = {
+    f'{LOCATION_INDEX_TABLE}_insert': f"""
+        CREATE TRIGGER {LOCATION_INDEX_TABLE}_insert AFTER INSERT ON {RECORDING_TABLE}
+        BEGIN
+            {INSERT_LOCATION}
+        END
+    """,
+    f'{LOCATION_INDEX_TABLE}_update': f"""
+        CREATE TRIGGER {LOCATION_INDEX_TABLE}_update
+        AFTER UPDATE OF id, latitude, longitude ON {RECORDING_TABLE}
+        WHEN OLD.id IS NOT NEW.id
+            OR OLD.latitude IS NOT NEW.latitude
+            OR OLD.longitude IS NOT NEW.longitude
+        BEGIN
+            DELETE FROM {LOCATION_INDEX_TABLE} WHERE id = OLD.id;
+            {INSERT_LOCATION}
+        END
+    """,
+    f'{LOCATION_INDEX_TABLE}_delete': f"""
+        CREATE TRIGGER {LOCATION_INDEX_TABLE}_delete AFTER DELETE ON {RECORDING_TABLE}
+        BEGIN
+            DELETE FROM {LOCATION_INDEX_TABLE} WHERE id = OLD.id;
+        END
+    """,
+}
+
+FILL_TABLE = f"""
+    INSERT INTO {LOCATION_INDEX_TABLE}
+    SELECT id, latitude, latitude, longitude, longitude FROM {RECORDING_TABLE}
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+"""
+
+# Bounds, as search parameters, and the test of the indexed box against each
+BOUND_CONDITIONS = {
+    'west': 'max_longitude >= %s',
+    'east': 'min_longitude <= %s',
+    'south': 'max_latitude >= %s',
+    'north': 'min_latitude <= %s',
+}
+
+# Heatmap cells are about this many screen pixels across, at the map's zoom level; web maps are
+# drawn in tiles of 256 pixels, and the world is 2^zoom tiles wide
+CELL_PIXELS = 4
+TILE_PIXELS = 256
+MAX_ZOOM = 24
+
+# Whether the index exists, by database alias; checked once per process
+_index_available: Dict[str, bool] = {}
+
+
+def _schema_objects(connection: BaseDatabaseWrapper, object_type: str) -> set:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT name FROM sqlite_master WHERE type = %s', [object_type])
+        return {row[0] for row in cursor.fetchall()}
+
+
+def create_location_index(connection: BaseDatabaseWrapper) -> bool:
+    """
+    Create the location index and its triggers, and index existing recordings
+    Args:
+        connection: Database connection, usually a migration's schema_editor.connection
+
+    Returns:
+        True if the index was created, False if the database can't support it
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(CREATE_TABLE)
+        except OperationalError:
+            # SQLite was built without the R*Tree module
+            return False
+        for statement in TRIGGERS.values():
+            cursor.execute(statement)
+        cursor.execute(FILL_TABLE)
+    _index_available.pop(connection.alias, None)
+    return True
+
+
+def drop_location_index(connection: BaseDatabaseWrapper) -> None:
+    """
+    Remove the location index and its triggers, if they exist
+    Args:
+        connection: Database connection
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name in TRIGGERS:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        cursor.execute(f'DROP TABLE IF EXISTS {LOCATION_INDEX_TABLE}')
+    _index_available.pop(connection.alias, None)
+
+
+def repair_location_index(connection: BaseDatabaseWrapper) -> bool:
+    """
+    Recreate missing triggers, and re-index every recording. SQLite migrations that alter the
+    recordings table copy it to a new table, dropping its triggers, so this is run after each
+    migration
+    Args:
+        connection: Database connection
+
+    Returns:
+        True if the index had to be repaired
+    """
+    if connection.vendor != 'sqlite' \
+            or LOCATION_INDEX_TABLE not in _schema_objects(connection, 'table'):
+        return False
+    missing = set(TRIGGERS) - _schema_objects(connection, 'trigger')
+    if not missing:
+        return False
+    with connection.cursor() as cursor:
+        for name in missing:
+            cursor.execute(TRIGGERS[name])
+        cursor.execute(f'DELETE FROM {LOCATION_INDEX_TABLE}')
+        cursor.execute(FILL_TABLE)
+    return True
+
+
+def location_index_available(connection: BaseDatabaseWrapper) -> bool:
+    """
+    Check whether the location index exists
+    Args:
+        connection: Database connection
+
+    Returns:
+        True if bounds can be searched with the index
+    """
+    if connection.alias not in _index_available:
+        _index_available[connection.alias] = connection.vendor == 'sqlite' \
+            and LOCATION_INDEX_TABLE in _schema_objects(connection, 'table')
+    return _index_available[connection.alias]
+
+
+def filter_within_bounds(queryset: QuerySet, bounds: Mapping[str, str]) -> QuerySet:
+    """
+    Restrict recordings to those the location index finds within map bounds. The index only
+    narrows the search: its coordinates are rounded outwards, so the exact bounds must still be
+    filtered on, as build_search_filter does
+    Args:
+        queryset: Recordings
+        bounds: Mapping, such as search parameters, with any of 'west', 'east', 'south' and
+            'north', in degrees
+
+    Returns:
+        Filtered queryset, or the queryset unchanged if there are no bounds or no index
+    """
+    sides = [side for side in BOUND_CONDITIONS if side in bounds]
+    if not sides or not location_index_available(connections[queryset.db]):
+        return queryset
+    conditions = ' AND '.join(BOUND_CONDITIONS[side] for side in sides)
+    return queryset.filter(id__in=RawSQL(
+        f'SELECT id FROM {LOCATION_INDEX_TABLE} WHERE {conditions}',
+        [float(bounds[side]) for side in sides]
+    ))
+
+
+def cell_size_for_zoom(zoom: int) -> float:
+    """
+    Size of heatmap cells for a map zoom level
+    Args:
+        zoom: Web map zoom level, from 0 for the whole world in one tile
+
+    Returns:
+        Width and height of each cell, in degrees
+    """
+    return 360.0 / (TILE_PIXELS * 2 ** zoom) * CELL_PIXELS
+
+
+def _group_by_cell(located: QuerySet, cell_size: float) -> QuerySet:
+    # Cells are numbered from the south west corner of the world, so that casting to integer,
+    # which truncates towards zero, always rounds down
+    return located.annotate(
+        row=Cast((F('latitude') + 90.0) / cell_size, IntegerField()),
+        column=Cast((F('longitude') + 180.0) / cell_size, IntegerField()),
+    ).values('row', 'column').annotate(value=Count('id'))
+
+
+def count_by_cell(queryset: QuerySet, cell_size: Optional[float] = None) -> List[Dict]:
+    """
+    Count located recordings in a grid of cells, in the database, so that a heatmap of any
+    number of recordings needs no more points than there are cells on the map
+    Args:
+        queryset: Recordings
+        cell_size: Width and height of each cell, in degrees; if None, recordings are counted by
+            their exact location
+
+    Returns:
+        List of {'lat', 'lng', 'value'}, the centre of each cell with recordings, and how many
+    """
+    located = queryset.filter(latitude__isnull=False, longitude__isnull=False).order_by()
+    if not cell_size:
+        return [
+            {'lat': row['latitude'], 'lng': row['longitude'], 'value': row['value']}
+            for row in located.values('latitude', 'longitude').annotate(value=Count('id'))
+        ]
+
+    cells = _group_by_cell(located, cell_size)
+    return [
+        {
+            'lat': round((cell['row'] + 0.5) * cell_size - 90.0, 6),
+            'lng': round((cell['column'] + 0.5) * cell_size - 180.0, 6),
+            'value': cell['value'],
+        }
+        for cell in cells
+    ]
+
+
+def highest_cell_count(queryset: QuerySet, cell_size: float) -> int:
+    """
+    Find the most recordings in any one cell of a grid
+    Args:
+        queryset: Recordings
+        cell_size: Width and height of each cell, in degrees
+
+    Returns:
+        Highest count, or 0 if no recordings have a location
+    """
+    located = queryset.filter(latitude__isnull=False, longitude__isnull=False).order_by()
+    return _group_by_cell(located, cell_size).aggregate(highest=Max('value'))['highest'] or 0
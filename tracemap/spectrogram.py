@@ -0,0 +1,272 @@
+"""
+Spectrogram image rendering with numpy, as an in-process alternative to SoX
+"""
+import io
+from math import ceil
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import png
+
+from .riff import RiffScan, scan_riff
+from .samples import map_samples, to_float
+
+
+# Defaults, matching the size of SoX's default spectrogram plot area
+DEFAULT_WIDTH = 800
+DEFAULT_HEIGHT = 257
+DYNAMIC_RANGE_DB = 120
+
+# Number of FFT frames read and transformed in one go, to bound memory use on long files
+FRAMES_PER_BLOCK = 2048
+
+# Colour map from silence to full scale, approximating SoX's default palette
+PALETTE_STOPS = (
+    (0.0, (0, 0, 0)),
+    (0.3, (96, 0, 128)),
+    (0.55, (208, 32, 32)),
+    (0.75, (255, 160, 0)),
+    (0.9, (255, 240, 64)),
+    (1.0, (255, 255, 255)),
+)
+
+
+def parse_frequency(value: str) -> float:
+    """
+    Parse a SoX-style frequency, eg '25k' or '200000'
+    Args:
+        value: frequency string
+
+    Returns:
+        Frequency in Hz
+    """
+    value = value.strip().lower()
+    if value.endswith('k'):
+        return float(value[:-1]) * 1000
+    return float(value)
+
+
+def parse_sox_prefilter(
+        effects: Sequence[str]
+) -> Tuple[Optional[float], Optional[float], Optional[float]]:
+    """
+    Find the rate, highpass and lowpass frequencies in a list of SoX effects,
+    eg ['rate', '200k', 'highpass', '25k', 'lowpass', '75k']
+
+    Args:
+        effects: SoX effects and their arguments, as in settings.SPECTROGRAM_PREFILTER
+
+    Returns:
+        Tuple of (rate, highpass, lowpass), each None if not present
+    """
+    found = {}
+    for index, effect in enumerate(effects):
+        if effect in ('rate', 'highpass', 'lowpass'):
+            # Skip any option flags, eg 'rate -v 200k'
+            arguments = [a for a in effects[index + 1:] if not a.startswith('-')]
+            if arguments:
+                found[effect] = parse_frequency(arguments[0])
+    return found.get('rate'), found.get('highpass'), found.get('lowpass')
+
+
+def build_palette(stops: Iterable[Tuple[float, Tuple[int, int, int]]] = PALETTE_STOPS) \
+        -> List[Tuple[int, int, int]]:
+    """
+    Interpolate a 256-entry RGB palette between color stops
+    Args:
+        stops: Sequence of (position 0-1, (r, g, b))
+
+    Returns:
+        List of RGB tuples
+    """
+    stops = list(stops)
+    positions = [s[0] for s in stops]
+    levels = np.linspace(0, 1, 256)
+    channels = [
+        np.interp(levels, positions, [s[1][k] for s in stops]).round().astype(int)
+        for k in range(3)
+    ]
+    return list(zip(*[c.tolist() for c in channels]))
+
+
+class SpectrogramRenderer:
+    """
+    Render spectrograms of uncompressed WAV files to PNG images
+
+    Audio is memory-mapped and transformed a block of FFT frames at a time, so memory use
+    doesn't depend on the length or sample rate of the recording.
+    """
+
+    def __init__(
+            self,
+            prefilter: Sequence[str] = (),
+            width: int = DEFAULT_WIDTH,
+            height: int = DEFAULT_HEIGHT
+    ):
+        self.display_rate, self.highpass, self.lowpass = parse_sox_prefilter(prefilter)
+        self.width = width
+        self.height = height
+        self.palette = build_palette()
+
+    def render_file(
+            self,
+            filename: str,
+            dest: str,
+            title: str = '',
+            credit: str = '',
+            riff_scan: Optional[RiffScan] = None
+    ) -> Tuple[int, int]:
+        """
+        Render the spectrogram of a file
+        Args:
+            filename: Source .wav file
+            dest: Destination .png file
+            title: Title to store in the image metadata
+            credit: Credit to store in the image metadata
+            riff_scan: Result of scanning the source file, if already available
+
+        Returns:
+            Image (width, height)
+
+        Raises:
+            ValueError if the file's sample format isn't supported
+        """
+        if riff_scan is None:
+            riff_scan = scan_riff(filename)
+        samples = map_samples(riff_scan)
+        return self.render(samples, riff_scan.wave_format.sample_rate, dest, title, credit)
+
+    def render(
+            self,
+            samples: np.ndarray,
+            sample_rate: int,
+            dest: str,
+            title: str = '',
+            credit: str = ''
+    ) -> Tuple[int, int]:
+        """
+        Render the spectrogram of the first channel of an array of samples
+        Args:
+            samples: (frames, channels) array, as from samples.map_samples
+            sample_rate: Sample rate in Hz
+            dest: Destination .png file
+            title: Title to store in the image metadata
+            credit: Credit to store in the image metadata
+
+        Returns:
+            Image (width, height)
+        """
+        levels = self.levels(samples[:, 0], sample_rate)
+        self.write_png(levels, dest, title, credit)
+        return self.width, self.height
+
+    def levels(self, channel: np.ndarray, sample_rate: int) -> np.ndarray:
+        """
+        Calculate the palette index of each pixel, with the highest frequency in the top row
+        Args:
+            channel: 1-D array of samples
+            sample_rate: Sample rate in Hz
+
+        Returns:
+            (height, width) uint8 array
+        """
+        display_rate = min(sample_rate, self.display_rate or sample_rate)
+        # Choose the FFT size so that the first `height` bins span 0 to display_rate / 2
+        fft_size = max(2, int(round(2 * (self.height - 1) * sample_rate / display_rate)))
+        window = np.hanning(fft_size).astype(np.float32)
+        scale = 2 / window.sum()  # A full-scale sine wave peaks at 0dB
+
+        frequencies = np.arange(self.height) * sample_rate / fft_size
+        out_of_band = np.zeros(self.height, dtype=bool)
+        if self.highpass:
+            out_of_band |= frequencies < self.highpass
+        if self.lowpass:
+            out_of_band |= frequencies > self.lowpass
+
+        image = np.zeros((self.height, self.width), dtype=np.uint8)
+        if not len(channel):
+            return image
+
+        frames_per_column = self.frames_per_column(len(channel), fft_size)
+        offsets = np.arange(fft_size)
+        frame_count = self.width * frames_per_column
+        power = np.zeros((self.width, self.height))
+        for first_frame in range(0, frame_count, FRAMES_PER_BLOCK):
+            frame_numbers = np.arange(first_frame, min(first_frame + FRAMES_PER_BLOCK, frame_count))
+            starts = self.frame_starts(frame_numbers, frames_per_column, len(channel), fft_size)
+            indices = starts[:, np.newaxis] + offsets  # (frames, fft_size)
+            in_range = (indices >= 0) & (indices < len(channel))
+            frames = to_float(channel[np.clip(indices, 0, len(channel) - 1)])
+            frames *= in_range * window
+            spectrum = np.fft.rfft(frames, axis=-1)[:, :self.height]
+            frame_power = np.square(np.abs(spectrum) * scale)  # (frames, height)
+
+            # Add up the power of the frames of each column in the block
+            columns = frame_numbers // frames_per_column
+            column_starts = np.flatnonzero(np.diff(columns, prepend=-1))
+            power[columns[column_starts]] += np.add.reduceat(frame_power, column_starts, axis=0)
+
+        decibels = 10 * np.log10(power / frames_per_column + 1e-20)
+        level = np.clip((decibels + DYNAMIC_RANGE_DB) / DYNAMIC_RANGE_DB, 0, 1)
+        level[:, out_of_band] = 0
+        image[:] = (level * 255).astype(np.uint8).T[::-1]
+        return image
+
+    def frames_per_column(self, sample_count: int, fft_size: int) -> int:
+        """
+        Choose how many FFT frames to average into each column. Frames are spaced at most half
+        their length apart, so that every sample falls within the middle of some frame, however
+        long the recording is
+        Args:
+            sample_count: Total number of samples
+            fft_size: Length of each frame
+
+        Returns:
+            Frames per column
+        """
+        return max(1, ceil(2 * sample_count / (self.width * fft_size)))
+
+    def frame_starts(
+            self, frame_numbers: np.ndarray, frames_per_column: int, sample_count: int,
+            fft_size: int
+    ) -> np.ndarray:
+        """
+        Find the start of FFT frames, spread evenly across the whole recording
+        Args:
+            frame_numbers: Frames to find, numbered from the start of the first column
+            frames_per_column: Frames in each column
+            sample_count: Total number of samples
+            fft_size: Length of each frame
+
+        Returns:
+            int array of the same shape; frames may overhang either end of the audio
+        """
+        step = sample_count / (frames_per_column * self.width)
+        centres = (frame_numbers + 0.5) * step
+        return centres.astype(np.int64) - fft_size // 2
+
+    def write_png(self, levels: np.ndarray, dest: str, title: str, credit: str):
+        """
+        Write palette index data to a PNG file, with title and credit as text chunks
+        Args:
+            levels: (height, width) uint8 array of palette indexes
+            dest: Destination .png file
+            title: Title text
+            credit: Credit text
+
+        Returns:
+            void
+        """
+        writer = png.Writer(
+            width=levels.shape[1], height=levels.shape[0], palette=self.palette, bitdepth=8
+        )
+        buffer = io.BytesIO()
+        writer.write(buffer, levels.tolist())
+        chunks = list(png.Reader(bytes=buffer.getvalue()).chunks())
+
+        text_chunks = [
+            (b'tEXt', keyword + b'\0' + text.encode('latin-1', 'replace'))
+            for keyword, text in ((b'Title', title), (b'Comment', credit)) if text
+        ]
+        with open(dest, 'wb') as file:
+            png.write_chunks(file, chunks[:1] + text_chunks + chunks[1:])  # After IHDR
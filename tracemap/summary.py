@@ -0,0 +1,52 @@
+"""
+Aggregation of recording counts into per-day, per-species summaries, independent of the database
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def summarise_day_rows(
+        rows: Iterable[Dict]
+) -> Tuple[Dict[Optional[str], Dict], Dict[str, List[str]]]:
+    """
+    Build the daily summary from recording counts grouped by day, genus and species, in a single
+    pass over the rows
+    Args:
+        rows: Dictionaries with 'day' ('YYYY-MM-DD' or None), 'genus', 'species' and 'count'
+
+    Returns:
+        Tuple of:
+            days: Map of day to {'day': day, 'count': total, 'genus': {genus: {species: count}}},
+                where every day lists every genus
+            genus_species: Map of genus to its sorted species abbreviations, in genus order
+    """
+    days = {}
+    genus_species = {}
+
+    for row in rows:
+        day_key = row['day']
+        genus_abbr = row['genus']
+        count = row['count']
+
+        day_summary = days.get(day_key)
+        if day_summary is None:
+            day_summary = days[day_key] = {'day': day_key, 'count': 0, 'genus': {}}
+        day_summary['count'] += count
+
+        day_genus = day_summary['genus'].get(genus_abbr)
+        if day_genus is None:
+            day_genus = day_summary['genus'][genus_abbr] = {}
+        day_genus[row['species']] = count
+
+        species_set = genus_species.get(genus_abbr)
+        if species_set is None:
+            species_set = genus_species[genus_abbr] = set()
+        species_set.add(row['species'])
+
+    genus_species = {g: sorted(genus_species[g]) for g in sorted(genus_species)}
+
+    # Templates look up every genus for every day, so fill in the gaps
+    for day_summary in days.values():
+        day_genus = day_summary['genus']
+        day_summary['genus'] = {g: day_genus.get(g, {}) for g in genus_species}
+
+    return days, genus_species
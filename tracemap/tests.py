@@ -1,7 +1,548 @@
 # flake8: noqa
 # pylint: skip-file
 
-from django.test import TestCase
+import io
+import os
+import struct
+import tempfile
+import wave
+from contextlib import redirect_stderr, redirect_stdout
+from datetime import date, datetime, timedelta, timezone
 
+import numpy as np
+from django.core.management import call_command
+from django.db import connection
+from django.http import Http404
+from django.test import RequestFactory, TestCase
+from svgwrite.container import Hyperlink
 
-# Create your tests here.
+from svg_calendar import DayLink, FastGridImage, GridImage
+
+from .management.commands import importaudiofile, watchsessions
+from .models import (AudioRecording, DailySpeciesSummary, DataVersion,
+                     ImportManifestEntry, Species)
+from .resampler import PolyphaseResampler
+from .riff import scan_riff
+from .spatial import (LOCATION_INDEX_TABLE, count_by_cell,
+                      filter_within_bounds, highest_cell_count,
+                      location_index_available)
+from .spectrogram import SpectrogramRenderer
+from .views import page_cursor, page_start, recordings_after
+
+
+def write_wav(path, samples, sample_rate=384000):
+    with wave.open(path, 'wb') as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(sample_rate)
+        file.writeframes(np.asarray(samples, dtype='<i2').tobytes())
+
+
+def import_quietly(*args):
+    output = io.StringIO()
+    with redirect_stdout(output):
+        call_command('importaudiofile', *args)
+    return output.getvalue()
+
+
+class ScanRiffTests(TestCase):
+    fmt = struct.pack('<HHIIHH', 1, 1, 384000, 768000, 2, 16)
+
+    def write_riff(self, chunks, size_adjustment=0):
+        body = b'WAVE'
+        for chunk_id, content, declared_size in chunks:
+            body += struct.pack('<4sI', chunk_id, declared_size) + content
+            if len(content) % 2:
+                body += b'\0'
+        file = tempfile.NamedTemporaryFile(suffix='.wav', delete=False)
+        self.addCleanup(os.remove, file.name)
+        file.write(b'RIFF' + struct.pack('<I', len(body) + size_adjustment) + body)
+        file.close()
+        return file.name
+
+    def test_odd_size_chunks_are_padded(self):
+        guano = b'GUANO|Version: 1.0\nSpecies Auto ID: Pippip\n'
+        guano += b'' if len(guano) % 2 else b'x'
+        data = b'\1\0' * 384
+        filename = self.write_riff([
+            (b'fmt ', self.fmt, len(self.fmt)),
+            (b'guan', guano, len(guano)),
+            (b'junk', b'abc', 3),
+            (b'data', data, len(data)),
+        ])
+        scan = scan_riff(filename)
+        self.assertEqual(scan.chunk(b'guan'), guano)
+        self.assertIsNone(scan.chunk(b'junk'))
+        self.assertEqual(scan.data_size, len(data))
+        with open(filename, 'rb') as file:
+            file.seek(scan.data_offset)
+            self.assertEqual(file.read(), data)
+        self.assertAlmostEqual(scan.duration, 0.001)
+
+    def test_truncated_data_chunk(self):
+        data = b'\1\0' * 3840
+        filename = self.write_riff([
+            (b'fmt ', self.fmt, len(self.fmt)),
+            (b'data', data, 2 * len(data)),
+        ], size_adjustment=len(data))
+        scan = scan_riff(filename)
+        self.assertEqual(scan.data_size, len(data))
+        self.assertAlmostEqual(scan.duration, 0.01)
+        self.assertEqual(scan.wave_format.sample_rate, 384000)
+
+    def test_rejects_other_files(self):
+        file = tempfile.NamedTemporaryFile(suffix='.wav', delete=False)
+        self.addCleanup(os.remove, file.name)
+        file.write(b'RIFF\0\0\0\0AVI LIST')
+        file.close()
+        with self.assertRaises(ValueError):
+            scan_riff(file.name)
+
+
+class FastGridImageTests(TestCase):
+    counts = {'2020-05-01': 3, '2020-06-30': 1, '2021-04-12': 12, '2022-08-09': 7}
+
+    @staticmethod
+    def link_rect(rect, day_date, _):
+        outer = Hyperlink('/byday/' + day_date.strftime('%Y-%m-%d'), '_self')
+        rect.update({'class_': 'dateTrigger'})
+        outer.add(rect)
+        return outer
+
+    @staticmethod
+    def link_day(rect, day_date, _):
+        outer = DayLink('/byday/' + day_date.strftime('%Y-%m-%d'), '_self')
+        rect.update({'class_': 'dateTrigger'})
+        outer.add(rect)
+        return outer
+
+    def test_svgwrite_decorator_is_applied(self):
+        expected = GridImage().set_day_rect_decorator(self.link_rect) \
+            .draw_daily_count_image(self.counts, True).tostring()
+        fast = FastGridImage().set_day_rect_decorator(self.link_rect)
+        self.assertEqual(fast.render_daily_count_image(self.counts, True), expected)
+
+    def test_markup_decorator_matches_svgwrite(self):
+        expected = GridImage().set_day_rect_decorator(self.link_rect) \
+            .draw_daily_count_image(self.counts, True).tostring()
+        fast = FastGridImage().set_day_markup_decorator(self.link_day)
+        self.assertEqual(fast.render_daily_count_image(self.counts, True), expected)
+
+    def test_decorator_attributes_are_escaped(self):
+        def decorate(rect, day_date, _):
+            outer = DayLink('/byday/?a=1&b="2"')
+            rect.update({'id': '<day>'})
+            outer.add(rect)
+            return outer
+
+        image = FastGridImage().set_day_markup_decorator(decorate) \
+            .render_daily_count_image({'2020-05-01': 3})
+        self.assertIn('xlink:href="/byday/?a=1&amp;b=&quot;2&quot;"', image)
+        self.assertIn('id="&lt;day&gt;"', image)
+
+    def test_no_days_draws_empty_calendar(self):
+        image = FastGridImage().render_daily_count_image({}, True)
+        self.assertTrue(image.startswith('<svg'))
+        self.assertTrue(image.endswith('</svg>'))
+        self.assertIn(f'>{date.today().year}</text>', image)
+        self.assertNotIn('<title>', image)
+        self.assertEqual(FastGridImage().render_daily_count_images({'a': {}}), {})
+
+
+def make_recording(when, genus='Pip', species='pip', **fields):
+    recording = AudioRecording(genus=genus, species=species, duration=2.0, **fields)
+    if when is not None:
+        recording.set_recording_time(when)
+    recording.save()
+    return recording
+
+
+class DailySpeciesSummaryTests(TestCase):
+    night = datetime(2021, 6, 1, 22, 30, tzinfo=timezone(timedelta(hours=1)))
+
+    def summary(self):
+        return {
+            (row.day, row.genus, row.species): (row.count, row.total_duration)
+            for row in DailySpeciesSummary.objects.all()
+        }
+
+    def setUp(self):
+        self.first = make_recording(self.night)
+        self.second = make_recording(self.night + timedelta(minutes=5))
+        self.other = make_recording(self.night, species='pyg')
+
+    def test_saves_keep_summary_up_to_date(self):
+        self.assertEqual(self.summary(), {
+            ('2021-06-01', 'Pip', 'pip'): (2, 4.0),
+            ('2021-06-01', 'Pip', 'pyg'): (1, 2.0),
+        })
+
+    def test_hiding_and_showing_recording(self):
+        self.first.hide = True
+        self.first.save()
+        self.assertEqual(self.summary()[('2021-06-01', 'Pip', 'pip')], (1, 2.0))
+
+        self.second.hide = True
+        self.second.save(update_fields=['hide'])
+        self.assertNotIn(('2021-06-01', 'Pip', 'pip'), self.summary())
+
+        self.first.hide = False
+        self.first.save()
+        self.assertEqual(self.summary()[('2021-06-01', 'Pip', 'pip')], (1, 2.0))
+
+    def test_deleting_recording(self):
+        self.other.delete()
+        self.assertEqual(self.summary(), {('2021-06-01', 'Pip', 'pip'): (2, 4.0)})
+        self.first.delete()
+        self.second.delete()
+        self.assertEqual(self.summary(), {})
+
+    def test_refresh_days_after_bulk_changes(self):
+        # Bulk updates and deletes don't send signals, so the summary is refreshed explicitly
+        AudioRecording.objects.filter(id=self.first.id).update(hide=True)
+        AudioRecording.objects.filter(id=self.other.id).delete()
+        undated = AudioRecording.objects.create(genus='Nyc', species='noc', duration=1.5)
+        AudioRecording.objects.filter(id=undated.id).update(duration=3.0)
+        DailySpeciesSummary.refresh_days(['2021-06-01', ''])
+        self.assertEqual(self.summary(), {
+            ('2021-06-01', 'Pip', 'pip'): (1, 2.0),
+            ('', 'Nyc', 'noc'): (1, 3.0),
+        })
+        self.assertEqual(self.summary(), {
+            (row.day, row.genus, row.species): (row.count, row.total_duration)
+            for row in DailySpeciesSummary.aggregate()
+        })
+
+
+class SpatialTests(TestCase):
+    points = [(51.501, -0.101), (51.502, -0.102), (51.509, -0.109), (52.203, 0.123), (-33.897, 151.203)]
+
+    def setUp(self):
+        for latitude, longitude in self.points:
+            make_recording(None, latitude=latitude, longitude=longitude)
+        make_recording(None)  # No location
+
+    def within(self, bounds):
+        recordings = AudioRecording.objects.filter(
+            latitude__gte=bounds['south'], latitude__lte=bounds['north'],
+            longitude__gte=bounds['west'], longitude__lte=bounds['east'],
+        )
+        return recordings, filter_within_bounds(recordings, bounds)
+
+    def test_index_is_used_and_finds_same_recordings(self):
+        if not location_index_available(connection):
+            self.skipTest('SQLite was built without the R*Tree module')
+        for bounds in [
+            {'south': 51.5, 'north': 51.505, 'west': -0.105, 'east': -0.1},
+            {'south': 50, 'north': 53, 'west': -1, 'east': 1},
+            {'south': -90, 'north': 90, 'west': -180, 'east': 180},
+            {'south': 10, 'north': 11, 'west': 10, 'east': 11},
+        ]:
+            with self.subTest(bounds=bounds):
+                plain, indexed = self.within(bounds)
+                self.assertIn(LOCATION_INDEX_TABLE, str(indexed.query))
+                self.assertEqual(set(indexed.values_list('id', flat=True)),
+                                 set(plain.values_list('id', flat=True)))
+        self.assertEqual(self.within({'south': 50, 'north': 53, 'west': -1, 'east': 1})[1].count(), 4)
+
+    def test_index_follows_changes(self):
+        if not location_index_available(connection):
+            self.skipTest('SQLite was built without the R*Tree module')
+        bounds = {'south': 10, 'north': 11, 'west': 10, 'east': 11}
+        recording = AudioRecording.objects.filter(latitude__isnull=True).get()
+        recording.latitude, recording.longitude = 10.5, 10.5
+        recording.save()
+        AudioRecording.objects.filter(latitude__lt=0).update(latitude=10.2, longitude=10.2)
+        self.assertEqual(self.within(bounds)[1].count(), 2)
+        AudioRecording.objects.filter(latitude=10.2).delete()
+        self.assertEqual(self.within(bounds)[1].count(), 1)
+
+    def test_count_by_cell(self):
+        cells = count_by_cell(AudioRecording.objects.all(), 0.01)
+        by_centre = {(cell['lat'], cell['lng']): cell['value'] for cell in cells}
+        self.assertEqual(by_centre, {
+            (51.505, -0.105): 3, (52.205, 0.125): 1, (-33.895, 151.205): 1,
+        })
+        self.assertEqual(highest_cell_count(AudioRecording.objects.all(), 0.01), 3)
+        self.assertEqual(highest_cell_count(AudioRecording.objects.none(), 0.01), 0)
+
+    def test_count_by_exact_location(self):
+        cells = count_by_cell(AudioRecording.objects.all())
+        self.assertEqual(sorted((c['lat'], c['lng'], c['value']) for c in cells),
+                         sorted((lat, lng, 1) for lat, lng in self.points))
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        night = datetime(2021, 6, 1, 22, 30, tzinfo=timezone.utc)
+        self.recordings = [
+            make_recording(None), make_recording(None),
+            make_recording(night), make_recording(night), make_recording(night),
+            make_recording(night + timedelta(minutes=1)),
+        ]
+
+    def walk_pages(self, size):
+        factory = RequestFactory()
+        pages, after = [], None
+        while True:
+            params = {'size': size, **({'after': after} if after else {})}
+            files, size, _ = page_start(AudioRecording.objects.all(), factory.get('/list', params))
+            page = list(files.values_list('recorded_at_utc', 'id')[:size])
+            if not page:
+                return pages
+            pages.append([recording_id for _, recording_id in page])
+            after = page_cursor(*page[-1])
+
+    def test_pages_cover_all_recordings_once_in_order(self):
+        expected = [recording.id for recording in self.recordings]
+        for size in range(1, 7):
+            with self.subTest(size=size):
+                pages = self.walk_pages(size)
+                self.assertEqual([recording_id for page in pages for recording_id in page], expected)
+                self.assertTrue(all(len(page) <= size for page in pages))
+
+    def test_after_undated_recording(self):
+        cursor = page_cursor(None, self.recordings[0].id)
+        after = recordings_after(AudioRecording.objects.all(), cursor)
+        self.assertEqual(set(after.values_list('id', flat=True)),
+                         {recording.id for recording in self.recordings[1:]})
+
+    def test_after_equal_timestamps(self):
+        middle = self.recordings[3]
+        after = recordings_after(AudioRecording.objects.all(),
+                                 page_cursor(middle.recorded_at_utc, middle.id))
+        self.assertEqual(set(after.values_list('id', flat=True)),
+                         {recording.id for recording in self.recordings[4:]})
+
+    def test_invalid_cursor(self):
+        for cursor in ['nonsense', 'yesterday_1', '_x']:
+            with self.subTest(cursor=cursor), self.assertRaises(Http404):
+                page_start(AudioRecording.objects.all(), RequestFactory().get('/list', {'after': cursor}))
+
+
+class DataVersionTests(TestCase):
+    def setUp(self):
+        self.recording = AudioRecording.objects.create(
+            identifier='TEST', recorded_at_iso='2021-06-01T22:00:00+01:00', genus='Pipistrellus',
+            species='pipistrellus', latitude=51.5, longitude=-0.1
+        )
+
+    def assert_bumps(self, expected, **save_kwargs):
+        before = DataVersion.current().version
+        self.recording.save(**save_kwargs)
+        self.assertEqual(DataVersion.current().version, before + (1 if expected else 0))
+
+    def test_media_saves_keep_version(self):
+        self.recording.spectrogram_image_file = 'spectrogram.png'
+        self.recording.spectrogram_image_width = 800
+        self.assert_bumps(
+            False, update_fields=['spectrogram_image_file', 'spectrogram_image_width']
+        )
+        self.recording.subsampled_audio_file = 'subsampled.wav'
+        self.assert_bumps(False)
+
+    def test_data_changes_bump_version(self):
+        self.recording.latitude = 52.0
+        self.assert_bumps(True)
+        self.recording.hide = True
+        self.assert_bumps(True, update_fields=['hide'])
+        self.recording.resolved_species = Species.objects.create(
+            genus='Pipistrellus', species='pipistrellus'
+        )
+        self.assert_bumps(True, update_fields=['resolved_species'])
+
+
+class ImportAudioFileTests(TestCase):
+    def test_empty_directory_on_empty_database(self):
+        output = io.StringIO()
+        with tempfile.TemporaryDirectory() as directory, redirect_stdout(output):
+            call_command('importaudiofile', directory)
+        self.assertIn('Found no files', output.getvalue())
+        self.assertFalse(AudioRecording.objects.exists())
+
+    def test_failed_files_are_reported_and_skipped(self):
+        with tempfile.TemporaryDirectory() as directory:
+            write_wav(os.path.join(directory, 'GOOD.wav'), np.arange(3840) % 100)
+            with open(os.path.join(directory, 'BAD.wav'), 'wb') as file:
+                file.write(b'not a recording' * 100)
+
+            for jobs in ('1', '2'):
+                with self.subTest(jobs=jobs):
+                    errors = io.StringIO()
+                    with redirect_stderr(errors):
+                        import_quietly(directory, '-f', '-j', jobs)
+                    self.assertIn('Failed to import', errors.getvalue())
+                    self.assertIn('BAD.wav', errors.getvalue())
+                    self.assertEqual(
+                        list(AudioRecording.objects.values_list('identifier', flat=True)),
+                        ['GOOD']
+                    )
+
+    def test_records_are_written_in_batches(self):
+        def summary(rows):
+            return sorted((row.day, row.genus, row.species, row.count) for row in rows)
+
+        with tempfile.TemporaryDirectory() as directory:
+            for number in range(5):
+                write_wav(os.path.join(directory, f'REC{number:04}.wav'), np.arange(3840) % 100)
+
+            output = import_quietly(directory, '-b', '2')
+            self.assertEqual(output.count('Saving 2 new and 0 updated records'), 2)
+            self.assertEqual(output.count('Saving 1 new and 0 updated records'), 1)
+            self.assertEqual(AudioRecording.objects.count(), 5)
+            self.assertEqual(summary(DailySpeciesSummary.objects.all()),
+                             summary(DailySpeciesSummary.aggregate()))
+            self.assertEqual(sum(row[3] for row in summary(DailySpeciesSummary.objects.all())), 5)
+
+            output = import_quietly(directory, '-f', '-b', '3')
+            self.assertEqual(output.count('Saving 0 new and 3 updated records'), 1)
+            self.assertEqual(output.count('Saving 0 new and 2 updated records'), 1)
+            self.assertEqual(AudioRecording.objects.count(), 5)
+            self.assertEqual(summary(DailySpeciesSummary.objects.all()),
+                             summary(DailySpeciesSummary.aggregate()))
+
+
+class ImportManifestTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(os.path.realpath(self.directory.name), 'REC0001.wav')
+        write_wav(self.path, np.arange(3840) % 100)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def entry(self):
+        entry = ImportManifestEntry()
+        entry.update_from_file(self.path)
+        return entry
+
+    def test_matches_unchanged_file(self):
+        self.assertTrue(self.entry().matches_file(self.path))
+
+    def test_matches_touched_file_by_header_hash(self):
+        entry = self.entry()
+        os.utime(self.path, (1000000, 1000000))
+        self.assertTrue(entry.matches_file(self.path))
+        self.assertEqual(entry.mtime, 1000000)
+
+    def test_rejects_changed_file(self):
+        entry = self.entry()
+        write_wav(self.path, np.arange(3840) % 50)
+        os.utime(self.path, (1000000, 1000000))
+        self.assertFalse(entry.matches_file(self.path))
+        write_wav(self.path, np.arange(4000) % 100)
+        self.assertFalse(entry.matches_file(self.path))
+
+    def test_changed_only_skips_unchanged_files(self):
+        import_quietly(self.directory.name, '-c')
+        self.assertIn('Unchanged since last import, skipping',
+                      import_quietly(self.directory.name, '-c'))
+
+        write_wav(self.path, np.arange(4000) % 100)
+        output = import_quietly(self.directory.name, '-c')
+        self.assertNotIn('Unchanged since last import', output)
+        self.assertEqual(ImportManifestEntry.objects.get().size, os.path.getsize(self.path))
+        self.assertEqual(AudioRecording.objects.count(), 1)
+
+    def test_existing_entries_are_updated_without_preloading(self):
+        import_quietly(self.directory.name)
+        write_wav(self.path, np.arange(4000) % 100)
+        import_quietly(self.directory.name)
+        self.assertEqual(ImportManifestEntry.objects.get().size, os.path.getsize(self.path))
+
+    def test_file_state_is_queued_without_queries(self):
+        command = importaudiofile.Command()
+        with self.assertNumQueries(0):
+            command.record_file_state(self.path)
+
+
+class WatchSessionsTests(TestCase):
+    class Importer:
+        def __init__(self):
+            self.imported = []
+            self.queued = 0
+            self.records_written = 0
+
+        def process_file(self, file):
+            if file.startswith('bad'):
+                raise ValueError('Truncated data chunk')
+            self.imported.append(file)
+            self.queued += 1
+
+        def flush_recordings(self):
+            self.records_written += self.queued
+            self.queued = 0
+
+        def warm_caches(self):
+            raise ValueError('min() arg is an empty sequence')
+
+    def test_failures_are_reported_and_batch_is_written(self):
+        importer = self.Importer()
+        errors = io.StringIO()
+        with redirect_stdout(io.StringIO()), redirect_stderr(errors):
+            watchsessions.Command.import_files(importer, ['a.wav', 'bad.wav', 'b.wav'])
+        self.assertEqual(importer.imported, ['a.wav', 'b.wav'])
+        self.assertEqual(importer.records_written, 2)
+        self.assertIn('bad.wav', errors.getvalue())
+        self.assertIn('Failed to render cached pages', errors.getvalue())
+
+
+class PolyphaseResamplerTests(TestCase):
+    source_rate = 384000
+    target_rate = 44100
+
+    def gain_db(self, frequency):
+        # Level of a tone after resampling, away from the ends where the filter runs off the audio
+        resampler = PolyphaseResampler(self.source_rate, self.target_rate)
+        t = np.arange(self.source_rate // 5) / self.source_rate
+        samples = (0.5 * np.sin(2 * np.pi * frequency * t) * 32767).astype(np.int16)[:, None]
+        output = resampler.resample_block(samples, 0, resampler.output_length(len(samples)))
+        rms = np.sqrt(np.mean(np.square(output[2000:-2000, 0])))
+        return 20 * np.log10(rms / (0.5 / np.sqrt(2)))
+
+    def test_passband_is_kept(self):
+        for frequency in [1000, 5000, 15000]:
+            with self.subTest(frequency=frequency):
+                self.assertLess(abs(self.gain_db(frequency)), 0.1)
+
+    def test_stopband_is_removed(self):
+        # Above the target Nyquist frequency, tones would alias into the audible range
+        for frequency in [30000, 45000, 100000]:
+            with self.subTest(frequency=frequency):
+                self.assertLess(self.gain_db(frequency), -55)
+
+    def test_file_has_target_rate_and_length(self):
+        resampler = PolyphaseResampler(self.source_rate, self.target_rate)
+        samples = np.zeros((38400, 2), dtype=np.int16)
+        with tempfile.TemporaryDirectory() as directory:
+            dest = os.path.join(directory, 'subsampled.wav')
+            resampler.resample_to_file(samples, dest)
+            with wave.open(dest) as file:
+                self.assertEqual(file.getframerate(), self.target_rate)
+                self.assertEqual(file.getnchannels(), 2)
+                self.assertEqual(file.getnframes(), 4410)
+
+
+class SpectrogramRendererTests(TestCase):
+    sample_rate = 384000
+
+    def tone(self, seconds, frequency):
+        t = np.arange(int(seconds * self.sample_rate)) / self.sample_rate
+        return (0.5 * np.sin(2 * np.pi * frequency * t) * 32767).astype(np.int16)
+
+    def test_short_tone_anywhere_in_long_file_is_drawn(self):
+        renderer = SpectrogramRenderer(['rate', '200k', 'highpass', '25k', 'lowpass', '75k'])
+        sample_count = 60 * self.sample_rate
+        column_span = sample_count / renderer.width
+        call = self.tone(0.003, 45000)
+
+        # Centred on column boundaries, between the frames of a sparser sampling, and at each end
+        for start in [0, int(100.5 * column_span), int(555 * column_span) - len(call) // 2,
+                      sample_count - len(call)]:
+            with self.subTest(start=start):
+                channel = np.zeros(sample_count, dtype=np.int16)
+                channel[start:start + len(call)] = call
+                levels = renderer.levels(channel, self.sample_rate)
+                column = int(start / column_span)
+                self.assertGreater(levels[:, max(0, column - 1):column + 2].max(), 128)
+                self.assertEqual(levels[:, :max(0, column - 2)].max(initial=0), 0)
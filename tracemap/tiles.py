@@ -0,0 +1,303 @@
+"""
+PNG map tiles of the density of recordings, for any search, cached on disk by data version
+
+Tiles follow the XYZ scheme of web maps: at zoom level z, the Web Mercator map of the world is
+2^z tiles across and down, numbered from the north west corner. Each tile counts recordings in
+square cells of a few pixels, coloured between the calendar's low and high colours.
+"""
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from math import atan, degrees, log1p, pi, sinh
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+import png
+from django.db.models import QuerySet
+
+from batbox import settings
+from svg_calendar import COLOR_HIGH, COLOR_LOW
+
+from .models import DataVersion
+from .spatial import (CELL_PIXELS, TILE_PIXELS, cell_size_for_zoom,
+                      filter_within_bounds, highest_cell_count)
+
+
+# Tiles deeper than this would show little more than single recordings
+MAX_TILE_ZOOM = 18
+
+# Web Mercator leaves out the poles; this latitude maps to the top of the world's square
+MAX_LATITUDE = 85.0511287798
+
+# Search parameters that change the tiles; map bounds are set by each tile
+TILE_SEARCH_PARAMS = ('species', 'start', 'end')
+
+# Palette index 0 is transparent, for cells without recordings; the rest graduate from the low
+# to the high colour, partly transparent so that the map shows through
+TILE_OPACITY = 208
+TILE_PALETTE: List[Tuple[int, int, int, int]] = [(0, 0, 0, 0)] + [
+    tuple(
+        [round(low + (high - low) * step / 254) for low, high in zip(COLOR_LOW, COLOR_HIGH)]
+        + [TILE_OPACITY]
+    )
+    for step in range(255)
+]
+
+
+def tile_bounds(zoom: int, x: int, y: int) -> Dict[str, float]:
+    """
+    Get the area covered by a tile
+    Args:
+        zoom: Zoom level
+        x: Column, from the west
+        y: Row, from the north
+
+    Returns:
+        Map of 'south', 'west', 'north' and 'east' to degrees, as search parameters
+    """
+    tiles = 2 ** zoom
+
+    def latitude(row: int) -> float:
+        return degrees(atan(sinh(pi * (1 - 2 * row / tiles))))
+
+    return {
+        'south': latitude(y + 1),
+        'west': x / tiles * 360.0 - 180.0,
+        'north': latitude(y),
+        'east': (x + 1) / tiles * 360.0 - 180.0,
+    }
+
+
+def to_pixels(latitudes: np.ndarray, longitudes: np.ndarray, zoom: int) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Project locations onto the map of the world at a zoom level
+    Args:
+        latitudes: Degrees
+        longitudes: Degrees
+        zoom: Zoom level
+
+    Returns:
+        Tuple of (x, y) pixel positions, from the north west corner of the world
+    """
+    size = TILE_PIXELS * 2 ** zoom
+    radians = np.radians(np.clip(latitudes, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (longitudes + 180.0) / 360.0 * size
+    y = (1 - np.log(np.tan(radians) + 1 / np.cos(radians)) / pi) / 2 * size
+    return x, y
+
+
+def tile_png(x: np.ndarray, y: np.ndarray, scale_max: int) -> bytes:
+    """
+    Draw a tile from the positions of recordings within it
+    Args:
+        x: Pixel positions, from the west edge of the tile
+        y: Pixel positions, from the north edge of the tile
+        scale_max: Count given the high colour; lower counts are graduated on a log scale
+
+    Returns:
+        PNG image
+    """
+    cells = TILE_PIXELS // CELL_PIXELS
+    counts, _, _ = np.histogram2d(y, x, bins=cells, range=[[0, TILE_PIXELS], [0, TILE_PIXELS]])
+
+    levels = np.zeros(counts.shape, dtype=np.uint8)
+    occupied = counts > 0
+    if occupied.any():
+        fractions = np.minimum(np.log1p(counts[occupied]) / log1p(max(scale_max, 1)), 1)
+        levels[occupied] = 1 + np.round(fractions * 254).astype(np.uint8)
+    pixels = levels.repeat(CELL_PIXELS, axis=0).repeat(CELL_PIXELS, axis=1)
+
+    writer = png.Writer(width=TILE_PIXELS, height=TILE_PIXELS, palette=TILE_PALETTE, bitdepth=8)
+    buffer = io.BytesIO()
+    writer.write(buffer, pixels.tolist())
+    return buffer.getvalue()
+
+
+def located_positions(recordings: QuerySet) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the locations of recordings as arrays
+    Args:
+        recordings: Recordings
+
+    Returns:
+        Tuple of (latitudes, longitudes), for recordings with a location
+    """
+    located = recordings.filter(latitude__isnull=False, longitude__isnull=False).order_by()
+    rows = np.array(list(located.values_list('latitude', 'longitude')), dtype=float)
+    if not rows.size:
+        return np.empty(0), np.empty(0)
+    return rows[:, 0], rows[:, 1]
+
+
+class DensityTiles:
+    """
+    Tiles of the recordings matching a search, rendered on first request and kept on disk
+
+    Tiles are stored under the data version, so are never stale; directories of earlier versions
+    are removed when the first tile of a new version is written.
+    """
+
+    def __init__(
+            self, recordings: QuerySet, data_version: DataVersion,
+            search_params: Mapping[str, str], cache_dir: Optional[str] = None
+    ):
+        """
+        Args:
+            recordings: Recordings matching the search
+            data_version: Current data version
+            search_params: The search's parameters, identifying its tiles
+            cache_dir: Directory of tiles, by default settings.TILE_CACHE_DIR
+        """
+        self.recordings = recordings
+        self.cache_dir = cache_dir or getattr(
+            settings, 'TILE_CACHE_DIR', os.path.join(settings.BASE_DIR, 'data', 'tiles')
+        )
+        self.version_dir = os.path.join(self.cache_dir, data_version.token)
+        self.search_dir = os.path.join(self.version_dir, self.search_key(search_params))
+        self.scales: Dict[int, int] = {}
+
+    @staticmethod
+    def search_key(search_params: Mapping[str, str]) -> str:
+        """
+        Name the tiles of a search by its parameters
+        Args:
+            search_params: Search parameters; those that don't affect tiles are ignored
+
+        Returns:
+            Directory name
+        """
+        terms = [f'{k}={search_params[k]}' for k in TILE_SEARCH_PARAMS if k in search_params]
+        if not terms:
+            return 'all'
+        return hashlib.sha1('&'.join(terms).encode('utf-8')).hexdigest()[:16]
+
+    def tile_path(self, zoom: int, x: int, y: int) -> str:
+        """
+        Get where a tile is kept
+        Args:
+            zoom: Zoom level
+            x: Column, from the west
+            y: Row, from the north
+
+        Returns:
+            Path of the PNG file
+        """
+        return os.path.join(self.search_dir, str(zoom), str(x), f'{y}.png')
+
+    def scale_max(self, zoom: int) -> int:
+        """
+        Get the count given the high colour at a zoom level: the most recordings in any cell,
+        counted in cells about the size of a tile's, and kept with the tiles
+        Args:
+            zoom: Zoom level
+
+        Returns:
+            Count
+        """
+        if zoom not in self.scales:
+            path = os.path.join(self.search_dir, str(zoom), 'scale')
+            try:
+                with open(path) as file:
+                    self.scales[zoom] = int(file.read())
+            except (OSError, ValueError):
+                self.scales[zoom] = highest_cell_count(self.recordings, cell_size_for_zoom(zoom))
+                self.write(path, str(self.scales[zoom]).encode('ascii'))
+        return self.scales[zoom]
+
+    def tile(self, zoom: int, x: int, y: int) -> bytes:
+        """
+        Get a tile, rendering it if it isn't on disk yet
+        Args:
+            zoom: Zoom level
+            x: Column, from the west
+            y: Row, from the north
+
+        Returns:
+            PNG image
+        """
+        path = self.tile_path(zoom, x, y)
+        try:
+            with open(path, 'rb') as file:
+                return file.read()
+        except OSError:
+            pass
+
+        bounds = tile_bounds(zoom, x, y)
+        in_tile = filter_within_bounds(self.recordings.filter(
+            latitude__gte=bounds['south'], latitude__lte=bounds['north'],
+            longitude__gte=bounds['west'], longitude__lte=bounds['east'],
+        ), bounds)
+        pixel_x, pixel_y = to_pixels(*located_positions(in_tile), zoom)
+        image = tile_png(pixel_x - x * TILE_PIXELS, pixel_y - y * TILE_PIXELS,
+                         self.scale_max(zoom))
+        self.write(path, image)
+        return image
+
+    def render_zoom(self, zoom: int, latitudes: np.ndarray, longitudes: np.ndarray) -> int:
+        """
+        Render every tile with recordings at a zoom level, from their locations, rather than
+        searching for the recordings in each tile. Tiles already on disk are kept
+        Args:
+            zoom: Zoom level
+            latitudes: Of all the recordings, as from located_positions
+            longitudes: Of all the recordings
+
+        Returns:
+            Number of tiles rendered
+        """
+        pixel_x, pixel_y = to_pixels(latitudes, longitudes, zoom)
+        last_tile = 2 ** zoom - 1
+        columns = np.clip(pixel_x // TILE_PIXELS, 0, last_tile).astype(np.int64)
+        rows = np.clip(pixel_y // TILE_PIXELS, 0, last_tile).astype(np.int64)
+
+        # Sort recordings by tile, to take each tile's as a slice
+        keys = columns * (last_tile + 1) + rows
+        order = np.argsort(keys, kind='stable')
+        tile_keys, starts = np.unique(keys[order], return_index=True)
+        ends = list(starts[1:]) + [len(order)]
+
+        rendered = 0
+        for key, start, end in zip(tile_keys.tolist(), starts.tolist(), ends):
+            x, y = divmod(key, last_tile + 1)
+            path = self.tile_path(zoom, x, y)
+            if os.path.exists(path):
+                continue
+            in_tile = order[start:end]
+            self.write(path, tile_png(pixel_x[in_tile] - x * TILE_PIXELS,
+                                      pixel_y[in_tile] - y * TILE_PIXELS,
+                                      self.scale_max(zoom)))
+            rendered += 1
+        return rendered
+
+    def write(self, path: str, content: bytes):
+        """
+        Write a file atomically, so that other processes never read part of it, first removing
+        the tiles of earlier data versions if this is the first for this version
+        Args:
+            path: Destination, within this version's directory
+            content: File content
+        """
+        if not os.path.isdir(self.version_dir):
+            self.remove_other_versions()
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as file:
+            file.write(content)
+        # Temporary files are only readable by their owner, and the web server may not be
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+
+    def remove_other_versions(self):
+        """
+        Remove the tiles of every data version but this one
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if path != self.version_dir and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,176 @@
+"""
+Collection and reporting of the time spent in each stage of an import
+"""
+import heapq
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+# Stages in the order they're reported; each is timed per file unless noted
+STAGES = (
+    'scan',  # Finding files, once per import
+    'preload',  # Loading existing records and manifest, once per import
+    'lookup',
+    'parse',
+    'duration',
+    'subsample',
+    'spectrogram',
+    'write',  # Saving a batch of records
+)
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile of a sorted, non-empty sequence
+    Args:
+        sorted_values: Values in ascending order
+        fraction: Percentile as a fraction, eg 0.95
+
+    Returns:
+        Value
+    """
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+class ImportTimings:
+    """
+    Times taken by each stage of an import, overall and for the slowest files
+    """
+
+    def __init__(self, slowest_count: int = 10):
+        self.started = time.perf_counter()
+        self.slowest_count = slowest_count
+        self.stages: Dict[str, List[float]] = defaultdict(list)
+        self.in_progress: Dict[str, Dict[str, float]] = defaultdict(dict)
+        self.slowest: List[Tuple[float, int, str, Dict[str, float]]] = []
+        self.files_checked = 0
+        self.files_imported = 0
+
+    @contextmanager
+    def stage(self, name: str, filename: Optional[str] = None) -> Iterator[None]:
+        """
+        Time a block of code
+        Args:
+            name: Stage name, from STAGES
+            filename: File being processed, or None for stages that cover a whole import
+
+        Returns:
+            Context manager
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if filename is None:
+                self.stages[name].append(elapsed)
+            else:
+                file_stages = self.in_progress[filename]
+                file_stages[name] = file_stages.get(name, 0.0) + elapsed
+
+    def take_file(self, filename: str) -> Dict[str, float]:
+        """
+        Remove and return the stage times recorded so far for a file, eg to pass them from a
+        worker process back to the main one
+        """
+        return self.in_progress.pop(filename, {})
+
+    def add_file(self, filename: str, file_stages: Dict[str, float]):
+        """
+        Add stage times recorded elsewhere for a file
+        """
+        in_progress = self.in_progress[filename]
+        for name, elapsed in file_stages.items():
+            in_progress[name] = in_progress.get(name, 0.0) + elapsed
+
+    def finish_file(self, filename: str, imported: bool):
+        """
+        Add a file's stage times to the totals
+        Args:
+            filename: File that has been processed
+            imported: Whether it was imported, rather than skipped
+
+        Returns:
+            void
+        """
+        file_stages = self.take_file(filename)
+        for name, elapsed in file_stages.items():
+            self.stages[name].append(elapsed)
+        self.files_checked += 1
+        if imported:
+            self.files_imported += 1
+
+        # The count breaks ties, so that stage dictionaries are never compared
+        entry = (sum(file_stages.values()), self.files_checked, filename, file_stages)
+        if len(self.slowest) < self.slowest_count:
+            heapq.heappush(self.slowest, entry)
+        elif entry[0] > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def summary(self) -> Dict:
+        """
+        Summarise the times taken
+        Returns:
+            json-serializable dictionary
+        """
+        elapsed = time.perf_counter() - self.started
+        stages = {}
+        for name in STAGES + tuple(sorted(set(self.stages) - set(STAGES))):
+            values = sorted(self.stages.get(name, []))
+            if not values:
+                continue
+            stages[name] = {
+                'count': len(values),
+                'total': sum(values),
+                'p50': percentile(values, 0.5),
+                'p95': percentile(values, 0.95),
+                'max': values[-1],
+            }
+
+        return {
+            'elapsed': elapsed,
+            'files_checked': self.files_checked,
+            'files_imported': self.files_imported,
+            'files_per_second': self.files_checked / elapsed if elapsed else None,
+            'stages': stages,
+            'slowest_files': [
+                {'file': filename, 'seconds': total, 'stages': file_stages}
+                for total, _, filename, file_stages in sorted(self.slowest, reverse=True)
+            ],
+        }
+
+    def print_summary(self):
+        """
+        Print a human-readable summary
+        """
+        summary = self.summary()
+        print(
+            f'Checked {summary["files_checked"]} files ({summary["files_imported"]} imported) '
+            f'in {summary["elapsed"]:.1f}s, {summary["files_per_second"] or 0:.1f} files/s'
+        )
+        if summary['stages']:
+            print(f'{"Stage":<12} {"count":>7} {"total":>9} {"p50":>8} {"p95":>8} {"max":>8}')
+            for name, stats in summary['stages'].items():
+                print(
+                    f'{name:<12} {stats["count"]:>7} {stats["total"]:>8.2f}s '
+                    f'{stats["p50"]:>7.3f}s {stats["p95"]:>7.3f}s {stats["max"]:>7.3f}s'
+                )
+        if summary['slowest_files']:
+            print('Slowest files:')
+            for entry in summary['slowest_files']:
+                breakdown = ', '.join(
+                    f'{name} {elapsed:.2f}s' for name, elapsed in
+                    sorted(entry['stages'].items(), key=lambda item: -item[1])
+                )
+                print(f'{entry["seconds"]:>8.2f}s {entry["file"]} ({breakdown})')
+
+    def write_report(self, filename: str):
+        """
+        Write the summary to a JSON file
+        """
+        with open(filename, 'w', encoding='utf-8') as file:
+            json.dump(self.summary(), file, indent=2)
@@ -9,6 +9,7 @@ from . import views
 urlpatterns = [
     path('', views.index, name='index'),
     path('calendar', views.calendar, name='calendar'),
+    path('dashboard', views.dashboard, name='dashboard'),
     path('byday/<str:date_string>', views.day, name='day_view'),
     path('list', views.list_all, name='list_view'),
     path('recording/<int:primary_key>', views.single, name='single_view'),
@@ -20,6 +21,8 @@ urlpatterns = [
     ),
     path('search', views.search, name='search_view'),
     path('api/search', views.search_api, name='search_api'),
+    path('api/traces', views.traces_api, name='traces_api'),
+    path('tiles/<int:zoom>/<int:x>/<int:y>.png', views.density_tile, name='density_tile'),
     path(
         'img/species_marker/<str:genus_name>.<str:species_name>',
         views.species_marker,
@@ -3,29 +3,51 @@ Module views, responding to routed URLs
 """
 # pylint: disable=R0914
 # - Can't modify number of views - can we refactor to class?
+from collections import defaultdict
 from datetime import date, datetime, timedelta
+from itertools import islice
+from math import isfinite
 from os import path
-from typing import List, Tuple
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+from urllib.parse import urlencode
 
 from dateutil.parser import parse as parse_date
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
-from django.db.models import Count, Max, Min
-from django.db.models.functions import Substr
-from django.http import Http404, HttpRequest, HttpResponse, JsonResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, F, Max, Min, Q, QuerySet, Sum
+from django.http import (Http404, HttpRequest, HttpResponse, JsonResponse,
+                         StreamingHttpResponse)
 from django.template import loader, response
-from svgwrite import Drawing, shapes
-from svgwrite.container import Hyperlink
+from django.urls import reverse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from svgwrite import Drawing
 from svgwrite.path import Path
 from svgwrite.text import Text
 
 from batbox import settings
-from svg_calendar import GridImage
-from tracemap.models import AudioRecording
+from svg_calendar import DayLink, DayRect, FastGridImage
+from tracemap.models import (QUERY_BATCH_SIZE, AudioRecording,
+                             DailySpeciesSummary, DataVersion, Species)
 
 from .repository import NonUniqueSpeciesLookup, SpeciesLookup
+from .spatial import (MAX_ZOOM, cell_size_for_zoom, count_by_cell,
+                      filter_within_bounds)
+from .summary import summarise_day_rows
+from .tiles import MAX_TILE_ZOOM, TILE_SEARCH_PARAMS, DensityTiles
 
 
-def decorate_rect_with_class(rect: shapes.Rect, day_date: date, _):
+# Recordings on each page of list views, by default and at most
+RECORDINGS_PAGE_SIZE = 500
+MAX_RECORDINGS_PAGE_SIZE = 5000
+PAGE_PARAMS = ('after', 'size')
+
+# Cached pages are keyed by data version, so are never stale; old versions just expire
+PAGE_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def decorate_rect_with_class(rect: DayRect, day_date: date, _) -> DayLink:
     """
     Decorator for day squares for SVG calendar view
     Args:
@@ -36,8 +58,8 @@ def decorate_rect_with_class(rect: shapes.Rect, day_date: date, _):
     Returns:
 
     """
-    day_string = day_date.strftime('%Y-%m-%d')
-    outer = Hyperlink('/byday/' + day_string, '_self')
+    day_string = day_date.isoformat()
+    outer = DayLink('/byday/' + day_string, '_self')
     rect.update({'class_': 'dateTrigger'})
     rect.update({'id': 'calday-' + day_string})
     outer.add(rect)
@@ -68,6 +90,68 @@ def index(request):
     return HttpResponse(template.render(context, request))
 
 
+def request_data_version(request: HttpRequest) -> DataVersion:
+    """
+    Get the data version, reading it only once for each request
+    Args:
+        request:
+
+    Returns:
+        DataVersion
+    """
+    if not hasattr(request, 'data_version'):
+        request.data_version = DataVersion.current()
+    return request.data_version
+
+
+def calendar_svg(data_version: DataVersion) -> str:
+    """
+    Draw the calendar of recording counts, or get it from the cache
+    Args:
+        data_version: Current data version
+
+    Returns:
+        SVG document
+    """
+    key = f'calendar-svg:{data_version.token}'
+    image = cache.get(key)
+    if image is None:
+        counts_by_day = list_counts_by_day()
+        grid_image = FastGridImage().set_day_markup_decorator(decorate_rect_with_class)
+        image = grid_image.render_daily_count_image(counts_by_day, True)
+        cache.set(key, image, PAGE_CACHE_TIMEOUT)
+    return image
+
+
+def render_calendar_page(data_version: DataVersion) -> str:
+    """
+    Render the calendar page, or get it from the cache. The page doesn't depend on the request,
+    so it can be rendered ahead of time, eg after an import
+    Args:
+        data_version: Current data version
+
+    Returns:
+        HTML
+    """
+    key = f'calendar-page:{data_version.token}'
+    page = cache.get(key)
+    if page is None:
+        template = loader.get_template('tracemap/calendar.html')
+        page = template.render({'calendar_svg': calendar_svg(data_version)})
+        cache.set(key, page, PAGE_CACHE_TIMEOUT)
+    return page
+
+
+# Pages that only change with the data; clients must revalidate them each time, and get a 304
+# response if no recordings have changed
+revalidate_by_data_version = condition(
+    etag_func=lambda request, *args, **kwargs: request_data_version(request).token,
+    last_modified_func=lambda request, *args, **kwargs: request_data_version(request).updated_at
+)
+
+
+@cache_control(no_cache=True)
+@revalidate_by_data_version
 def calendar(request):
     """
     Create a calendar view recordings
@@ -78,17 +162,135 @@ def calendar(request):
     Returns:
 
     """
-    template = loader.get_template('tracemap/calendar.html')
+    return HttpResponse(render_calendar_page(request_data_version(request)))
 
-    counts_by_day = list_counts_by_day()
 
-    grid_image = GridImage().set_day_rect_decorator(decorate_rect_with_class)
-    image = grid_image.draw_daily_count_image(counts_by_day, True).tostring()
+DASHBOARD_GROUPINGS = ('species', 'recorder')
 
-    context = {
-        'calendar_svg': image,
-    }
-    return HttpResponse(template.render(context, request))
+
+def daily_counts_by_species() -> Dict[Tuple[str, str], Dict[str, int]]:
+    """
+    Get the number of recordings of each species on each day, from the daily summary
+    Returns:
+        Map of (genus, species) abbreviations to map of day to count
+    """
+    series = defaultdict(dict)
+    rows = DailySpeciesSummary.objects \
+        .exclude(day='') \
+        .values_list('genus', 'species', 'day', 'count') \
+        .order_by()
+    for genus_abbr, species_abbr, day_string, count in rows.iterator():
+        series[(genus_abbr, species_abbr)][day_string] = count
+    return series
+
+
+def daily_counts_by_recorder() -> Dict[str, Dict[str, int]]:
+    """
+    Get the number of recordings made by each recorder on each day
+    Returns:
+        Map of recorder serial number to map of day to count
+    """
+    series = defaultdict(dict)
+    rows = AudioRecording.objects \
+        .filter(hide=False, recorded_date__isnull=False) \
+        .values_list('recorder_serial', 'recorded_date') \
+        .annotate(count=Count('id')) \
+        .order_by()
+    for serial, recorded_date, count in rows.iterator():
+        series[serial][recorded_date.isoformat()] = count
+    return series
+
+
+def dashboard_panels(grouping: str) -> Tuple[List[dict], Optional[str]]:
+    """
+    Draw a calendar for each species or recorder, from one grouped query, most active first
+    Args:
+        grouping: One of DASHBOARD_GROUPINGS
+
+    Returns:
+        Tuple of:
+            panels: List of {'title', 'subtitle', 'link', 'count', 'calendar_svg'}
+            legend_svg: Colour scale shared by all panels, or None if there are no recordings
+    """
+    if grouping == 'recorder':
+        series = daily_counts_by_recorder()
+    else:
+        series = daily_counts_by_species()
+    series = dict(sorted(series.items(), key=lambda item: -sum(item[1].values())))
+
+    grid_image = FastGridImage().set_day_markup_decorator(decorate_rect_with_class)
+    images = grid_image.render_daily_count_images(series)
+    if not images:
+        return [], None
+
+    species_by_pair = SpeciesLookup().species_by_abbreviation_pairs(series) \
+        if grouping == 'species' else {}
+
+    panels = []
+    for key, image in images.items():
+        panel = {'count': sum(series[key].values()), 'calendar_svg': image}
+        if grouping == 'recorder':
+            panel.update({'title': key or 'Unknown recorder', 'subtitle': None, 'link': None})
+        else:
+            genus_abbr, species_abbr = key
+            species_record = species_by_pair[key]
+            if genus_abbr and species_abbr:
+                link = reverse('species_view', args=key)
+            elif genus_abbr:
+                link = reverse('genus_view', args=[genus_abbr])
+            else:
+                link = None
+            panel.update({
+                'title': f'{genus_abbr or "?"} {species_abbr or "?"}',
+                'subtitle': species_record.common_name if species_record else None,
+                'link': link,
+            })
+        panels.append(panel)
+
+    return panels, grid_image.render_legend(grid_image.series_max(series), 'Recordings')
+
+
+def render_dashboard_page(data_version: DataVersion, grouping: str) -> str:
+    """
+    Render the dashboard page, or get it from the cache
+    Args:
+        data_version: Current data version
+        grouping: One of DASHBOARD_GROUPINGS
+
+    Returns:
+        HTML
+    """
+    key = f'dashboard-{grouping}:{data_version.token}'
+    page = cache.get(key)
+    if page is None:
+        panels, legend_svg = dashboard_panels(grouping)
+        template = loader.get_template('tracemap/dashboard.html')
+        page = template.render({
+            'grouping': grouping,
+            'groupings': DASHBOARD_GROUPINGS,
+            'panels': panels,
+            'legend_svg': legend_svg,
+        })
+        cache.set(key, page, PAGE_CACHE_TIMEOUT)
+    return page
+
+
+@cache_control(no_cache=True)
+@revalidate_by_data_version
+def dashboard(request):
+    """
+    Show a small calendar of activity for each species, or each recorder
+
+    Args:
+        request: May have 'by' parameter of 'species' (default) or 'recorder'
+
+    Returns:
+
+    """
+    grouping = request.GET.get('by', 'species')
+    if grouping not in DASHBOARD_GROUPINGS:
+        raise Http404(f'Unknown grouping {grouping}')
+    return HttpResponse(render_dashboard_page(request_data_version(request), grouping))
 
 
 def day(request, date_string):
@@ -101,19 +303,12 @@ def day(request, date_string):
     Returns:
         HTTP response containing formatted output
     """
-    if date_string == 'undated':
-        files = AudioRecording.objects.filter(recorded_at__isnull=True, hide=False)
-    else:
-        (year, month, day_number) = date_string.split('-')
-        date_start = datetime(int(year), int(month), int(day_number))
-        date_end = date_start + timedelta(days=1)
-        files = AudioRecording.objects.filter(
-            recorded_at_iso__gte=date_start.isoformat(),
-            recorded_at_iso__lte=date_end.isoformat(),
-            hide=False
-        )
-
-    if len(files) == 0:
+    list_params = {'day': date_string}
+    try:
+        files = recordings_for_list(list_params)
+    except ValueError as error:
+        raise Http404('Invalid date') from error
+    if not files.exists():
         raise Http404("No records")
 
     context = {
@@ -121,7 +316,7 @@ def day(request, date_string):
         'og_title': f'Echolocation recordings from {date_string}',
         'og_description': 'Visualisation, location and playback'
     }
-    return display_recordings_list(files, request, context)
+    return display_recordings_page(files, request, context, list_params)
 
 
 def list_all(request):
@@ -133,15 +328,13 @@ def list_all(request):
     Returns:
         HTTP response containing formatted output
     """
-    title = 'All recordings'
-    search_params = request.GET
-    if search_params:
-        search_filter = build_search_filter(search_params)
-        files = AudioRecording.objects.filter(**search_filter)
-        title = 'Search results'
-    else:
-        files = AudioRecording.objects.filter(hide=False)
-    return display_recordings_list(files, request, {'title': title})
+    search_params = {k: v for k, v in request.GET.items() if k not in PAGE_PARAMS}
+    try:
+        files = recordings_for_list(search_params)
+    except ValueError as error:
+        raise Http404('Invalid search') from error
+    title = 'Search results' if search_params else 'All recordings'
+    return display_recordings_page(files, request, {'title': title}, search_params)
 
 
 def single(request, primary_key):
@@ -154,7 +347,7 @@ def single(request, primary_key):
     Returns:
         HTTP response containing formatted output
     """
-    files = [AudioRecording.objects.get(id=primary_key)]
+    files = [AudioRecording.objects.select_related('resolved_species').get(id=primary_key)]
     if len(files) == 0:
         raise Http404('Recording not found')
 
@@ -171,7 +364,7 @@ def single(request, primary_key):
         'og_description': 'Visualisation, location and playback'
     }
 
-    species_details = SpeciesLookup().species_by_abbreviations(file.genus, file.species)
+    species_details = recording_species(file)
 
     if species_details:
         species_name = title_case(species_details.species)
@@ -196,7 +389,8 @@ def genus(request, genus_name):
     Returns:
         HTTP response containing formatted output
     """
-    files = AudioRecording.objects.filter(genus=genus_name, hide=False)
+    list_params = {'genus': genus_name}
+    files = recordings_for_list(list_params)
     title = f'Genus: {genus_name}'
     safe_genus_name = genus_name
 
@@ -212,11 +406,7 @@ def genus(request, genus_name):
         'og_description': 'Visualisation, location and playback'
     }
 
-    return display_recordings_list(
-        files,
-        request,
-        context
-    )
+    return display_recordings_page(files, request, context, list_params)
 
 
 def species(request, genus_name, species_name):
@@ -230,7 +420,8 @@ def species(request, genus_name, species_name):
     Returns:
         HTTP response containing formatted output
     """
-    files = AudioRecording.objects.filter(genus=genus_name, species=species_name, hide=False)
+    list_params = {'genus': genus_name, 'species': species_name}
+    files = recordings_for_list(list_params)
     title_genus_case = title_case(genus_name)
     safe_latin_name = f'{title_genus_case}. {species_name.lower()}.'
     safe_common_name = None
@@ -257,11 +448,24 @@ def species(request, genus_name, species_name):
 
     context['og_title'] = f'Echolocation recordings from {safe_species_name}'
 
-    return display_recordings_list(
-        files,
-        request,
-        context
-    )
+    return display_recordings_page(files, request, context, list_params)
+
+
+def recording_species(file: AudioRecording) -> Optional[Species]:
+    """
+    Get the species of a recording, if its abbreviations match exactly one
+    Args:
+        file: Recording, ideally fetched with select_related('resolved_species')
+
+    Returns:
+        Species or None
+    """
+    if file.resolved_species_id is not None:
+        return file.resolved_species
+    if file.species_ambiguous:
+        return None
+    # Not resolved since import, eg recordings imported before species were resolved
+    return SpeciesLookup().resolve(file.genus, file.species)[0]
 
 
 def title_case(in_string):
@@ -278,13 +482,13 @@ def search(request):
 
     """
     template = loader.get_template('tracemap/search.html')
-    time_range = AudioRecording.objects.all(). \
-        aggregate(min=Min('recorded_at_iso'), max=Max('recorded_at_iso'))
+    time_range = AudioRecording.objects.filter(hide=False). \
+        aggregate(min=Min('recorded_date'), max=Max('recorded_date'))
 
     # Clip from start to end of day
     time_range = {
-        'min': parse_date(time_range['min']).strftime('%Y-%m-%d'),
-        'max': (parse_date(time_range['max']) + timedelta(days=1)).strftime('%Y-%m-%d'),
+        'min': time_range['min'].isoformat(),
+        'max': (time_range['max'] + timedelta(days=1)).isoformat(),
     }
 
     default_range = {
@@ -314,53 +518,245 @@ def display_recordings_list(files: List[AudioRecording], request, context: dict
     Returns:
 
     """
-    if context is None:
-        context = {}
+    first_file = next((file for file in files if file.spectrogram_image_file), None)
+    map_data = {'traces': list(iter_traces(files)), 'bounds': bounds_from_recordings(files)}
+    return render_recordings_list(request, context or {}, map_data, first_file)
 
-    lookup = SpeciesLookup()
-    traces = []
+
+def render_recordings_list(
+        request: HttpRequest, context: dict, map_data: dict, og_file: Optional[AudioRecording]
+):
+    """
+    Render the list and map page
+    Args:
+        request:
+        context: Template context
+        map_data: Map of 'bounds', and either 'traces', or 'traces_url' to fetch them from
+        og_file: Recording whose spectrogram is shown when the page is shared, if any
+
+    Returns:
+        HTTP response containing formatted output
+    """
+    template = loader.get_template('tracemap/list.html')
+    local_context = {
+        'map_data': map_data,
+        'mapbox_token': settings.MAPS['mapbox_token'],
+    }
+
+    og_context = {}
+    if og_file is not None:
+        spectrogram_url = media_path_to_relative_url(og_file.spectrogram_image_file)
+        og_context['og_image'] = f'{request.scheme}://{request.get_host()}{spectrogram_url}'
+        if og_file.spectrogram_image_width:
+            og_context['og_image_width'] = og_file.spectrogram_image_width
+            og_context['og_image_height'] = og_file.spectrogram_image_height
+
+    context = {**context, **og_context, **local_context}
+    return HttpResponse(template.render(context, request))
+
+
+def iter_traces(files: Iterable[AudioRecording]) -> Iterator[Dict]:
+    """
+    Serialise recordings for the map and list, a batch at a time, so that any number can be
+    streamed
+    Args:
+        files: Recordings, ideally fetched with select_related('resolved_species')
+
+    Returns:
+        Iterator of trace dictionaries
+    """
     urls_map = {
         'file': 'url',
         'lo_file': 'lo_url',
         'spectrogram_file': 'spectrogram_url',
     }
+    species_info_by_id = {}
+    files = iter(files)
+    while True:
+        batch = list(islice(files, QUERY_BATCH_SIZE))
+        if not batch:
+            return
+
+        # Recordings imported before species were resolved still need looking up
+        species_by_pair = SpeciesLookup().species_by_abbreviation_pairs(
+            (file.genus, file.species) for file in batch
+            if file.resolved_species_id is None and not file.species_ambiguous
+        )
+
+        for file in batch:
+            trace = file.as_serializable()
+            for file_key, url_key in urls_map.items():
+                if trace[file_key]:
+                    tracefile = trace[file_key]
+                    trace[url_key] = media_path_to_relative_url(tracefile)
+                else:
+                    # Derived files may not have been generated yet, see processmedia
+                    trace[url_key] = None
+                trace[file_key] = None
+
+            if file.resolved_species_id is not None:
+                species_info = file.resolved_species
+            else:
+                species_info = species_by_pair.get((file.genus, file.species))
+            if species_info and species_info.id not in species_info_by_id:
+                species_info_by_id[species_info.id] = species_info.as_serializable()
+            trace['species_info'] = species_info_by_id[species_info.id] if species_info else ''
+            yield trace
+
+
+def page_cursor(recorded_at_utc: Optional[datetime], recording_id: int) -> str:
+    """
+    Mark the position of a recording in the order of list pages
+    Args:
+        recorded_at_utc: Recording time of the last recording of a page
+        recording_id: ID of the last recording of a page
+
+    Returns:
+        Cursor, as the 'after' parameter of the next page
+    """
+    time = recorded_at_utc.isoformat() if recorded_at_utc is not None else ''
+    return f'{time}_{recording_id}'
+
+
+def recordings_after(files: QuerySet, cursor: str) -> QuerySet:
+    """
+    Filter recordings to those after a cursor, in the order of list pages: by recording time,
+    undated recordings first, then by ID
+    Args:
+        files: Recordings
+        cursor: As from page_cursor
+
+    Returns:
+        Filtered queryset
+
+    Raises:
+        ValueError if the cursor isn't valid
+    """
+    time_string, id_string = cursor.rsplit('_', 1)
+    last_id = int(id_string)
+    if not time_string:
+        return files.filter(
+            Q(recorded_at_utc__isnull=False) | Q(recorded_at_utc__isnull=True, id__gt=last_id)
+        )
+    last_time = datetime.fromisoformat(time_string)
+    # Written as a range from the last time, rather than later time OR same time and later ID,
+    # so that the index by time is searched from there
+    return files.filter(recorded_at_utc__gte=last_time) \
+        .exclude(recorded_at_utc=last_time, id__lte=last_id)
 
-    for file in files:
-        trace = file.as_serializable()
-        for file_key, url_key in urls_map.items():
-            if trace[file_key]:
-                tracefile = trace[file_key]
-                trace[url_key] = media_path_to_relative_url(tracefile)
-            trace[file_key] = None
 
+def page_start(files: QuerySet, request: HttpRequest) -> Tuple[QuerySet, int, Optional[str]]:
+    """
+    Order recordings for list pages, from the start of the requested page. Pages are found by
+    keyset pagination: each page starts after the last recording of the previous one, so no page
+    needs the recordings before it to be counted or skipped
+    Args:
+        files: Recordings
+        request: With optional 'after', the cursor of the previous page's last recording, and
+            'size', the number of recordings per page
+
+    Returns:
+        Tuple of the recordings from the start of the page, the page size, and the cursor
+    """
+    try:
+        size = int(request.GET.get('size', RECORDINGS_PAGE_SIZE))
+    except ValueError:
+        size = RECORDINGS_PAGE_SIZE
+    size = min(max(size, 1), MAX_RECORDINGS_PAGE_SIZE)
+
+    files = files.order_by(F('recorded_at_utc').asc(nulls_first=True), 'id')
+    after = request.GET.get('after')
+    if after:
         try:
-            species_info = lookup.species_by_abbreviations(file.genus, file.species)
-        except NonUniqueSpeciesLookup:
-            species_info = None
-        trace['species_info'] = species_info.as_serializable() if species_info else ''
-        traces.append(trace)
+            files = recordings_after(files, after)
+        except ValueError as error:
+            raise Http404('No such page') from error
+    return files, size, after
 
-    bounds = bounds_from_recordings(files)
-    template = loader.get_template('tracemap/list.html')
-    local_context = {
-        'map_data': {'traces': traces, 'bounds': bounds},
-        'mapbox_token': settings.MAPS['mapbox_token'],
+
+def display_recordings_page(
+        files: QuerySet, request: HttpRequest, context: dict, list_params: Dict[str, str]
+):
+    """
+    Generate page view of one page of recordings, on a map of where all of them were recorded.
+    The recordings themselves are fetched from traces_api once the page is shown
+    Args:
+        files: All recordings to list, as from recordings_for_list
+        request: With page parameters, as page_start
+        context: Template context
+        list_params: Parameters of recordings_for_list that select the recordings
+
+    Returns:
+        HTTP response containing formatted output
+    """
+    remaining, size, after = page_start(files, request)
+
+    # Only the last recording of the page is needed, for the cursor of the next
+    page_end = list(remaining.values_list('recorded_at_utc', 'id')[size - 1:size + 1])
+    params = request.GET.copy()
+    params.pop('after', None)
+    page_context = {'page_size': size}
+    if len(page_end) > 1:
+        params['after'] = page_cursor(*page_end[0])
+        page_context['next_page_url'] = f'?{params.urlencode()}'
+        params.pop('after')
+    if after:
+        page_context['first_page_url'] = f'?{params.urlencode()}'
+
+    traces_params = {**list_params, 'size': size, **({'after': after} if after else {})}
+    map_data = {
+        'traces_url': f'{reverse("traces_api")}?{urlencode(traces_params)}',
+        'bounds': bounds_from_extent(files),
     }
+    og_file = remaining.filter(spectrogram_image_file__gt='').only(
+        'spectrogram_image_file', 'spectrogram_image_width', 'spectrogram_image_height'
+    ).first()
+    return render_recordings_list(request, {**context, **page_context}, map_data, og_file)
 
-    og_context = {}
 
-    files_with_spectrogram = [x for x in traces if x['spectrogram_url']]
-    if len(files_with_spectrogram):
-        first_file = files_with_spectrogram[0]
-        print(first_file)
-        og_context['og_image'] = \
-            f'{request.scheme}://{request.get_host()}{first_file["spectrogram_url"]}'
-        if first_file['spectrogram_width']:
-            og_context['og_image_width'] = first_file['spectrogram_width']
-            og_context['og_image_height'] = first_file['spectrogram_height']
+def traces_api(request: HttpRequest):
+    """
+    API call handler streaming one page of recordings for the list and map, as JSON, encoding
+    and sending them a batch at a time rather than holding them all in memory
+    Args:
+        request: With parameters of recordings_for_list, and page parameters, as page_start
 
-    context = {**context, **og_context, **local_context}
-    return HttpResponse(template.render(context, request))
+    Returns:
+        Streamed JSON of {'traces': [trace]}
+    """
+    list_params = {k: v for k, v in request.GET.items() if k not in PAGE_PARAMS}
+    try:
+        files = recordings_for_list(list_params)
+    except ValueError as error:
+        raise Http404('Invalid search') from error
+    remaining, size, _ = page_start(files, request)
+    page = remaining.select_related('resolved_species')[:size]
+    return StreamingHttpResponse(
+        stream_traces_json(page.iterator(chunk_size=QUERY_BATCH_SIZE)),
+        content_type='application/json'
+    )
+
+
+def stream_traces_json(files: Iterable[AudioRecording]) -> Iterator[str]:
+    """
+    Encode recordings as JSON of {'traces': [trace]}, in parts
+    Args:
+        files: Recordings
+
+    Returns:
+        Iterator of parts of the JSON document, each with a batch of traces
+    """
+    encoder = DjangoJSONEncoder()
+    yield '{"traces": ['
+    parts = []
+    separator = ''
+    for trace in iter_traces(files):
+        parts.append(separator + encoder.encode(trace))
+        separator = ', '
+        if len(parts) >= QUERY_BATCH_SIZE:
+            yield ''.join(parts)
+            parts = []
+    yield ''.join(parts) + ']}'
 
 
 def media_path_to_relative_url(tracefile):
@@ -399,15 +795,44 @@ def bounds_from_recordings(files: List[AudioRecording]) -> Tuple:
                 max([t.longitude for t in positioned_files])
             )
         )
+        return expand_point_bounds(bounds)
+    return None
 
-        # Possibly not needed, leaflet.js may handle this
-        if bounds[0] == bounds[1]:
-            bounds = (
-                (bounds[0][0] - 0.01, bounds[0][1] - 0.01),
-                (bounds[0][0] + 0.01, bounds[0][1] + 0.01)
-            )
-    else:
-        bounds = None
+
+def bounds_from_extent(files: QuerySet) -> Optional[Tuple]:
+    """
+    Generate map bounds for recordings, with an aggregate query rather than fetching them
+    Args:
+        files: Recordings
+
+    Returns:
+        Bounds, as bounds_from_recordings, or None if no recordings have a location
+    """
+    extent = files.filter(latitude__isnull=False, longitude__isnull=False).aggregate(
+        south=Min('latitude'), west=Min('longitude'), north=Max('latitude'), east=Max('longitude')
+    )
+    if extent['south'] is None:
+        return None
+    return expand_point_bounds(
+        ((extent['south'], extent['west']), (extent['north'], extent['east']))
+    )
+
+
+def expand_point_bounds(bounds: Tuple) -> Tuple:
+    """
+    Widen bounds around a single point, so the map has an area to show
+    Args:
+        bounds: ((south, west), (north, east))
+
+    Returns:
+        Bounds
+    """
+    # Possibly not needed, leaflet.js may handle this
+    if bounds[0] == bounds[1]:
+        bounds = (
+            (bounds[0][0] - 0.01, bounds[0][1] - 0.01),
+            (bounds[0][0] + 0.01, bounds[0][1] + 0.01)
+        )
     return bounds
 
 
@@ -417,13 +842,12 @@ def list_counts_by_day():
     Returns:
 
     """
-    days = AudioRecording.objects \
-        .filter(hide=False) \
-        .annotate(day=Substr('recorded_at_iso', 1, 10)) \
-        .values('day').annotate(c=Count('id')) \
+    days = DailySpeciesSummary.objects \
+        .exclude(day='') \
+        .values('day').annotate(c=Sum('count')) \
         .values('day', 'c').order_by('day')
 
-    days = {day['day'][0:10]: day['c'] for day in days if day['day'] is not None}
+    days = {day['day']: day['c'] for day in days}
 
     return days
 
@@ -434,85 +858,159 @@ def summarise_by_day() -> Tuple[dict, dict]:
     Returns:
 
     """
-
-    def f_day(date_string):
-        return parse_date(date_string).strftime('%Y-%m-%d') if date_string is not None else None
-
-    # Take all the objects
-    # Annotate them with a day record
-    # Identify (group) by values
-    # Annotate the groups with a count of rows
-    # Spit out the summary
-    days_by_species = AudioRecording.objects \
-        .filter(hide=False) \
-        .annotate(day=Substr('recorded_at_iso', 1, 10)) \
-        .values('day', 'genus', 'species') \
-        .annotate(count=Count('id')) \
+    # Counts are kept grouped by day, genus and species as recordings change; undated
+    # recordings are summarised under a blank day
+    days_by_species = (
+        {
+            'day': row['day'] or None,
+            'genus': row['genus'],
+            'species': row['species'],
+            'count': row['count']
+        }
+        for row in DailySpeciesSummary.objects
         .values('day', 'genus', 'species', 'count')
+        .order_by()
+        .iterator()
+    )
 
-    # FIXME:  R1718: Consider using a set comprehension (consider-using-set-comprehension)
-    # pylint: disable=R1718
-    unique_days = set([f_day(row['day']) for row in days_by_species])
-    unique_genus = set([row['genus'] for row in days_by_species])
-
-    days = {
-        day: {'day': day, 'count': 0, 'genus': {g: {} for g in unique_genus}}
-        for day in unique_days
-    }
-
-    genus_species = {g: [] for g in unique_genus}
-
-    for row in days_by_species:
-        day_key = f_day(row['day'])
-        days[day_key]['count'] += row['count']
-        for genus_abbr in unique_genus:
-            if row['genus'] == genus_abbr:
-                days[day_key]['genus'][genus_abbr][row['species']] = row['count']
-                genus_species[genus_abbr].append(row['species'])
+    days, genus_species = summarise_day_rows(days_by_species)
 
     lookup = SpeciesLookup()
-    genus_lookup = lookup.genus_name_by_abbreviation
-    # genus_species = Map of (eg) { PYP: [NAT, PIP, PYG], …} - species lists are unsorted here
+    # genus_species = Map of (eg) { PYP: [NAT, PIP, PYG], …}
+    genus_names = lookup.genus_names_by_abbreviations(genus_species)
+    species_by_pair = lookup.species_by_abbreviation_pairs(
+        (genus_abbr, species_abbr)
+        for genus_abbr, species_list in genus_species.items()
+        for species_abbr in species_list
+    )
 
     genus_map = {}
-    for genus_abbr in genus_species:
-        name = genus_lookup(genus_abbr)
+    for genus_abbr, species_list in genus_species.items():
+        name = genus_names[genus_abbr]
         genus_map[genus_abbr] = {
             'name': name if isinstance(name, str) else None,
-            'species': []
+            'species': [
+                {
+                    'abbreviation': species_abbr,
+                    'species': species_by_pair[(genus_abbr, species_abbr)]
+                }
+                for species_abbr in species_list
+            ]
         }
-        species_abbreviations = sorted(set(genus_species[genus_abbr]))
-
-        for species_abbr in species_abbreviations:
-            try:
-                species_data = lookup.species_by_abbreviations(genus_abbr, species_abbr)
-            except NonUniqueSpeciesLookup:
-                species_data = None
-
-            species_item = {
-                'abbreviation': species_abbr,
-                'species': species_data
-            }
-            genus_map[genus_abbr]['species'].append(species_item)
 
     return days, genus_map
 
 
 def search_api(request: HttpRequest):
     """
-    API call handler for search
+    API call handler for search, giving counts of matching recordings for a heatmap
     Args:
-        request:
+        request: With search parameters, as build_search_filter, and optionally 'zoom', the map
+            zoom level, or 'cell', a cell size in degrees, to count recordings in a grid of
+            cells rather than by exact location
 
     Returns:
-
+        JSON of {'data': [{'lat', 'lng', 'value'}], 'max': highest value, 'cell': cell size}
     """
     search_params = request.GET
+    try:
+        if 'cell' in search_params:
+            cell_size = float(search_params['cell'])
+        elif 'zoom' in search_params:
+            cell_size = cell_size_for_zoom(min(int(search_params['zoom']), MAX_ZOOM))
+        else:
+            cell_size = None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cell size or zoom level'}, status=400)
+    if cell_size is not None and not (isfinite(cell_size) and cell_size > 0):
+        return JsonResponse({'error': 'Cell size must be positive'}, status=400)
+
     search_filter = build_search_filter(search_params)
+    results = filter_within_bounds(AudioRecording.objects.filter(**search_filter), search_params)
+    cells = count_by_cell(results, cell_size)
+    return JsonResponse({
+        'data': cells,
+        'max': max((cell['value'] for cell in cells), default=0),
+        'cell': cell_size,
+        'search': search_filter
+    }, safe=False)
 
-    results = AudioRecording.objects.filter(**search_filter)
-    results = [{'lat': f.latitude, 'lng': f.longitude, 'value': 1} for f in results]
-    return JsonResponse({'data': results, 'search': search_filter}, safe=False)
+
+def density_tiles(data_version: DataVersion, search_params: dict) -> DensityTiles:
+    """
+    Get the density tiles of the recordings matching a search
+    Args:
+        data_version: Current data version
+        search_params: Search parameters, as build_search_filter; map bounds are ignored
+
+    Returns:
+        DensityTiles
+    """
+    search_params = {k: search_params[k] for k in TILE_SEARCH_PARAMS if k in search_params}
+    recordings = AudioRecording.objects.filter(**build_search_filter(search_params))
+    return DensityTiles(recordings, data_version, search_params)
+
+
+@cache_control(no_cache=True)
+@revalidate_by_data_version
+def density_tile(request: HttpRequest, zoom: int, x: int, y: int):
+    """
+    Map tile of the density of recordings matching a search
+    Args:
+        request: With search parameters, as build_search_filter
+        zoom: Zoom level
+        x: Column, from the west
+        y: Row, from the north
+
+    Returns:
+        PNG image
+    """
+    if zoom > MAX_TILE_ZOOM or x >= 2 ** zoom or y >= 2 ** zoom:
+        raise Http404('No such tile')
+    tiles = density_tiles(request_data_version(request), request.GET)
+    return HttpResponse(tiles.tile(zoom, x, y), content_type='image/png')
+
+
+def date_prefix(time_string: str) -> Optional[date]:
+    """
+    Get the date from the start of an ISO time string
+    Args:
+        time_string: eg 'YYYY-MM-DD hh:mm'
+
+    Returns:
+        date, or None if the string doesn't start with a valid date
+    """
+    try:
+        return date.fromisoformat(time_string[0:10])
+    except ValueError:
+        return None
+
+
+def recordings_for_list(list_params: Mapping[str, str]) -> QuerySet:
+    """
+    Select the visible recordings for a list page
+    Args:
+        list_params: Search parameters, as build_search_filter, and optionally 'genus', a genus
+            abbreviation, and 'day', 'YYYY-MM-DD' or 'undated'
+
+    Returns:
+        Queryset of recordings
+
+    Raises:
+        ValueError if the day or map bounds aren't valid
+    """
+    files = filter_within_bounds(
+        AudioRecording.objects.filter(**build_search_filter(list_params)), list_params
+    )
+    if 'genus' in list_params:
+        files = files.filter(genus=list_params['genus'])
+    if 'day' in list_params:
+        if list_params['day'] == 'undated':
+            files = files.filter(recorded_date__isnull=True)
+        else:
+            (year, month, day_number) = list_params['day'].split('-')
+            files = files.filter(recorded_date=date(int(year), int(month), int(day_number)))
+    return files
 
 
 def build_search_filter(search_params: dict):
@@ -538,10 +1036,17 @@ def build_search_filter(search_params: dict):
         search_filter['latitude__gte'] = search_params['south']
     if 'north' in search_params:
         search_filter['latitude__lte'] = search_params['north']
+    # Times are compared as local ISO strings; the same bounds on the date allow an index to be used
     if 'start' in search_params:
         search_filter['recorded_at_iso__gte'] = search_params['start']
+        start_date = date_prefix(search_params['start'])
+        if start_date is not None:
+            search_filter['recorded_date__gte'] = start_date
     if 'end' in search_params:
         search_filter['recorded_at_iso__lte'] = search_params['end']
+        end_date = date_prefix(search_params['end'])
+        if end_date is not None:
+            search_filter['recorded_date__lte'] = end_date
     return search_filter
 
 
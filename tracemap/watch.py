@@ -0,0 +1,285 @@
+"""
+Watch a directory tree for new audio files, with inotify where available or by polling
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+# inotify event flags, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def is_audio_file(name: str) -> bool:
+    """
+    Whether a file name is one we import; hidden files are skipped, as copying tools often
+    write to a hidden temporary file and rename it when complete
+    """
+    return not name.startswith('.') and name.lower().endswith('.wav')
+
+
+class PollingWatcher:
+    """
+    Find new files by checking directory modification times, only listing directories that
+    have changed since they were last seen
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.directories: Dict[str, Tuple[float, Set[str]]] = {}
+
+    def start(self) -> List[str]:
+        """
+        Record the current state of the tree
+        Returns:
+            Paths of all audio files found
+        """
+        return self.scan_directory(self.root)
+
+    def scan_directory(self, path: str) -> List[str]:
+        """
+        List a directory and any new subdirectories, remembering what was in them
+        Args:
+            path: Directory to list
+
+        Returns:
+            Paths of audio files that weren't there last time
+        """
+        found = []
+        try:
+            mtime = os.stat(path).st_mtime
+            entries = list(os.scandir(path))
+        except FileNotFoundError:
+            self.directories.pop(path, None)
+            return found
+
+        _, previous = self.directories.get(path, (None, set()))
+        names = set()
+        for entry in entries:
+            names.add(entry.name)
+            if entry.name in previous:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                found.extend(self.scan_directory(entry.path))
+            elif is_audio_file(entry.name):
+                found.append(entry.path)
+        self.directories[path] = (mtime, names)
+        return found
+
+    def wait(self, timeout: float) -> List[str]:
+        """
+        Wait for the polling interval, then look for new files
+        Args:
+            timeout: Seconds to wait
+
+        Returns:
+            Paths of new audio files
+        """
+        time.sleep(timeout)
+        found = []
+        for path, (mtime, _) in list(self.directories.items()):
+            try:
+                changed = os.stat(path).st_mtime != mtime
+            except FileNotFoundError:
+                self.directories.pop(path, None)
+                continue
+            if changed:
+                found.extend(self.scan_directory(path))
+        return found
+
+    def close(self):
+        """
+        Nothing to release when polling
+        """
+
+
+class InotifyWatcher:
+    """
+    Receive notifications of file changes from the Linux kernel, via libc
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches: Dict[int, str] = {}
+
+    def start(self) -> List[str]:
+        """
+        Watch every directory in the tree
+        Returns:
+            Paths of all audio files found
+
+        Raises:
+            OSError if a directory can't be watched, eg because the watch limit was reached
+        """
+        return self.watch_tree(self.root)
+
+    def watch_tree(self, path: str) -> List[str]:
+        """
+        Watch a directory and its subdirectories. Each directory is watched before it's
+        listed, so that files created in between are not missed
+        Args:
+            path: Top directory
+
+        Returns:
+            Paths of audio files already in the tree
+        """
+        found = []
+        for directory, subdirectories, files in os.walk(path):
+            watch = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if watch < 0:
+                error = ctypes.get_errno()
+                raise OSError(error, f'Unable to watch {directory}: {os.strerror(error)}')
+            self.watches[watch] = directory
+            subdirectories.sort()
+            found.extend(os.path.join(directory, f) for f in sorted(files) if is_audio_file(f))
+        return found
+
+    def wait(self, timeout: float) -> List[str]:
+        """
+        Wait for file events
+        Args:
+            timeout: Maximum seconds to wait
+
+        Returns:
+            Paths of audio files that have been created, written or moved into the tree
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        found = []
+        for watch, mask, name in self.read_events():
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so fall back to a full listing
+                print('inotify queue overflowed, rescanning')
+                found.extend(self.watch_tree(self.root))
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(watch, None)
+                continue
+            directory = self.watches.get(watch)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    found.extend(self.watch_tree(path))
+            elif is_audio_file(name):
+                found.append(path)
+        return found
+
+    def read_events(self) -> Iterable[Tuple[int, int, str]]:
+        """
+        Read all queued events
+        Returns:
+            Iterable of (watch descriptor, event mask, file name)
+        """
+        while True:
+            try:
+                buffer = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset + INOTIFY_EVENT.size <= len(buffer):
+                watch, mask, _, length = INOTIFY_EVENT.unpack_from(buffer, offset)
+                offset += INOTIFY_EVENT.size
+                name = buffer[offset:offset + length].rstrip(b'\0')
+                offset += length
+                yield watch, mask, os.fsdecode(name)
+
+    def close(self):
+        """
+        Release the inotify instance
+        """
+        os.close(self.fd)
+
+
+def create_watcher(root: str, use_inotify: bool = True):
+    """
+    Create and start the best available watcher for a directory tree
+    Args:
+        root: Directory to watch
+        use_inotify: Whether to try inotify before falling back to polling
+
+    Returns:
+        Tuple of (watcher, paths of audio files already in the tree)
+    """
+    if use_inotify:
+        watcher: Optional[InotifyWatcher] = None
+        try:
+            watcher = InotifyWatcher(root)
+            return watcher, watcher.start()
+        except (OSError, AttributeError) as e:
+            # AttributeError: libc has no inotify functions, eg on macOS
+            print(f'inotify unavailable ({e}), polling instead')
+            if watcher is not None:
+                watcher.close()
+
+    watcher = PollingWatcher(root)
+    return watcher, watcher.start()
+
+
+class SettlingFiles:
+    """
+    Track files until their size and modification time stop changing, so that files are only
+    handed on once they have been completely written
+    """
+
+    def __init__(self, settle_time: float):
+        self.settle_time = settle_time
+        self.pending: Dict[str, Tuple[int, float, float]] = {}
+
+    def add(self, paths: Iterable[str]):
+        """
+        Start or restart tracking files
+        Args:
+            paths: Paths of files that have been created or changed
+
+        Returns:
+            void
+        """
+        for path in paths:
+            self.pending[path] = (-1, 0.0, time.monotonic())
+
+    def __len__(self):
+        return len(self.pending)
+
+    def settled(self) -> List[str]:
+        """
+        Check pending files, and stop tracking any that have settled or disappeared
+        Returns:
+            Paths of files that haven't changed for at least the settle time
+        """
+        ready = []
+        now = time.monotonic()
+        for path, (size, mtime, since) in list(self.pending.items()):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime) != (size, mtime):
+                self.pending[path] = (stat.st_size, stat.st_mtime, now)
+            elif now - since >= self.settle_time:
+                del self.pending[path]
+                ready.append(path)
+        return sorted(ready)
@@ -0,0 +1,113 @@
+"""
+Benchmark drawing the calendar of daily recording counts, over synthetic data
+
+Compares svg_calendar.FastGridImage with GridImage, which builds svgwrite elements, using the
+same decoration as the calendar page, and checks that both give the same SVG. Also compares
+drawing a calendar per series, as on the activity dashboard, one at a time and all at once.
+
+Run from the project root:
+
+    python -m utils.benchmark_calendar --years 10
+"""
+import argparse
+import random
+import timeit
+from datetime import date, timedelta
+
+from svgwrite.container import Hyperlink
+
+from svg_calendar import DayLink, FastGridImage, GridImage
+
+
+def synthetic_counts(years: int, seed: int = 1):
+    """
+    Recording counts for most nights of each year's bat season, as from views.list_counts_by_day
+    """
+    rng = random.Random(seed)
+    counts = {}
+    first_day = date(2000, 4, 1)
+    for year in range(years):
+        season_start = first_day.replace(year=first_day.year + year)
+        for offset in range(200):
+            if rng.random() < 0.2:
+                continue
+            counts[(season_start + timedelta(days=offset)).isoformat()] = rng.randint(1, 500)
+    return counts
+
+
+def link_rect(rect, day_date: date, _):
+    """
+    The calendar page's decoration, for svgwrite elements
+    """
+    day_string = day_date.strftime('%Y-%m-%d')
+    outer = Hyperlink('/byday/' + day_string, '_self')
+    rect.update({'class_': 'dateTrigger'})
+    rect.update({'id': 'calday-' + day_string})
+    outer.add(rect)
+    return outer
+
+
+def link_markup(rect, day_date: date, _):
+    """
+    The calendar page's decoration, for markup
+    """
+    day_string = day_date.isoformat()
+    outer = DayLink('/byday/' + day_string, '_self')
+    rect.update({'class_': 'dateTrigger'})
+    rect.update({'id': 'calday-' + day_string})
+    outer.add(rect)
+    return outer
+
+
+def svgwrite_calendar(counts):
+    return GridImage().set_day_rect_decorator(link_rect) \
+        .draw_daily_count_image(counts, True).tostring()
+
+
+def string_calendar(counts):
+    return FastGridImage().set_day_markup_decorator(link_markup) \
+        .render_daily_count_image(counts, True)
+
+
+def separate_calendars(series):
+    grid_image = FastGridImage().set_day_markup_decorator(link_markup)
+    return [grid_image.render_daily_count_image(counts) for counts in series.values()]
+
+
+def shared_calendars(series):
+    return FastGridImage().set_day_markup_decorator(link_markup) \
+        .render_daily_count_images(series)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--years', type=int, default=10, help='Years of synthetic data')
+    parser.add_argument('--series', type=int, default=30, help='Series for small multiples')
+    parser.add_argument('--repeat', type=int, default=5, help='Timing runs of each version')
+    args = parser.parse_args()
+
+    counts = synthetic_counts(args.years)
+    print(f'{len(counts)} days over {args.years} years')
+
+    if svgwrite_calendar(counts) != string_calendar(counts):
+        raise SystemExit('Results differ')
+
+    for name, function in (
+            ('svgwrite', svgwrite_calendar),
+            ('string', string_calendar),
+    ):
+        best = min(timeit.repeat(lambda f=function: f(counts), number=1, repeat=args.repeat))
+        print(f'{name:<12} {best * 1000:8.1f}ms')
+
+    series = {n: synthetic_counts(args.years, seed=n) for n in range(args.series)}
+    print(f'{args.series} series')
+    for name, function in (
+            ('separately', separate_calendars),
+            ('shared', shared_calendars),
+    ):
+        best = min(timeit.repeat(lambda f=function: f(series), number=1, repeat=args.repeat))
+        print(f'{name:<12} {best * 1000:8.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""
+Benchmark recording queries with and without the indexes of visible recordings, over synthetic data
+
+Fills a separate SQLite database with synthetic recordings, then shows the query plan and time
+of the queries behind the day, species, list and summary views, first without the indexes of
+visible recordings by recorded_date, by genus and species, and by recorded_at_utc, and then with
+them. Queries that used to compare or group by parts of recorded_at_iso are shown in both forms,
+and pages of the list are fetched both by offset and after a cursor.
+
+Run from the project root:
+
+    python -m utils.benchmark_indexes --rows 1000000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import django
+from django.conf import settings
+
+
+GENERA = {
+    'PIP': ['PIP', 'PYG', 'NAT', 'KUH'],
+    'MYO': ['DAU', 'MYS', 'NAT', 'BRA', 'BEC'],
+    'NYC': ['NOC', 'LEI'],
+    'PLE': ['AUR', 'AUS'],
+    'BAR': ['BAR'],
+    'EPT': ['SER'],
+    'RHI': ['FER', 'HIP'],
+    'NoID': [''],
+}
+NEW_INDEXES = ['recording_visible_date', 'recording_visible_species', 'recording_visible_time']
+BATCH_SIZE = 10000
+
+
+def fill_database(rows: int, years: int, seed: int = 1):
+    """
+    Create synthetic recordings, on nights through each year's bat season
+    """
+    from tracemap.models import AudioRecording  # pylint: disable=C0415
+
+    rng = random.Random(seed)
+    pairs = [(g, s) for g, species_list in GENERA.items() for s in species_list]
+    first_night = datetime(2010, 4, 1, 20, 0, tzinfo=timezone(timedelta(hours=1)))
+    started = time.perf_counter()
+    for start in range(0, rows, BATCH_SIZE):
+        batch = []
+        for number in range(start, min(rows, start + BATCH_SIZE)):
+            genus, species = rng.choice(pairs)
+            audio = AudioRecording(
+                identifier=f'REC{number:08d}',
+                audio_file=f'/sessions/REC{number:08d}.wav',
+                genus=genus,
+                species=species,
+                recorder_serial=f'SN{rng.randint(1, 5)}',
+                duration=rng.random() * 10,
+                hide=rng.random() < 0.05,
+            )
+            if rng.random() > 0.01:
+                night = first_night.replace(year=first_night.year + rng.randrange(years)) \
+                    + timedelta(days=rng.randrange(200), seconds=rng.randrange(8 * 3600))
+                audio.set_recording_time(night)
+            batch.append(audio)
+        AudioRecording.objects.bulk_create(batch)
+        print(f'\r{min(rows, start + BATCH_SIZE)} rows', end='', flush=True)
+    print(f' in {time.perf_counter() - started:.0f}s')
+
+
+def benchmark_queries(years: int):
+    """
+    Queries behind the views, as (name, queryset); some are given in their old form too
+    """
+    from django.db.models import Count, F, Sum  # pylint: disable=C0415
+    from django.db.models.functions import Substr  # pylint: disable=C0415
+
+    from tracemap import views  # pylint: disable=C0415
+    from tracemap.models import AudioRecording  # pylint: disable=C0415
+
+    day = datetime(2010 + years // 2, 6, 15)
+    visible = AudioRecording.objects.filter(hide=False).only('id')
+    middle = visible.count() // 2
+    cursor = views.page_cursor(*visible.filter(recorded_date__gte=day.date())
+                               .order_by('recorded_at_utc', 'id')
+                               .values_list('recorded_at_utc', 'id').first())
+    return [
+        ('day, by iso string (old)', visible.filter(
+            recorded_at_iso__gte=day.isoformat(),
+            recorded_at_iso__lte=(day + timedelta(days=1)).isoformat()
+        )),
+        ('day, by recorded_date', visible.filter(recorded_date=day.date())),
+        ('species', visible.filter(genus='MYO', species='BEC')),
+        ('list, first 100 by time', visible.order_by('recorded_at_utc', 'id')[:100]),
+        ('list, 100 from the middle by offset', visible
+            .order_by('recorded_at_utc', 'id')[middle:middle + 100]),
+        ('list, 100 after a cursor', views.recordings_after(
+            visible.order_by(F('recorded_at_utc').asc(nulls_first=True), 'id'), cursor
+        )[:100]),
+        ('summary of a week, by iso string (old)', visible
+            .annotate(day=Substr('recorded_at_iso', 1, 10))
+            .filter(day__in=[(day + timedelta(days=n)).date().isoformat() for n in range(7)])
+            .values('day', 'genus', 'species')
+            .annotate(count=Count('id'), total_duration=Sum('duration'))
+            .order_by()),
+        ('summary of a week, by recorded_date', visible
+            .filter(recorded_date__in=[(day + timedelta(days=n)).date() for n in range(7)])
+            .values('recorded_date', 'genus', 'species')
+            .annotate(count=Count('id'), total_duration=Sum('duration'))
+            .order_by()),
+    ]
+
+
+def show_queries(years: int, repeat: int):
+    """
+    Print the plan and best time of each query
+    """
+    from django.db import connection  # pylint: disable=C0415
+
+    for name, queryset in benchmark_queries(years):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            # Clone the queryset, so that results aren't cached between runs
+            count = len(list(queryset.all()))
+            timings.append(time.perf_counter() - started)
+        print(f'{name}: {count} rows, {min(timings) * 1000:.1f}ms')
+        for step in plan:
+            print(f'    {step}')
+
+
+def set_indexes(enabled: bool):
+    """
+    Create or drop the indexes being measured
+    """
+    from django.db import connection  # pylint: disable=C0415
+
+    from tracemap.models import AudioRecording  # pylint: disable=C0415
+
+    indexes = [
+        index for index in AudioRecording._meta.indexes  # pylint: disable=W0212
+        if index.name in NEW_INDEXES
+    ]
+    with connection.schema_editor() as schema_editor:
+        for index in indexes:
+            if enabled:
+                schema_editor.add_index(AudioRecording, index)
+            else:
+                schema_editor.remove_index(AudioRecording, index)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=1000000, help='Recordings to create')
+    parser.add_argument('--years', type=int, default=10, help='Years of synthetic data')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing runs of each query')
+    parser.add_argument(
+        '--database', help='SQLite file to use, kept for later runs; by default a temporary file'
+    )
+    args = parser.parse_args()
+
+    database = args.database or os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'batbox.settings')
+    settings.DATABASES['default']['NAME'] = database
+    django.setup()
+
+    from django.core.management import call_command  # pylint: disable=C0415
+
+    from tracemap.models import AudioRecording  # pylint: disable=C0415
+
+    call_command('migrate', verbosity=0)
+    existing = AudioRecording.objects.count()
+    if existing < args.rows:
+        print(f'Creating recordings in {database}')
+        fill_database(args.rows - existing, args.years)
+
+    print(f'\nWithout indexes, {AudioRecording.objects.count()} rows\n')
+    set_indexes(False)
+    show_queries(args.years, args.repeat)
+
+    print('\nWith indexes\n')
+    set_indexes(True)
+    show_queries(args.years, args.repeat)
+
+    if not args.database:
+        os.remove(database)
+
+
+if __name__ == '__main__':
+    main()
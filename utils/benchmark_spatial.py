@@ -0,0 +1,150 @@
+"""
+Benchmark searching recordings by map bounds, with and without the location index
+
+Fills a separate SQLite database with synthetic recordings clustered around survey sites, in
+steps up to the given number of rows. At each step, shows the time to find the recordings in
+boxes of a few sizes, first with only the latitude and longitude filters, which scan the table,
+and then through the R*Tree location index, and checks that both find the same recordings.
+
+Run from the project root:
+
+    python -m utils.benchmark_spatial --rows 3000000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import django
+from django.conf import settings
+
+
+# Half-widths of the boxes searched, in degrees: a site, a town and a region
+BOX_SIZES = [0.01, 0.1, 1.0]
+SITES = 500
+
+
+def site_centres(seed: int = 1):
+    """
+    Survey sites scattered over Great Britain
+    """
+    rng = random.Random(seed)
+    return [(rng.uniform(50.5, 57.5), rng.uniform(-5.0, 1.5)) for _ in range(SITES)]
+
+
+def fill_database(start: int, rows: int, sites, seed: int = 1):
+    """
+    Insert synthetic recordings directly, a batch at a time, as creating model instances for
+    millions of rows would take much longer than the searches being measured
+    """
+    from django.db import connection, transaction  # pylint: disable=C0415
+
+    from tracemap.models import AudioRecording  # pylint: disable=C0415
+
+    rng = random.Random(seed + start)
+    meta = AudioRecording._meta  # pylint: disable=W0212
+    template = AudioRecording()
+    fields = [f for f in meta.concrete_fields if not f.primary_key]
+    defaults = [f.get_db_prep_save(getattr(template, f.attname), connection) for f in fields]
+    positions = {f.attname: n for n, f in enumerate(fields)}
+    columns = ', '.join(connection.ops.quote_name(f.column) for f in fields)
+    sql = f'INSERT INTO {meta.db_table} ({columns}) VALUES ({", ".join(["%s"] * len(fields))})'
+
+    started = time.perf_counter()
+    batch_size = 10000
+    for batch_start in range(start, rows, batch_size):
+        batch = []
+        for number in range(batch_start, min(rows, batch_start + batch_size)):
+            values = list(defaults)
+            latitude, longitude = rng.choice(sites)
+            values[positions['identifier']] = f'REC{number:08d}'
+            values[positions['latitude']] = latitude + rng.gauss(0, 0.005)
+            values[positions['longitude']] = longitude + rng.gauss(0, 0.005)
+            values[positions['hide']] = rng.random() < 0.05
+            batch.append(values)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, batch)
+        print(f'\r{min(rows, batch_start + batch_size)} rows', end='', flush=True)
+    print(f' in {time.perf_counter() - started:.0f}s')
+
+
+def best_time(function, repeat: int):
+    """
+    Run a function repeatedly, giving its last result and its fastest time
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return result, min(timings)
+
+
+def show_searches(centre, repeat: int):
+    """
+    Print the time of each search, with and without the location index
+    """
+    from tracemap.models import AudioRecording  # pylint: disable=C0415
+    from tracemap.spatial import filter_within_bounds  # pylint: disable=C0415
+    from tracemap.views import build_search_filter  # pylint: disable=C0415
+
+    for size in BOX_SIZES:
+        bounds = {
+            'south': str(centre[0] - size),
+            'north': str(centre[0] + size),
+            'west': str(centre[1] - size),
+            'east': str(centre[1] + size),
+        }
+        scanned = AudioRecording.objects.filter(**build_search_filter(bounds))
+        indexed = filter_within_bounds(scanned, bounds)
+        scan_ids, scan_time = best_time(
+            lambda q=scanned: set(q.values_list('id', flat=True)), repeat
+        )
+        index_ids, index_time = best_time(
+            lambda q=indexed: set(q.values_list('id', flat=True)), repeat
+        )
+        if scan_ids != index_ids:
+            raise SystemExit('Results differ')
+        print(f'  ±{size:<5} {len(index_ids):8} found'
+              f'  scan {scan_time * 1000:8.1f}ms  index {index_time * 1000:8.1f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=3000000, help='Recordings to create')
+    parser.add_argument('--steps', type=int, default=4, help='Sizes to measure, up to rows')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing runs of each search')
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'batbox.settings')
+    settings.DATABASES['default']['NAME'] = database
+    django.setup()
+
+    from django.core.management import call_command  # pylint: disable=C0415
+    from django.db import connection  # pylint: disable=C0415
+
+    from tracemap import spatial  # pylint: disable=C0415
+
+    call_command('migrate', verbosity=0)
+    if not spatial.location_index_available(connection):
+        raise SystemExit('SQLite was built without the R*Tree module')
+
+    print(f'Creating recordings in {database}')
+    sites = site_centres()
+    existing = 0
+    for step in range(args.steps, 0, -1):
+        rows = args.rows // 10 ** (step - 1)
+        fill_database(existing, rows, sites)
+        existing = rows
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        show_searches(sites[0], args.repeat)
+        print()
+
+    os.remove(database)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark the daily species summary used by the index page, over synthetic data
+
+Compares tracemap.summary.summarise_day_rows with the previous implementation, which scanned
+every genus for every row and parsed every date, and checks that both give the same result.
+
+Run from the project root:
+
+    python -m utils.benchmark_summary --years 10
+"""
+import argparse
+import random
+import timeit
+from datetime import date, timedelta
+
+from dateutil.parser import parse as parse_date
+
+from tracemap.summary import summarise_day_rows
+
+
+GENERA = {
+    'PIP': ['PIP', 'PYG', 'NAT', 'KUH'],
+    'MYO': ['DAU', 'MYS', 'NAT', 'BRA', 'BEC'],
+    'NYC': ['NOC', 'LEI'],
+    'PLE': ['AUR', 'AUS'],
+    'BAR': ['BAR'],
+    'EPT': ['SER'],
+    'RHI': ['FER', 'HIP'],
+    'NoID': [''],
+}
+
+
+def synthetic_rows(years: int, seed: int = 1):
+    """
+    Grouped counts as returned by the summary query, for recordings on most nights of each
+    year's bat season
+    """
+    rng = random.Random(seed)
+    pairs = [(g, s) for g, species_list in GENERA.items() for s in species_list]
+    rows = []
+    first_day = date(2000, 4, 1)
+    for year in range(years):
+        season_start = first_day.replace(year=first_day.year + year)
+        for offset in range(200):
+            if rng.random() < 0.2:
+                continue
+            day = (season_start + timedelta(days=offset)).isoformat()
+            for genus_abbr, species_abbr in rng.sample(pairs, rng.randint(1, 8)):
+                rows.append({
+                    'day': day,
+                    'genus': genus_abbr,
+                    'species': species_abbr,
+                    'count': rng.randint(1, 200)
+                })
+    rows.append({'day': None, 'genus': 'PIP', 'species': 'PIP', 'count': 3})
+    return rows
+
+
+def legacy_summarise_day_rows(days_by_species):
+    """
+    The previous aggregation loop from views.summarise_by_day, without its species lookups
+    """
+
+    def f_day(date_string):
+        return parse_date(date_string).strftime('%Y-%m-%d') if date_string is not None else None
+
+    unique_days = {f_day(row['day']) for row in days_by_species}
+    unique_genus = {row['genus'] for row in days_by_species}
+
+    days = {
+        day: {'day': day, 'count': 0, 'genus': {g: {} for g in unique_genus}}
+        for day in unique_days
+    }
+
+    genus_species = {g: [] for g in unique_genus}
+
+    for row in days_by_species:
+        day_key = f_day(row['day'])
+        days[day_key]['count'] += row['count']
+        for genus_abbr in unique_genus:
+            if row['genus'] == genus_abbr:
+                days[day_key]['genus'][genus_abbr][row['species']] = row['count']
+                genus_species[genus_abbr].append(row['species'])
+
+    return days, {g: sorted(set(s)) for g, s in genus_species.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--years', type=int, default=10, help='Years of synthetic data')
+    parser.add_argument('--repeat', type=int, default=5, help='Timing runs of each version')
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.years)
+    print(f'{len(rows)} grouped rows over {args.years} years')
+
+    legacy = legacy_summarise_day_rows(rows)
+    current = summarise_day_rows(rows)
+    if legacy != current:
+        raise SystemExit('Results differ')
+
+    for name, function in (
+            ('previous', legacy_summarise_day_rows),
+            ('single pass', summarise_day_rows),
+    ):
+        best = min(timeit.repeat(lambda f=function: f(rows), number=1, repeat=args.repeat))
+        print(f'{name:<12} {best * 1000:8.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -161,19 +161,31 @@ class WamdFile:
             if not wamd_chunk:
                 raise ValueError('No wamd data chunk found')
 
-            metadata = {}
-            offset = 0
-            size = wamd_chunk.getsize()
-            buf = wamd_chunk.read(size)
-            while offset < size:
-                id = struct.unpack_from('< H', buf, offset)[0]
-                len = struct.unpack_from('< I', buf, offset + 2)[0]
-                val = struct.unpack_from('< %ds' % len, buf, offset + 6)[0]
-                if id not in WamdFile.WAMD_DROP_IDS:
-                    name = WamdFile.WAMD_IDS.get(id, id)
-                    val = WamdFile.WAMD_COERCE.get(name, WamdFile._parse_text)(val)
-                    metadata[name] = val
-                offset += 6 + len
-            self.metadata = metadata
+            self.metadata = WamdFile._parse_wamd_chunk(wamd_chunk.read(wamd_chunk.getsize()))
 
         self.initialised = True
+
+    @staticmethod
+    def _parse_wamd_chunk(buf: bytes) -> dict:
+        """Parse the contents of a wamd chunk into a dict"""
+        metadata = {}
+        offset = 0
+        size = len(buf)
+        while offset < size:
+            id = struct.unpack_from('< H', buf, offset)[0]
+            length = struct.unpack_from('< I', buf, offset + 2)[0]
+            val = struct.unpack_from('< %ds' % length, buf, offset + 6)[0]
+            if id not in WamdFile.WAMD_DROP_IDS:
+                name = WamdFile.WAMD_IDS.get(id, id)
+                val = WamdFile.WAMD_COERCE.get(name, WamdFile._parse_text)(val)
+                metadata[name] = val
+            offset += 6 + length
+        return metadata
+
+    @classmethod
+    def from_chunk_data(cls, filename: str, buf: bytes) -> 'WamdFile':
+        """Create a WamdFile from the contents of a wamd chunk that has already been read"""
+        wamd_file = cls(filename)
+        wamd_file.metadata = cls._parse_wamd_chunk(buf)
+        wamd_file.initialised = True
+        return wamd_file